@@ -4,15 +4,21 @@
 #SBATCH -t 48:00:00
 #SBATCH -p RM-shared
 
+# Page staging (stage_pages and check_staged_pages)
+# NOTE: sbatch runs a copy of this script, so the file is found in the directory it was submitted from
+QA_SCRIPT_DIRECTORY="$(dirname "${BASH_SOURCE[0]}")"
+[ -f "$QA_SCRIPT_DIRECTORY/../qa_staging.sh" ] || QA_SCRIPT_DIRECTORY="$SLURM_SUBMIT_DIR"
+source "$QA_SCRIPT_DIRECTORY/../qa_staging.sh"
+
 echo "Preparing for Eynollah line extraction on $1 ..."
 
 # 1. Make required subdirectories in the book folder
 cd "$1"
 mkdir pages pages_color lines lines_color eynollah_output eynollah_output/extracted_images eynollah_output/pagexml
 
-# 2. Copy original book page images to 'pages' and 'pages_color' subdirectories
-cp *.tif pages/
-cp *.tif pages_color/
+# 2. Stage original book page images in 'pages' and 'pages_color' subdirectories
+stage_pages pages *.tif
+stage_pages pages_color *.tif
 
 # 3. Load the conda environment for eynollah
 echo "Loading conda environment..."
@@ -42,3 +48,9 @@ date
 
 conda deactivate
 
+# 5. Line extraction may only read staged pages that share the originals' data
+if ! check_staged_pages; then
+  echo "Line extraction wrote to original page images through their staged links."
+  exit 1
+fi
+
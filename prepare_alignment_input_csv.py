@@ -7,7 +7,9 @@ threshold in the character bbox, and dump this and other relevant
 alignment input info to a csv.
 """
 import csv
+import hashlib
 import io
+import os
 import tarfile
 from PIL import Image
 import io
@@ -110,6 +112,86 @@ def binarize_img(im, window_size=25):
     return Image.fromarray(im_bw > t), t
 
 
+def binarization_cache_key(img_path, window_size=25):
+    """ Returns a short key identifying one Sauvola binarization of the file at img_path.
+    The key changes whenever the file's path, size or modification time or the window size changes
+    :param img_path: path to the image file
+    """
+    stat = os.stat(img_path)
+    key = f'{os.path.abspath(img_path)}|{stat.st_size}|{stat.st_mtime_ns}|{window_size}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def binarize_img_cached(img_path, cache_dir, window_size=25, im=None):
+    """ Returns the Sauvola binarization of the image at img_path as a boolean numpy array (HxW).
+    Binarizations are kept bit-packed in cache_dir and reused while the image file is unchanged
+    :param img_path: path to the image file
+    :param cache_dir: directory holding the cached binarizations
+    :param im: optional PIL Image of img_path, if it has already been opened
+    """
+    cache_dir = Path(cache_dir)
+    img_stem = Path(img_path).stem
+    cache_path = cache_dir/f'{img_stem}_w{window_size}_{binarization_cache_key(img_path, window_size)}.npz'
+
+    # reuse the cached binarization if there is one for this version of the file
+    if cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                return np.unpackbits(cached['bits'], axis=1, count=int(cached['width'])).astype(bool)
+        except (OSError, ValueError, KeyError) as e:
+            print(cache_path, 'could not be read, binarizing again:', e)
+
+    if im is None:
+        im = Image.open(img_path)
+    bin_mtx = np.asarray(binarize_img(im, window_size=window_size)[0])
+
+    # replace any stale binarizations of this image with the new one (written atomically, as
+    # several jobs may share a book's cache)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    for stale_path in cache_dir.glob(f'{img_stem}_w{window_size}_' + '?' * 16 + '.npz'):
+        stale_path.unlink(missing_ok=True)
+    tmp_path = cache_path.with_name(f'{cache_path.stem}.{os.getpid()}.tmp.npz')
+    np.savez_compressed(tmp_path, bits=np.packbits(bin_mtx, axis=1), width=bin_mtx.shape[1])
+    os.replace(tmp_path, cache_path)
+
+    return bin_mtx
+
+
+def bbox_mean_thresholds(thresholds, bboxes):
+    """ Returns the mean of the thresholds in each bbox, as np.mean(thresholds[t:b, l:r]) would give it.
+    All of the means are gathered at once from a summed-area table of the thresholds
+    :param thresholds: thresholds (of size HxW), e.g. from binarize_img
+    :param bboxes: bboxes (of size Nx4) as (l, t, r, b), negative coordinates taken as 0
+
+    :returns: means (of size N, NaN for bboxes with no thresholds in them), sizes (of size N, number of thresholds in each bbox)
+    """
+    height, width = thresholds.shape
+    bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+    l = np.clip(bboxes[:, 0], 0, width)
+    t = np.clip(bboxes[:, 1], 0, height)
+    r = np.clip(bboxes[:, 2], 0, width)
+    b = np.clip(bboxes[:, 3], 0, height)
+    sizes = np.maximum(b - t, 0) * np.maximum(r - l, 0)
+
+    # summed-area tables (with a row and column of zeros before the first) of the thresholds and of
+    # where they are NaN, so that a bbox with any NaN thresholds still has a NaN mean. The thresholds
+    # are summed less their overall mean, which keeps the sums small enough to hold their precision
+    nan_thresholds = np.isnan(thresholds)
+    offset = float(np.mean(thresholds[~nan_thresholds])) if not nan_thresholds.all() else 0.0
+    threshold_sums = np.zeros((height + 1, width + 1))
+    threshold_sums[1:, 1:] = np.where(nan_thresholds, 0, thresholds - offset).cumsum(axis=0).cumsum(axis=1)
+    nan_counts = np.zeros((height + 1, width + 1), dtype=np.int64)
+    nan_counts[1:, 1:] = nan_thresholds.cumsum(axis=0).cumsum(axis=1)
+
+    def bbox_totals(table):
+        return table[b, r] - table[t, r] - table[b, l] + table[t, l]
+
+    means = np.full(len(bboxes), np.nan)
+    filled = (sizes > 0) & (bbox_totals(nan_counts) == 0)
+    means[filled] = bbox_totals(threshold_sums)[filled] / sizes[filled] + offset
+    return means, sizes
+
+
 def extract_char_bboxes_by_page_from_json(json_dict):
     bboxes_by_page = defaultdict(list)
     # split out characters by page
@@ -220,20 +302,18 @@ if __name__ == '__main__':
                 pagenum = page_img_path.with_suffix('').name.split('-')[-1]
             
             print('Page', pagenum, 'found', len(char_bboxes_by_page[pagenum]), 'char bboxes.')
-            # then, crop each char bbox on this page and save it to disk
-            for char_bbox, char_filename, char_logprob in char_bboxes_by_page[pagenum]:
+            # then, find the mean threshold of every char bbox on this page at once
+            char_mean_thresholds, char_bbox_sizes = bbox_mean_thresholds(
+                local_thresholds, [char_bbox for char_bbox, _, _ in char_bboxes_by_page[pagenum]])
+            # and save a row for each char bbox on this page
+            for (char_bbox, char_filename, char_logprob), char_mean_threshold, char_bbox_size in \
+                zip(char_bboxes_by_page[pagenum], char_mean_thresholds.tolist(), char_bbox_sizes.tolist()):
                 #if char_filename.endswith('uc.tif'):  # NOTE: only use uppercase chars
                 if Path(char_filename).name not in book_char_images_filenames:
                     print(f'Skipping character because {Path(char_filename).name} not in tar file list (file name list printed above).')
                     continue
-                l, t, r, b = char_bbox
-                l = max(0, l)
-                t = max(0, t)
-                r = max(0, r)
-                b = max(0, b)
                 
-                char_bbox_thresholds = local_thresholds[t:b, l:r]
-                if 0 in char_bbox_thresholds.shape:
+                if 0 == char_bbox_size:
                     # skip characters with bad bounding boxes
                     print('Skipping bad bbox.')
                     continue
@@ -264,9 +344,9 @@ if __name__ == '__main__':
                         'book_char_tar_filepath': str(tarfile_path), 
                         'char_filepath_in_tar': str(char_filename),  # str(color_char_crop_img_dest), 
                         'char_ocular_logprob': float(char_logprob), 
-                        'char_mean_bin_threshold': float(np.mean(char_bbox_thresholds))
+                        'char_mean_bin_threshold': float(char_mean_threshold)
                 }
-                if str(float(np.mean(char_bbox_thresholds))) == 'nan':
+                if str(float(char_mean_threshold)) == 'nan':
                     print('nan encountered at row:')
                     print(row)
                     continue
@@ -40,6 +40,10 @@ def handle_args():
         "--collate",
         action="store_true",
         help="Gather all results from cropping runs over books listed in config book directory")
+    parser.add_argument(
+        "--commands",
+        nargs="+",
+        help="QA commands to run in place of those listed in the config file (e.g. for a command submitted as a dependent job)")
     parser.add_argument(
         "--config_file",
         help="Path to a yaml configuration file for your QA run")
@@ -85,6 +89,10 @@ def handle_args():
         elif not os.path.isdir(args.book_directory):
             print("Book directory: {0} is not a directory.".format(args.book_directory))
             success = False
+        # NOTE: Single book runs may also be given a config file for its optional settings
+        if args.config_file and not os.path.isfile(args.config_file):
+            print("Config file: {0} is not a file.".format(args.config_file))
+            success = False
     elif args.config_file:
         if not os.path.exists(args.config_file):
             print("Config file: {0} does not exist.".format(args.config_file))
@@ -105,28 +113,45 @@ def handle_args():
 
 def run_commands(p_args):
 
-    # Special case to call results collation functionality - done when all results have completed
-    # NOTE: Possible candidate for removal when QA modules are linked up for end to end processing
-    if p_args.collate:
-        qa_module.call_command("collate")
-        return
-
     # 0. Load up the QA class module from config and instantiate a copy of it
     module_name, class_name = QA_TYPE_CLASSES[qa_config[QA_TYPE]]
     qa_module = str_to_class(module_name, class_name)(qa_config)
+    if os.path.isdir(qa_config[OUTPUT_DIRECTORY]):
+        qa_module.run_catalog.add_run(qa_config[RUN_UUID], qa_config[QA_TYPE])
+
+    # NOTE: Whatever clear commands moved to the trash finishes being deleted once the commands are done
+    # (deleting it can overlap the commands after them), however they end
+    try:
+
+        # Special case to call results collation functionality - done when all results have completed
+        # NOTE: Possible candidate for removal when QA modules are linked up for end to end processing
+        if p_args.collate:
+            qa_module.call_command("collate")
+            return
+
+        # 1. Run QA commands in the sequence listed in the loaded config
+        # (or move each book through them on its own with the streaming pipeline)
+        if qa_config[STREAMING_PIPELINE] and RUN_TYPE_MULTI == qa_config[RUN_TYPE]:
+            qa_module.run_pipeline()
+            return
+        for cmd in qa_config[COMMANDS]:
+            qa_module.call_command(cmd)
+    finally:
 
-    # 1. Run QA commands in the sequence listed in the loaded config
-    for cmd in qa_config[COMMANDS]:
-        qa_module.call_command(cmd)
+        # 2. Finish deleting whatever clear commands moved to the trash
+        qa_module.trash.wait()
         
 def save_config(p_args):
 
     success = True
     config_required_fields = [BOOK_DIRECTORY]
+    config_yaml = {}
 
     # 1. Save default config values
     qa_config[COMMANDS]=[COMMAND_RUN]
     qa_config[OUTPUT_DIRECTORY] = DEFAULT_OUTPUT_DIRECTORY
+    for key in OPTIONAL_CONFIG_DEFAULTS:
+        qa_config[key] = OPTIONAL_CONFIG_DEFAULTS[key]
 
     # 2. Save optional config values if given
     if p_args.output_directory:
@@ -145,14 +170,20 @@ def save_config(p_args):
         if not directory_has_files_of_type(qa_config[BOOK_DIRECTORY], ".tif"):
             print("Could not find any tif images in the book directory: {0}.".format(qa_config[BOOK_DIRECTORY]))
             success = False
+
+        # B. Save optional config values from a config file if one was given (e.g. by a multi-book run)
+        if p_args.config_file:
+            config_yaml = read_config_file(p_args.config_file)
+            qa_config[CONFIG_FILE] = os.path.abspath(p_args.config_file)
+            save_optional_config_values(config_yaml)
     else:
 
         qa_config[RUN_TYPE] = RUN_TYPE_MULTI
         qa_config[QA_TYPE] = p_args.qa_function
 
         # A. Read in config yaml file and save its fields
-        with open(p_args.config_file, "r") as config_file:
-            config_yaml = yaml.safe_load(config_file)
+        config_yaml = read_config_file(p_args.config_file)
+        qa_config[CONFIG_FILE] = os.path.abspath(p_args.config_file)
         if BOOK_DIRECTORY in config_yaml:
             qa_config[BOOK_DIRECTORY] = format_path(config_yaml[BOOK_DIRECTORY])
         if COMMANDS in config_yaml:
@@ -162,6 +193,7 @@ def save_config(p_args):
         # NOTE: RUN_TYPE can also be 'single' here to indicate a single book run that is using a config file
         if RUN_TYPE in config_yaml:
             qa_config[RUN_TYPE] = config_yaml[RUN_TYPE]
+        save_optional_config_values(config_yaml)
 
         # B. Check contents of config file
         if not all(cmd in config_yaml.keys() for cmd in config_required_fields):
@@ -176,6 +208,26 @@ def save_config(p_args):
             success = False
 
     # 4. Check config elements common to both single and multi-book runs
+    if p_args.commands:
+        qa_config[COMMANDS] = p_args.commands
+        for cmd in qa_config[COMMANDS]:
+            if cmd not in VALID_COMMANDS:
+                print("{0} is an invalid command. Valid commands: {1}".format(cmd, VALID_COMMANDS))
+                success = False
+    if qa_config[AUTOCROP_COMPARISON_MODE] not in VALID_COMPARISON_MODES:
+        print("{0} is an invalid autocrop comparison mode. Valid modes: {1}".format(
+            qa_config[AUTOCROP_COMPARISON_MODE], VALID_COMPARISON_MODES))
+        success = False
+    if qa_config[EXECUTOR] not in VALID_EXECUTORS:
+        print("{0} is an invalid executor. Valid executors: {1}".format(qa_config[EXECUTOR], VALID_EXECUTORS))
+        success = False
+    if qa_config[PAGE_STAGING] not in VALID_STAGING_MODES:
+        print("{0} is an invalid page staging mode. Valid modes: {1}".format(qa_config[PAGE_STAGING], VALID_STAGING_MODES))
+        success = False
+    if qa_config[SLURM_PACKING] not in VALID_PACKING_MODES:
+        print("{0} is an invalid slurm packing mode. Valid modes: {1}".format(
+            qa_config[SLURM_PACKING], VALID_PACKING_MODES))
+        success = False
     if not os.path.exists(qa_config[BOOK_DIRECTORY]):
         print("Book directory: {0} does not exist.".format(qa_config[BOOK_DIRECTORY]))
         success = False
@@ -196,7 +248,7 @@ def save_config(p_args):
     elif RUN_UUID in config_yaml:
         qa_config[RUN_UUID] = config_yaml[RUN_UUID]
     else:
-        qa_config[RUN_UUID] = get_unique_uuid(qa_config[OUTPUT_DIRECTORY], MERGED_RESULTS_FILENAME_PREFIX + "*")
+        qa_config[RUN_UUID] = get_unique_uuid(qa_config[OUTPUT_DIRECTORY])
 
     # Temp
     if ERROR_FILE_RUN_UUID in config_yaml:
@@ -204,6 +256,19 @@ def save_config(p_args):
 
     return success
 
+def read_config_file(p_config_filepath):
+
+    with open(p_config_filepath, "r") as config_file:
+        config_yaml = yaml.safe_load(config_file)
+
+    return config_yaml if config_yaml else {}
+
+def save_optional_config_values(p_config_yaml):
+
+    for key in OPTIONAL_CONFIG_DEFAULTS:
+        if key in p_config_yaml:
+            qa_config[key] = p_config_yaml[key]
+
 def main():
 
     # 1. Handle args given to this script
@@ -5,12 +5,15 @@
 # Imports
 
 # Built-ins
+import contextlib
 import csv
 import glob
 import os
 import shutil
 import sys
 import traceback
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 # Third party
@@ -40,6 +43,19 @@ ERRORS_FILE_PREFIX = "autocrop_errors"
 MASTER_LOG_FILENAME_PREFIX = "qa_slurm"
 MERGED_RESULTS_FILENAME_PREFIX = "autocrop_all_results_merged"
 STATS_FILE_PREFIX = "autocrop_results"
+STATS_FILE_IMAGE_COLUMNS = [
+    "image_width",
+    "image_height",
+    "min_pct_dimension_difference",
+    "image_area",
+    "area_diff_from_original",
+    "percent_area_diff_from_original",
+    "frobenius_norm_from_original",
+    "error"
+]
+STATS_FILE_HEADER = ["book_name", "total_page_count", "autocrop_type", "image_name"] + STATS_FILE_IMAGE_COLUMNS
+# Most pages whose rows are held before they are written to the stats files (when not streaming them)
+STATS_CHECKPOINT_PAGES = 50
 
 
 # sbatch parameters
@@ -59,6 +75,8 @@ class QA_Autocrop(QA_Module):
 
         super().__init__(p_config)
         self.slurm_job_results = []
+        self.pipeline_collated_books = []
+        self.pipeline_merged_results_reset = False
 
         print("Exiting QA_Autocrop.__init__")
 
@@ -70,11 +88,9 @@ class QA_Autocrop(QA_Module):
         if not os.path.exists(self.config[OUTPUT_DIRECTORY] + ARCHIVE_DIRECTORY):
             os.makedirs(self.config[OUTPUT_DIRECTORY] + ARCHIVE_DIRECTORY)
 
-        # 1. Move each item (that's not the archive folder or master log for this run) into the archive folder
-        for item in get_items_in_dir(self.config[OUTPUT_DIRECTORY], ["directories", "files"]):
-            if ARCHIVE_DIRECTORY != item and MASTER_LOG_FILENAME_PREFIX not in item and ".gitignore" != item:
-                os.rename(self.config[OUTPUT_DIRECTORY] + item,
-                    "{0}archive{1}{2}".format(self.config[OUTPUT_DIRECTORY], os.sep, item))
+        # 1. Archive each item (that's not the archive folder or master log for this run)
+        self.archive_output_items([item for item in get_items_in_dir(self.config[OUTPUT_DIRECTORY], ["directories", "files"]) \
+            if ARCHIVE_DIRECTORY != item and MASTER_LOG_FILENAME_PREFIX not in item and ".gitignore" != item and RUN_CATALOG_FILENAME != item])
         
         print("Exiting QA_Autocrop.archive_logs")
 
@@ -97,15 +113,13 @@ class QA_Autocrop(QA_Module):
         print("Entering QA_Autocrop.clear_results")
 
         if RUN_TYPE_MULTI == self.config[RUN_TYPE]:
-            for book_directory in get_items_in_dir(format_path(self.config[BOOK_DIRECTORY]), ["directories"]):
+            for book_directory in self.directory_snapshot.get_book_names():
                 full_bookpath = format_path(self.config[BOOK_DIRECTORY] + book_directory)
-                if os.path.exists(full_bookpath + RESULTS_DIRECTORY):
-                    shutil.rmtree(full_bookpath + RESULTS_DIRECTORY, ignore_errors=True)
-                    wait_while_exists(full_bookpath + RESULTS_DIRECTORY)
+                if self.directory_snapshot.has_directory(full_bookpath, RESULTS_DIRECTORY):
+                    self.trash.delete(full_bookpath + RESULTS_DIRECTORY)
+            self.directory_snapshot.invalidate()
         elif RUN_TYPE_SINGLE == self.config[RUN_TYPE]:
-            if os.path.exists(self.config[BOOK_DIRECTORY] + RESULTS_DIRECTORY):
-                shutil.rmtree(self.config[BOOK_DIRECTORY] + RESULTS_DIRECTORY, ignore_errors=True)
-                wait_while_exists(self.config[BOOK_DIRECTORY] + RESULTS_DIRECTORY)
+            self.trash.delete(self.config[BOOK_DIRECTORY] + RESULTS_DIRECTORY)
 
         print("Exiting QA_Autocrop.clear_results")
 
@@ -176,6 +190,7 @@ class QA_Autocrop(QA_Module):
                                 error_type,
                                 errors_by_book[book_name][error_type][index][2]
                             ])
+        self.record_artifact("{0}{1}_{2}.csv".format(self.config[OUTPUT_DIRECTORY], ERRORS_FILE_PREFIX, self.config[RUN_UUID]), "", ARTIFACT_ERRORS)
 
         print("Exiting QA_Autocrop.collate_errors")
 
@@ -187,7 +202,7 @@ class QA_Autocrop(QA_Module):
             self.__collate_results_on_book(self.config[BOOK_DIRECTORY] + RESULTS_DIRECTORY + os.sep)
         elif RUN_TYPE_MULTI == self.config[RUN_TYPE]:
             # 1. Created merged autocrop results for each book in the book directory
-            for book_directory in get_items_in_dir(format_path(self.config[BOOK_DIRECTORY]), ["directories"]):
+            for book_directory in self.directory_snapshot.get_book_names():
 
                 full_bookpath = format_path(self.config[BOOK_DIRECTORY] + book_directory)
 
@@ -212,22 +227,24 @@ class QA_Autocrop(QA_Module):
 
         print("Entering QA_Autocrop.__collate_all_book_results")
 
-        with open(self.config[OUTPUT_DIRECTORY] + "{0}_{1}.csv".format(MERGED_RESULTS_FILENAME_PREFIX, self.config[RUN_UUID]), "w") as output_file:
+        merged_results_filepath = self.config[OUTPUT_DIRECTORY] + "{0}_{1}.csv".format(MERGED_RESULTS_FILENAME_PREFIX, self.config[RUN_UUID])
+        with open(merged_results_filepath, "w") as output_file:
             
             # 1. Read in collated results for each book and write them to the merged file
             header_written = False
-            for book_directory in get_items_in_dir(format_path(self.config[BOOK_DIRECTORY]), ["directories"]):
+            for book_directory in self.directory_snapshot.get_book_names():
 
-                # A. Get the latest collated csv file
+                # A. Get this run's collated csv file from the run catalog
+                # (or the latest one in the book's results directory if the catalog doesn't have it)
                 results_directory = format_path(self.config[BOOK_DIRECTORY] + book_directory + os.sep + RESULTS_DIRECTORY)
-                csv_filepaths = []
-                for filepath in glob.glob(results_directory + "merged_*.csv"):
-                    csv_filepaths.append((filepath, os.path.getctime(filepath)))
+                csv_filepaths = self.run_catalog.find_artifacts(self.config[RUN_UUID], book_directory, ARTIFACT_BOOK_RESULTS)
+                if not csv_filepaths:
+                    csv_filepaths = [filepath for filepath, ctime in sorted([(filepath, os.path.getctime(filepath)) \
+                        for filepath in glob.glob(results_directory + "merged_*.csv")], key=lambda filepath: filepath[1], reverse=True)]
                 if 0 == len(csv_filepaths):
                     print("No collated csv file found for {0}.".format(book_directory))
                     continue
-                sorted_csv_filepaths = sorted(csv_filepaths, key=lambda filepath: filepath[1], reverse=True)
-                latest_merged_filepath = sorted_csv_filepaths[0][0]
+                latest_merged_filepath = csv_filepaths[0]
 
                 # B. Save the csv file contents to the merged file
                 with open(latest_merged_filepath, "r") as input_file:
@@ -235,6 +252,7 @@ class QA_Autocrop(QA_Module):
                     # Add the lines from this collated csv file (skipping the header if already written) to the all results csv file
                     output_file.writelines(input_file.readlines()[1:] if header_written else input_file.readlines())
                     header_written = True
+        self.record_artifact(merged_results_filepath, "", ARTIFACT_RUN_RESULTS)
         
         print("Exiting QA_Autocrop.__collate_all_book_results")
 
@@ -242,13 +260,16 @@ class QA_Autocrop(QA_Module):
 
         print("Entering QA_Autocrop.__collate_results_on_book")
 
-        # 1. Get two most recent csv files for autocropping in the results directory (ignoring other collation csvs)
-        csv_filepaths = [(filepath, os.path.getctime(filepath)) \
-            for filepath in glob.glob(p_results_directory + "*.csv") if "merged_" not in filepath]
+        # 1. Get this run's stats csv files for autocropping from the run catalog (or, if the catalog doesn't
+        # have them, the two most recent csv files in the results directory, ignoring other collation csvs)
+        book_name = Path(p_results_directory).parent.name
+        csv_filepaths = self.run_catalog.find_artifacts(self.config[RUN_UUID], book_name, ARTIFACT_STATS)
+        if len(csv_filepaths) < 2:
+            csv_filepaths = [filepath for filepath, ctime in sorted([(filepath, os.path.getctime(filepath)) \
+                for filepath in glob.glob(p_results_directory + "*.csv") if "merged_" not in filepath], key=lambda filepath: filepath[1], reverse=True)]
         if len(csv_filepaths) < 2:
             raise Exception("Less than two csv files in the results directory: {0}".format(p_results_directory))
-        sorted_csv_filepaths = sorted(csv_filepaths, key=lambda filepath: filepath[1], reverse=True)
-        results_filepath1, results_filepath2 = sorted_csv_filepaths[0][0], sorted_csv_filepaths[1][0]
+        results_filepath1, results_filepath2 = csv_filepaths[0], csv_filepaths[1]
 
         # 2. Merge results file rows
         with open(results_filepath1, "r") as results_file1:
@@ -275,7 +296,8 @@ class QA_Autocrop(QA_Module):
 
         # 3. Write results into one csv file in the results directory
         print("Writing merged results for results dir: {0}".format(p_results_directory))
-        with open(p_results_directory + "merged_results_{0}.csv".format(self.config[RUN_UUID]), "w") as output_file:
+        book_results_filepath = p_results_directory + "merged_results_{0}.csv".format(self.config[RUN_UUID])
+        with open(book_results_filepath, "w") as output_file:
             csv_writer = csv.writer(output_file)
 
             csv_writer.writerow([
@@ -308,9 +330,16 @@ class QA_Autocrop(QA_Module):
                     row["frobenius_norm_from_original"],
                     row["error"]
                 ])
+        self.record_artifact(book_results_filepath, book_name, ARTIFACT_BOOK_RESULTS)
         
         print("Exiting QA_Autocrop.__collate_results_on_book")
 
+    def is_job_command(self, p_command_name):
+
+        # Multi-book stats are output by a job per book
+        return COMMAND_RUN == p_command_name or \
+            (COMMAND_OUTPUT_STATS == p_command_name and RUN_TYPE_MULTI == self.config[RUN_TYPE])
+
     def is_method_finished(self, p_book_directory):
 
         print("Entering QA_Autocrop.is_method_finished")
@@ -338,6 +367,60 @@ class QA_Autocrop(QA_Module):
             os.path.exists(results_folder + "error_{0}_{1}_{2}.txt".format(Path(p_book_directory).name, autocrop_type, self.config[RUN_UUID])) \
             for autocrop_type in AUTOCROP_TYPES])
 
+    # Streaming pipeline methods
+
+    def finish_pipeline(self):
+
+        print("Entering QA_Autocrop.finish_pipeline")
+
+        # Errors are collated from the run level merged results that books were added to as they were collated
+        # (which never get written if every book's collation failed)
+        if len(self.pipeline_collated_books):
+            self.collate_logs()
+            if os.path.exists(self.config[OUTPUT_DIRECTORY] + "{0}_{1}.csv".format(MERGED_RESULTS_FILENAME_PREFIX, self.config[RUN_UUID])):
+                self.collate_errors()
+
+        print("Exiting QA_Autocrop.finish_pipeline")
+
+    @property
+    def pipeline_book_stages(self):
+        return [COMMAND_RUN, COMMAND_OUTPUT_STATS, COMMAND_COLLATE]
+
+    def start_book_stage(self, p_command_name, p_book_directory):
+
+        print("Entering QA_Autocrop.start_book_stage for {0} on {1}".format(p_command_name, p_book_directory))
+
+        book_name = Path(p_book_directory).name
+        stage_jobs, sbatch_directives = [], None
+
+        # 1. Cropping and stats are done by jobs
+        if COMMAND_RUN == p_command_name:
+            stage_jobs, sbatch_directives = self.__get_autocrop_jobs(p_book_directory), self.__get_autocrop_sbatch_directives()
+        elif COMMAND_OUTPUT_STATS == p_command_name:
+            stage_jobs, sbatch_directives = [self.__get_output_stats_job(book_name)], self.__get_stats_sbatch_directives()
+
+        # 2. Collation merges the book's results here, then adds them to the run's merged results
+        # (which are started over by the first book collated). Only books whose collation succeeded are recorded.
+        elif COMMAND_COLLATE == p_command_name:
+            merged_results_filepath = self.config[OUTPUT_DIRECTORY] + "{0}_{1}.csv".format(MERGED_RESULTS_FILENAME_PREFIX, self.config[RUN_UUID])
+            if not self.pipeline_merged_results_reset:
+                if os.path.exists(merged_results_filepath):
+                    os.unlink(merged_results_filepath)
+                self.pipeline_merged_results_reset = True
+            try:
+                self.__collate_results_on_book(p_book_directory + RESULTS_DIRECTORY + os.sep)
+                append_csv_file(p_book_directory + RESULTS_DIRECTORY + os.sep + "merged_results_{0}.csv".format(self.config[RUN_UUID]),
+                    merged_results_filepath)
+                self.record_artifact(merged_results_filepath, "", ARTIFACT_RUN_RESULTS)
+                self.pipeline_collated_books.append(book_name)
+            except Exception as e:
+                print("Collation of results for book {0} has failed.".format(book_name))
+                traceback.print_exc(file=sys.stdout)
+
+        print("Exiting QA_Autocrop.start_book_stage")
+
+        return stage_jobs, sbatch_directives
+
     def run(self):
 
         print("Entering QA_Autocrop.run")
@@ -363,11 +446,24 @@ class QA_Autocrop(QA_Module):
 
     def __run_autocrop_on_all_books(self):
 
-        print("Entering/exiting QA_Autocrop.__run_autocrop_on_all_books")
+        print("Entering QA_Autocrop.__run_autocrop_on_all_books")
+
+        # 1. Gather the cropping jobs for every book
+        autocrop_jobs = []
+        for book_name in self.directory_snapshot.get_book_names():
+            if RESULTS_DIRECTORY != book_name:
+                autocrop_jobs.extend(self.__get_autocrop_jobs(format_path(self.config[BOOK_DIRECTORY] + book_name)))
 
-        return [ self.__run_autocrop_on_book(format_path(self.config[BOOK_DIRECTORY] + book_name)) \
-            for book_name in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]) \
-            if RESULTS_DIRECTORY != book_name ]
+        # 2. Submit them together (as one job array, unless job arrays are turned off)
+        slurm_results = self.submit_jobs(autocrop_jobs, self.__get_autocrop_sbatch_directives(),
+            "autocrop_{0}".format(self.config[RUN_UUID]))
+
+        print("Exiting QA_Autocrop.__run_autocrop_on_all_books")
+
+        return slurm_results
+
+    def _Base__run_on_book(self, p_book_directory):
+        return self.__run_autocrop_on_book(p_book_directory)
 
     def __run_autocrop_on_book(self, p_book_directory):
 
@@ -376,39 +472,35 @@ class QA_Autocrop(QA_Module):
         # 1. Start a process to test autocropping methods on this book
         book_name = Path(p_book_directory).name
 
-        # 2. Path for error output will be in the top level results directory
+        # 2. Spin up a slurm job to crop with each possible cropping type on this book
+        slurm_results = self.submit_jobs(self.__get_autocrop_jobs(p_book_directory), self.__get_autocrop_sbatch_directives(),
+            "autocrop_{0}_{1}".format(book_name, self.config[RUN_UUID]))
+
+        # NOTE: Stats for this book are output by a job of their own once these have finished
+        # when dependency chaining is on (see SLURM_DEPENDENCY_CHAINING)
+
+        print("Exiting QA_Autocrop.__run_autocrop_on_book")
+        
+        return slurm_results
+
+    def __get_autocrop_jobs(self, p_book_directory):
+
+        # 1. Book name and path for error output (which will be in the top level results directory)
+        book_name = Path(p_book_directory).name
         error_path = "{0}results{1}".format(format_path(str(p_book_directory)), os.sep)
 
-        # 3. Spin up a slurm job to crop with each possible cropping type on this book
-        slurm_results = []
-        autocrop_job_names = []
+        # 2. A job to crop the book with each possible cropping type
+        autocrop_jobs = []
         for autocrop_type in AUTOCROP_TYPES:
 
             # A. Determine output path for cropped images and create it if it does not exist
             output_path = "{0}results{1}{2}{1}".format(format_path(str(p_book_directory)), os.sep, autocrop_type)
             if not os.path.exists(output_path):
-                os.makedirs(output_path)             
-        
-            print("Creating slurm job for QA of cropping {0} with autocrop type {1}".format(book_name, autocrop_type))
-
-            # B. Run auto_crop.py on the book with the given arguments
+                os.makedirs(output_path)
 
-            # I. Save the job ID for outputting stats on autocrop runs afterward
-            job_name = "{0}_{1}_{2}".format(book_name, autocrop_type, self.config[RUN_UUID])
-            autocrop_job_names.append(job_name)
-
-            # II. sbatch arguments
-            sbatch_directives = {
-                
-                "-c": SBATCH_NUMBER_CPUS,
-                "-J": job_name,
-                "--mem-per-cpu": SBATCH_MEMORY_PER_CPU,
-                "-o": "{0}slurm-{1}_{2}_{3}.out".format(self.config[OUTPUT_DIRECTORY], book_name, autocrop_type, self.config[RUN_UUID]),
-                "-p": SBATCH_PARTITION,
-                "-t": SBATCH_TIME
-            }
+            print("Creating slurm job for QA of cropping {0} with autocrop type {1}".format(book_name, autocrop_type))
 
-            # III. autocrop.py arguments
+            # B. autocrop.py arguments
             autocrop_args = [
 
                 AUTOCROP_SCRIPT_LOCATION,
@@ -422,69 +514,28 @@ class QA_Autocrop(QA_Module):
                 autocrop_args.append("--threshold_by_inside")
             autocrop_args.append("*.tif")
 
-            # IV. Build the sbatch call
-            subprocess_args = ""
-            for arg in sbatch_directives:
-                subprocess_args += " {0} {1}".format(arg, sbatch_directives[arg])
-            subprocess_args += " " + "qa_autocrop_new.sh"
-            for arg in autocrop_args:
-                subprocess_args += " " + arg
-            subprocess_cmd = "sbatch " + subprocess_args
-
-            # print("subprocess.run(sbatch {0}, capture_output=True, text=True, shell=True)".format(subprocess_args))
-            print("subprocess.Popen({0} shell=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)".format(subprocess_cmd))
-
-            # V. Run sbatch and save results
-            # slurm_results.append(subprocess.run(subprocess_cmd, capture_output=True, text=True, shell=True))
-            slurm_results.append(
-                subprocess.Popen(
-                    subprocess_cmd,
-                    shell=True,
-                    stderr=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    text=True
-                )
-            )
-            # slurm_results.append(
-            #     self.start_process(# command, args, description
-            #         "sbatch",
-            #         subprocess_args,
-            #         "{0}_{1}_{2}".format(book_name, autocrop_type, self.config[RUN_UUID])
-            #     )
-            # )
-        
-        # 4. Build and run a dependent sbatch call for the output of stats on these autocrop runs for this book
-        # sbatch_output_stats = "sbatch"
-        # sbatch_output_directives = {
-
-        #     "-c": "1",
-        #     "-d": "afterany:{0}".format(":".join(autocrop_job_ids)),
-        #     "--mem": "1g",
-        #     "-o": "{0}slurm-output-{1}_{2}.out".format(self.config[OUTPUT_DIRECTORY], book_name, self.config[RUN_UUID]),
-        #     "-p": "RM-shared",
-        #     "-t": "12:00:00"
-        # }
-        # for arg in sbatch_output_directives:
-        #     sbatch_output_stats += " {0} {1}".format(arg, sbatch_output_directives[arg])
-        # sbatch_output_stats += " qa_autocrop_outputstats.sh"
-        # # sbatch_output_stats += " --wrap=\"python3 {0}qa.py autocrop --single_book --output_stats --book_directory {1} --run_uuid {2}\"".format(format_path(os.getcwd()), book_name, self.config[RUN_UUID])
-
-        # slurm_results.append(
-        #     subprocess.Popen(
-        #         sbatch_output_stats,
-        #         shell=True,
-        #         stderr=subprocess.PIPE,
-        #         stdout=subprocess.PIPE,
-        #         text=True
-        #     )
-        # )
-        # print("subprocess.Popen({0} shell=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)".format(sbatch_output_stats))   
-        # # subprocess.run(sbatch_output_stats, capture_output=True, text=True, shell=True))
-        # # print("subprocess.run({0}, capture_output=True, text=True, shell=True)".format(sbatch_output_stats))
+            # C. Run auto_crop.py on the book with the given arguments via the autocrop shell script
+            autocrop_jobs.append(QAJob(
+                self.__get_autocrop_job_name(book_name, autocrop_type),
+                "bash qa_autocrop_new.sh " + " ".join(autocrop_args),
+                "{0}slurm-{1}_{2}_{3}.out".format(self.config[OUTPUT_DIRECTORY], book_name, autocrop_type, self.config[RUN_UUID]),
+                str(p_book_directory),
+                p_environment=ENVIRONMENT_AUTOCROP
+            ))
 
-        print("Exiting QA_Autocrop.__run_autocrop_on_book")
-        
-        return slurm_results
+        return autocrop_jobs
+
+    def __get_autocrop_job_name(self, p_book_name, p_autocrop_type):
+        return "{0}_{1}_{2}".format(p_book_name, p_autocrop_type, self.config[RUN_UUID])
+
+    def __get_autocrop_sbatch_directives(self):
+
+        return {
+            "-c": SBATCH_NUMBER_CPUS,
+            "--mem-per-cpu": SBATCH_MEMORY_PER_CPU,
+            "-p": SBATCH_PARTITION,
+            "-t": SBATCH_TIME
+        }
 
     def output_stats(self):
 
@@ -501,41 +552,20 @@ class QA_Autocrop(QA_Module):
 
         print("Entering QA_Autocrop.__output_stats_on_all_books")
 
-        for book_name in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]):
+        # 1. A job to output the stats of each book
+        # (which, with dependency chaining, waits on that book's cropping jobs)
+        stats_jobs = []
+        for book_name in self.directory_snapshot.get_book_names():
 
             # Skip results directory
             if RESULTS_DIRECTORY == book_name:
                 continue
 
-            # A. sbatch arguments
-            sbatch_directives = {
-                
-                "-c": SBATCH_NUMBER_CPUS,
-                "-J": "{0}_{1}".format(book_name, self.config[RUN_UUID]),
-                "--mem-per-cpu": SBATCH_MEMORY_PER_CPU,
-                "-o": "{0}slurm-output-{1}_{2}.out".format(self.config[OUTPUT_DIRECTORY], book_name, self.config[RUN_UUID]),
-                "-p": SBATCH_PARTITION,
-                "-t": SBATCH_TIME
-            }
+            stats_jobs.append(self.__get_output_stats_job(book_name,
+                [self.__get_autocrop_job_name(book_name, autocrop_type) for autocrop_type in AUTOCROP_TYPES]))
 
-            # B. Build the sbatch call
-            subprocess_args = ""
-            for arg in sbatch_directives:
-                subprocess_args += " {0} {1}".format(arg, sbatch_directives[arg])
-            subprocess_args += " --wrap=\"python3 qa.py autocrop --single_book --output_stats --book_directory {0} --output_directory {1} --run_uuid {2}\"".format(
-                self.config[BOOK_DIRECTORY] + book_name, self.config[OUTPUT_DIRECTORY], self.config[RUN_UUID])
-            subprocess_cmd = "sbatch " + subprocess_args
-
-            print("subprocess.Popen({0} shell=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True)".format(subprocess_cmd))
-
-            # C. Run sbatch and save results
-            subprocess.Popen(
-                subprocess_cmd,
-                shell=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                text=True
-            )
+        # 2. Submit them together (as one job array, unless job arrays are turned off)
+        self.submit_jobs(stats_jobs, self.__get_stats_sbatch_directives(), "autocrop_output_stats_{0}".format(self.config[RUN_UUID]))
 
         print("Exiting QA_Autocrop.__output_stats_on_all_books")
 
@@ -543,225 +573,307 @@ class QA_Autocrop(QA_Module):
         #     for book_name in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]) \
         #     if RESULTS_DIRECTORY != book_name ]
 
+    def __get_output_stats_job(self, p_book_name, p_dependencies=None):
+
+        return QAJob(
+            "{0}_{1}".format(p_book_name, self.config[RUN_UUID]),
+            "python3 qa.py autocrop --single_book --output_stats --book_directory {0} --output_directory {1} --run_uuid {2}{3}".format(
+                self.config[BOOK_DIRECTORY] + p_book_name, self.config[OUTPUT_DIRECTORY], self.config[RUN_UUID],
+                " --config_file {0}".format(self.config[CONFIG_FILE]) if CONFIG_FILE in self.config else ""),
+            "{0}slurm-output-{1}_{2}.out".format(self.config[OUTPUT_DIRECTORY], p_book_name, self.config[RUN_UUID]),
+            self.config[BOOK_DIRECTORY] + p_book_name,
+            p_dependencies=p_dependencies
+        )
+
+    def __get_stats_sbatch_directives(self):
+
+        return {
+            "-c": self.__get_stats_cpu_count(),
+            "--mem-per-cpu": SBATCH_MEMORY_PER_CPU,
+            "-p": SBATCH_PARTITION,
+            "-t": SBATCH_TIME
+        }
+
+    def __get_stats_cpu_count(self):
+
+        # Stats jobs ask for as many CPUs as an explicit number of stats worker processes
+        # ('auto' sizes the worker pool from whatever the job is allocated)
+        stats_workers = str(self.config.get(AUTOCROP_STATS_WORKERS, 1))
+        if stats_workers.isdigit() and int(stats_workers) > int(SBATCH_NUMBER_CPUS):
+            return stats_workers
+        return SBATCH_NUMBER_CPUS
+
+    def _Base__output_stats_on_book(self, p_book_directory):
+        return self.__output_stats_on_book(p_book_directory)
+
     def __output_stats_on_book(self, p_book_directory):
 
         print("Entering QA_Autocrop.__output_stats_on_book")
 
         # 0. Output path
         output_folder = format_path(p_book_directory)
-
-        csv_results = {}
-
         book_dir = p_book_directory
         book_name = os.path.basename(book_dir[0:len(p_book_directory)-1])
-        csv_results[book_name] = { "original": {} }
         results_folder = "{0}results{1}".format(output_folder, os.sep)
 
         print("Book directory: " + book_dir)
         print("Book name: " + book_name)
         print("Results folder: " + results_folder)
 
-        # 1. Output stats csv files for each cropping run on this book
+        # 1. Read in the potential error file and count the images for each cropping run on this book
+        csv_results = { "original": { "images": {} } }
+        error_lookups = {}
         for autocrop_type in AUTOCROP_TYPES:
 
-            print("Loop for " + autocrop_type)
+            error_filepath = "{0}error_{1}_{2}_{3}.txt".format(results_folder,
+                book_name, autocrop_type, self.config[RUN_UUID])
+            error_lookups[autocrop_type] = {}
+            if os.path.exists(error_filepath):
+                error_lookups[autocrop_type] = read_error_file(error_filepath, "AUTOCROP")
 
             autocrop_type_subfolder = results_folder + autocrop_type
+            csv_results[autocrop_type] = {
+                "file_count": len(get_items_in_dir(autocrop_type_subfolder, ["files"])) if os.path.exists(autocrop_type_subfolder) else 0,
+                "images": {}
+            }
 
-            print("autocrop_type_subfolder: " + autocrop_type_subfolder)
+        print("FINISHED READING ERROR LOOKUP TABLES")
+        print("ERROR_LOOKUPS:\n{0}".format(error_lookups))
+
+        # 2. The number of original images
+        csv_results["original"]["file_count"] = len(get_items_in_dir(str(book_dir), ["files"]))
+
+        # 3. Pages with up to date rows in this run's stats files from a previous output_stats are skipped,
+        # and only the rows for new or changed pages are appended to those files
+        image_filepaths = sorted(Path(p_book_directory).glob("*.tif"))
+        # NOTE: A page is recalculated if it is out of date in any of the stats files, but its rows
+        # are only added to the files it is out of date in
+        manifests = {}
+        appending_types = []
+        stale_pages = { autocrop_type: None for autocrop_type in AUTOCROP_TYPES }
+        if self.config.get(INCREMENTAL_STATS, False):
+            manifests, appending_types = self.__load_stats_manifests(book_dir, results_folder, error_lookups)
+            for autocrop_type in AUTOCROP_TYPES:
+                stale_pages[autocrop_type] = set([image_filepath.name for image_filepath in image_filepaths \
+                    if not self.__page_is_current(manifests[autocrop_type], autocrop_type, book_dir, results_folder, image_filepath.name, error_lookups)])
+            stale_filepaths = [image_filepath for image_filepath in image_filepaths \
+                if any([image_filepath.name in stale_pages[autocrop_type] for autocrop_type in AUTOCROP_TYPES])]
+            print("Skipping {0} of {1} pages with up to date stats".format(len(image_filepaths) - len(stale_filepaths), len(image_filepaths)))
+            image_filepaths = stale_filepaths
+
+        # 4. In streaming mode, rows are written to the stats files as soon as each page is done. Otherwise they
+        # are held and written every STATS_CHECKPOINT_PAGES pages, so a book cut short keeps the pages it finished
+        # NOTE: The stats files are closed (flushing any rows still buffered) even if a page's stats fail
+        streaming = self.config.get(AUTOCROP_STATS_STREAMING, False)
+        with contextlib.ExitStack() as stats_files_stack:
+
+            stats_files = self.__open_stats_files(results_folder, book_name, stats_files_stack, appending_types)
+            held_page_count = 0
+
+            # 5. Single pass over the original images: each original is decoded and binarized once,
+            # then every cropping run's version of that image is compared against it
+            # NOTE: Pages may be spread over a pool of worker processes, but their results come back in page order
+            for image_name, original_stats, cropped_stats, page_errors in self.__map_stats_over_pages(image_filepaths, results_folder):
+
+                for autocrop_type in page_errors:
+                    error_lookups[autocrop_type][image_name] = page_errors[autocrop_type]
+
+                # A. Write this page's rows out right away
+                if streaming:
+                    self.__write_page_rows(stats_files, book_name, csv_results, image_name, original_stats, cropped_stats, error_lookups, stale_pages)
+                    self.__record_page_in_manifests(manifests, book_dir, results_folder, image_name, original_stats, error_lookups)
+                    for autocrop_type in manifests:
+                        manifests[autocrop_type].save()
+                    continue
 
-            # Check to make sure that the cropping run produced a directory of images
-            # if not os.path.exists(autocrop_type_subfolder):
-            #     print("Cropping for {0} using method '{1}' did not produce any images.".format(book_name, autocrop_type))
-            #     print("No stats csv file for this cropping run will be output.")
-            #     return    
+                # B. Or hold them, writing out the rows held so far (and noting their pages in the manifests) at each checkpoint
+                if original_stats is not None:
+                    csv_results["original"]["images"][image_name] = original_stats
+                for autocrop_type in cropped_stats:
+                    csv_results[autocrop_type]["images"][image_name] = cropped_stats[autocrop_type]
+                self.__record_page_in_manifests(manifests, book_dir, results_folder, image_name, original_stats, error_lookups)
+                held_page_count += 1
+                if held_page_count >= STATS_CHECKPOINT_PAGES:
+                    self.__write_held_rows(stats_files, book_name, csv_results, stale_pages, error_lookups)
+                    for autocrop_type in manifests:
+                        manifests[autocrop_type].save()
+                    held_page_count = 0
+
+            # 6. Add in errored images with their errors
+            for autocrop_type in AUTOCROP_TYPES:
+                for image_name in error_lookups[autocrop_type]:
+
+                    print("Adding errored image {0} to csv_results with error {1}".format(image_name, error_lookups[autocrop_type][image_name]))
+
+                    error_stats = { column: "N/A" for column in STATS_FILE_IMAGE_COLUMNS }
+                    error_stats["error"] = traceback_to_str(error_lookups[autocrop_type][image_name])
+                    if streaming:
+                        stats_files[autocrop_type]["writer"].writerow(self.__format_stats_row(book_name,
+                            csv_results[autocrop_type]["file_count"], autocrop_type, image_name, error_stats))
+                    else:
+                        csv_results[autocrop_type]["images"][image_name] = error_stats
+
+            # 7. Output the rest of the original and cropped image stats to each cropping run's csv file in the results folder
+            # (the files are closed on leaving this block)
+            if not streaming:
+                self.__write_held_rows(stats_files, book_name, csv_results, stale_pages)
+
+        # 8. Note the pages now in the stats files once their rows are written, and the files in the run catalog
+        for autocrop_type in manifests:
+            manifests[autocrop_type].save()
+        for autocrop_type in stats_files:
+            self.record_artifact(stats_files[autocrop_type]["filepath"], book_name, ARTIFACT_STATS)
 
-            # A. Potential error file for this cropping run for this book
-            error_filepath = "{0}results{1}error_{2}_{3}_{4}.txt".format(output_folder, os.sep,
-                book_name, autocrop_type, self.config[RUN_UUID])
-            error_lookup = {}
-            if os.path.exists(error_filepath):
-                error_lookup = self.read_error_file(error_filepath, "AUTOCROP")
+        print("Exiting QA_Autocrop.__output_stats_on_book")
 
-            print("FINISHED READING ERROR LOOKUP TABLE")
-            print("ERROR_LOOKUP:\n{0}".format(error_lookup))
+    def __map_stats_over_pages(self, p_image_filepaths, p_results_folder):
 
-            # B. Determine info about the original images
+        # 0. Number of worker processes (1 keeps all work in this process) and
+        # the most pages that can be in progress or waiting to be written at once
+        worker_count = get_worker_count(self.config.get(AUTOCROP_STATS_WORKERS, 1))
+        pages_in_flight = self.config.get(AUTOCROP_STATS_PAGES_IN_FLIGHT, WORKERS_AUTO)
+        pages_in_flight = 2 * worker_count if WORKERS_AUTO == str(pages_in_flight).lower() else max(1, int(pages_in_flight))
 
-            # I. The number of original images
-            csv_results[book_name]["original"]["file_count"] = len(get_items_in_dir(str(book_dir), ["files"]))
-            csv_results[book_name]["original"]["images"] = {}
+        print("Calculating stats for {0} pages with {1} worker process(es) and at most {2} page(s) in flight".format(
+            len(p_image_filepaths), worker_count, pages_in_flight))
 
-            # II. Gather stats on the original book images
-            for image_filepath in Path(p_book_directory).glob("*.tif"):
+        # 1. Yield each page's stats in page order
+        if worker_count > 1:
+            with ProcessPoolExecutor(max_workers=worker_count) as executor:
+                yield from bounded_ordered_map(executor, output_stats_on_page, pages_in_flight,
+                    p_image_filepaths, repeat(p_results_folder), repeat(self.config))
+        else:
+            for image_filepath in p_image_filepaths:
+                yield output_stats_on_page(image_filepath, p_results_folder, self.config)
 
-                print("Loop for original image: {0}".format(image_filepath))
+    def __load_stats_manifests(self, p_book_directory, p_results_folder, p_error_lookups):
 
-                try:
-                    img = Image.open(image_filepath)
-                except UnidentifiedImageError:
-                    print("Unidentified image error for {0}".format(Path(image_filepath).name))
-                    error_lookup[Path(image_filepath).name] = str(traceback.format_exc())
-                    continue
-                image_name = os.path.basename(image_filepath)
+        # Returns:
+        # 1. The manifest of pages already in each cropping run's stats file keyed by autocrop type
+        # 2. The autocrop types whose stats files can be appended to
 
-                # print("Image name: " + image_name)
+        manifests = {}
+        appending_types = []
+        for autocrop_type in AUTOCROP_TYPES:
 
-                csv_results[book_name]["original"]["images"][image_name] = { "binarized_image": binarize_img(img)[0] }
+            stats_filename = "{0}_{1}_{2}.csv".format(STATS_FILE_PREFIX, autocrop_type, self.config[RUN_UUID])
+            manifests[autocrop_type] = QAStatsManifest(
+                os.path.join(p_book_directory, BOOK_CACHE_DIRECTORY, STATS_MANIFEST_DIRECTORY, stats_filename + ".jsonl"),
+                p_results_folder + stats_filename)
+
+            # A. Drop the rows of pages that have changed since they were written
+            def row_is_current(p_row, p_autocrop_type=autocrop_type):
+                return self.__page_is_current(manifests[p_autocrop_type], p_autocrop_type,
+                    p_book_directory, p_results_folder, p_row["image_name"], p_error_lookups)
+
+            # B. Stats files without usable rows are written from scratch
+            if manifests[autocrop_type].prune_stats_file(row_is_current) is not None:
+                appending_types.append(autocrop_type)
+            else:
+                manifests[autocrop_type].reset()
+
+        return manifests, appending_types
+
+    def __page_is_current(self, p_manifest, p_autocrop_type, p_book_directory, p_results_folder, p_image_name, p_error_lookups):
+
+        # A page's rows in a cropping run's stats file are up to date if the original and cropped images
+        # are unchanged since they were written
+        # NOTE: Errored pages are never recorded in the manifest, so they are always recalculated
+        return p_image_name not in p_error_lookups[p_autocrop_type] and \
+            p_manifest.is_current(os.path.join(p_book_directory, p_image_name), "original") and \
+            p_manifest.is_current(self.__get_cropped_filepath(p_results_folder, p_autocrop_type, p_image_name),
+                p_autocrop_type, self.config.get(AUTOCROP_COMPARISON_MODE, COMPARISON_MODE_PADDED))
+
+    def __record_page_in_manifests(self, p_manifests, p_book_directory, p_results_folder, p_image_name, p_original_stats, p_error_lookups):
+
+        # Pages whose original could not be opened, or that have errors, are recalculated next time
+        if p_original_stats is None:
+            return
+        for autocrop_type in p_manifests:
+            if p_image_name in p_error_lookups[autocrop_type]:
+                p_manifests[autocrop_type].forget(os.path.join(p_book_directory, p_image_name), "original")
+                continue
+            p_manifests[autocrop_type].record(os.path.join(p_book_directory, p_image_name), "original")
+            p_manifests[autocrop_type].record(self.__get_cropped_filepath(p_results_folder, autocrop_type, p_image_name),
+                autocrop_type, self.config.get(AUTOCROP_COMPARISON_MODE, COMPARISON_MODE_PADDED))
 
-                # print("Binarized image done")
+    def __get_cropped_filepath(self, p_results_folder, p_autocrop_type, p_image_name):
+        return "{0}{1}{2}{3}".format(p_results_folder, p_autocrop_type, os.sep, p_image_name)
 
-                # Image area
-                csv_results[book_name]["original"]["images"][image_name]["image_width"] = img.size[0]
-                csv_results[book_name]["original"]["images"][image_name]["image_height"] = img.size[1]
-                csv_results[book_name]["original"]["images"][image_name]["image_area"]  = img.size[0] * img.size[1]
+    def __open_stats_files(self, p_results_folder, p_book_name, p_exit_stack, p_appending_types=[]):
 
-                # print("Image area done")
+        # Open a stats csv file for each cropping run and write its header
+        # (or, for incremental runs, add to the end of the file already there)
+        # NOTE: The files are closed along with the given contextlib.ExitStack
+        stats_files = {}
+        for autocrop_type in AUTOCROP_TYPES:
 
-                # N/A values
-                csv_results[book_name]["original"]["images"][image_name]["area_diff_from_original"] = 0
-                csv_results[book_name]["original"]["images"][image_name]["percent_area_diff_from_original"] = 0
-                csv_results[book_name]["original"]["images"][image_name]["frobenius_norm_from_original"] = 0
-                csv_results[book_name]["original"]["images"][image_name]["min_pct_dimension_difference"] = 0
-                csv_results[book_name]["original"]["images"][image_name]["error"] = "N/A"
+            stats_filepath = p_results_folder + "{0}_{1}_{2}.csv".format(STATS_FILE_PREFIX, autocrop_type, self.config[RUN_UUID])
 
-                # print("N/A values done")
+            print("Outputting stats for {0} to {1}".format(p_book_name, stats_filepath))
 
-            # C. Comparisons between originals and autocrop run
+            appending = autocrop_type in p_appending_types
+            stats_files[autocrop_type] = {
+                "file": p_exit_stack.enter_context(open(stats_filepath, "a" if appending else "w")),
+                "filepath": stats_filepath
+            }
+            stats_files[autocrop_type]["writer"] = csv.writer(stats_files[autocrop_type]["file"])
+            if not appending:
+                stats_files[autocrop_type]["writer"].writerow(STATS_FILE_HEADER)
 
-            csv_results[book_name][autocrop_type] = {}
+        return stats_files
 
-            # I. The number of autocropped images
-            csv_results[book_name][autocrop_type]["file_count"] = len(get_items_in_dir(autocrop_type_subfolder, ["files"]))
-            csv_results[book_name][autocrop_type]["images"] = {}
+    def __write_held_rows(self, p_stats_files, p_book_name, p_csv_results, p_stale_pages, p_error_lookups=None):
 
-            # print("Pre gather stats loop")
+        # Write the held rows to each cropping run's stats file (the originals' rows, then the crops' rows) and let them go
+        # NOTE: At a checkpoint (given the error lookups), errored crops are left to be written with the book's other errors at the end
+        for autocrop_type in AUTOCROP_TYPES:
+            for results_type in ["original", autocrop_type]:
+                for image_name in p_csv_results[results_type]["images"]:
+                    if p_stale_pages[autocrop_type] is not None and image_name not in p_stale_pages[autocrop_type]:
+                        continue
+                    if p_error_lookups is not None and autocrop_type == results_type and image_name in p_error_lookups[autocrop_type]:
+                        continue
+                    p_stats_files[autocrop_type]["writer"].writerow(self.__format_stats_row(p_book_name,
+                        p_csv_results[results_type]["file_count"],
+                        results_type,
+                        image_name,
+                        p_csv_results[results_type]["images"][image_name]))
+            p_stats_files[autocrop_type]["file"].flush()
+
+        for results_type in p_csv_results:
+            p_csv_results[results_type]["images"] = {}
+
+    def __write_page_rows(self, p_stats_files, p_book_name, p_csv_results, p_image_name, p_original_stats, p_cropped_stats, p_error_lookups, p_stale_pages):
+
+        for autocrop_type in p_stats_files:
+
+            # 0. Incremental runs leave the rows of pages that are already up to date in a stats file alone
+            if p_stale_pages[autocrop_type] is not None and p_image_name not in p_stale_pages[autocrop_type]:
+                continue
 
-            # II. Gather stats on autocropped images and compare to original images
-            for image_filepath in Path(autocrop_type_subfolder).glob("*.tif"):
+            csv_writer = p_stats_files[autocrop_type]["writer"]
 
-                print("Loop for cropped image: {0}".format(image_filepath))
+            # 1. The original image's row goes in every cropping run's stats file
+            if p_original_stats is not None:
+                csv_writer.writerow(self.__format_stats_row(p_book_name,
+                    p_csv_results["original"]["file_count"], "original", p_image_name, p_original_stats))
 
-                try:
-                    img = Image.open(image_filepath)
-                except Exception as e:
-                    print("Image opening exception for {0}".format(image_filepath))
-                    error_lookup[Path(image_filepath).name] = str(traceback.format_exc())
-                    continue
-                image_name = os.path.basename(image_filepath)
-
-                # a. Find second to last dash in cropped image filepath
-                # original_image_name = image_name[image_name.rfind("-", 0, image_name.rfind("-")) + 1:]
-                csv_results[book_name][autocrop_type]["images"][image_name] = {}
-
-                # b. Image area comparison
-                csv_results[book_name][autocrop_type]["images"][image_name]["image_width"] = img.size[0]
-                csv_results[book_name][autocrop_type]["images"][image_name]["image_height"] = img.size[1]
-
-                # min( (width - width_original) / width_original, (height - height_original) / height_original) )
-                autocropped_width = csv_results[book_name][autocrop_type]["images"][image_name]["image_width"]
-                autocropped_height = csv_results[book_name][autocrop_type]["images"][image_name]["image_height"]
-                original_width = csv_results[book_name]["original"]["images"][image_name]["image_width"]
-                original_height = csv_results[book_name]["original"]["images"][image_name]["image_height"]
-                csv_results[book_name][autocrop_type]["images"][image_name]["min_pct_dimension_difference"] = \
-                    min((autocropped_width - original_width) / original_width,
-                        (autocropped_height - original_height) / original_height)
-
-                csv_results[book_name][autocrop_type]["images"][image_name]["image_area"]  = img.size[0] * img.size[1]
-                csv_results[book_name][autocrop_type]["images"][image_name]["area_diff_from_original"] = \
-                    csv_results[book_name]["original"]["images"][image_name]["image_area"] - \
-                    csv_results[book_name][autocrop_type]["images"][image_name]["image_area"]
-                csv_results[book_name][autocrop_type]["images"][image_name]["percent_area_diff_from_original"] = 100.0 * \
-                    (float(csv_results[book_name][autocrop_type]["images"][image_name]["image_area"]) / \
-                    float(csv_results[book_name]["original"]["images"][image_name]["image_area"]))
-                
-                # c. Frobenius norm between original and autocropped images
+            # 2. Errored images are written out with all of the book's other errors at the end
+            if p_image_name in p_error_lookups[autocrop_type]:
+                continue
+            if autocrop_type in p_cropped_stats:
+                csv_writer.writerow(self.__format_stats_row(p_book_name,
+                    p_csv_results[autocrop_type]["file_count"], autocrop_type, p_image_name, p_cropped_stats[autocrop_type]))
 
-                # i. Pad the autocropped image to the size of the original
-                try:
-                    new_image = Image.new(
-                        img.mode,
-                        (csv_results[book_name]["original"]["images"][image_name]["image_width"],
-                        csv_results[book_name]["original"]["images"][image_name]["image_height"]),
-                    ) 
-                    new_image.paste(img, (0, 0))
-                except:
-                    print("ERROR: Problem creating image for comparison with cropped in __output_stats_for_book.")
-                    print("Image: {0}".format(image_name))
-                    error_lookup[Path(image_filepath).name] = str(traceback.format_exc())
-                    continue
+            # 3. Flush so the rows are on disk before the next page
+            p_stats_files[autocrop_type]["file"].flush()
 
-                # ii. Binarize the autocropped image
-                autocrop_img_mtx = np.asarray(binarize_img(new_image)[0]).astype(int)
-
-                # iii. Calculate the Frobenius norm between the two binarized images
-                original_img_mtx = np.asarray(csv_results[book_name]["original"]["images"][image_name]["binarized_image"]).astype(int)
-                diffed_img_mtx = np.subtract(original_img_mtx, autocrop_img_mtx)
-                csv_results[book_name][autocrop_type]["images"][image_name]["frobenius_norm_from_original"] = np.linalg.norm(diffed_img_mtx, "fro")
-
-                # d. All images found are likely not errored
-                csv_results[book_name][autocrop_type]["images"][image_name]["error"] = "N/A"
-
-            # III. Add in errored images with their errors
-            for image_name in error_lookup:
-
-                print("Adding errored image {0} to csv_results with error {1}".format(image_name, error_lookup[image_name]))
-
-                csv_results[book_name][autocrop_type]["images"][image_name] = {}
-                csv_results[book_name][autocrop_type]["images"][image_name]["image_width"] = "N/A"
-                csv_results[book_name][autocrop_type]["images"][image_name]["image_height"] = "N/A"
-                csv_results[book_name][autocrop_type]["images"][image_name]["min_pct_dimension_difference"] = "N/A"
-                csv_results[book_name][autocrop_type]["images"][image_name]["image_area"] = "N/A"
-                csv_results[book_name][autocrop_type]["images"][image_name]["area_diff_from_original"] = "N/A"
-                csv_results[book_name][autocrop_type]["images"][image_name]["percent_area_diff_from_original"] = "N/A"
-                csv_results[book_name][autocrop_type]["images"][image_name]["frobenius_norm_from_original"] = "N/A"
-                csv_results[book_name][autocrop_type]["images"][image_name]["error"] = traceback_to_str(error_lookup[image_name])
-
-            # D. Output a csv file of these stats in the autocrop result folder
-            for book_name in csv_results:
-
-                results_folder = "{0}results{1}".format(output_folder, os.sep)
-                stats_filepath = results_folder + "{0}_{1}_{2}.csv".format(STATS_FILE_PREFIX, autocrop_type, self.config[RUN_UUID])
-
-                print("Outputting stats for {0} to {1}".format(book_name, stats_filepath))
-
-                with open(stats_filepath, "w") as output_file:
-
-                    csv_writer = csv.writer(output_file)
-
-                    csv_writer.writerow([
-                        "book_name",
-                        "total_page_count",
-                        "autocrop_type",
-                        "image_name",
-                        "image_width",
-                        "image_height",
-                        "min_pct_dimension_difference",
-                        "image_area",
-                        "area_diff_from_original",
-                        "percent_area_diff_from_original",
-                        "frobenius_norm_from_original",
-                        "error"
-                    ])
-
-                    for autocrop_type in csv_results[book_name]:
-
-                        for image_name in csv_results[book_name][autocrop_type]["images"]:
-
-                            csv_writer.writerow([book_name,
-                                                csv_results[book_name][autocrop_type]["file_count"],
-                                                autocrop_type,
-                                                image_name,
-                                                csv_results[book_name][autocrop_type]["images"][image_name]["image_width"],
-                                                csv_results[book_name][autocrop_type]["images"][image_name]["image_height"],
-                                                csv_results[book_name][autocrop_type]["images"][image_name]["min_pct_dimension_difference"],
-                                                csv_results[book_name][autocrop_type]["images"][image_name]["image_area"],
-                                                csv_results[book_name][autocrop_type]["images"][image_name]["area_diff_from_original"],
-                                                csv_results[book_name][autocrop_type]["images"][image_name]["percent_area_diff_from_original"],
-                                                csv_results[book_name][autocrop_type]["images"][image_name]["frobenius_norm_from_original"],
-                                                "'" + csv_results[book_name][autocrop_type]["images"][image_name]["error"] + "'"])
-        
-        print("Exiting QA_Autocrop.__output_stats_on_book")
+    def __format_stats_row(self, p_book_name, p_file_count, p_autocrop_type, p_image_name, p_image_stats):
+
+        return [p_book_name, p_file_count, p_autocrop_type, p_image_name] + \
+            [p_image_stats[column] for column in STATS_FILE_IMAGE_COLUMNS if "error" != column] + \
+            ["'" + p_image_stats["error"] + "'"]
 
     def wait(self):
 
@@ -778,16 +890,148 @@ class QA_Autocrop(QA_Module):
 
         print("Entering QA_Autocrop.__wait_for_autocrop_on_book with book directory: {0}".format(p_book_directory))
 
-        while not self.is_method_finished(p_book_directory):
-            time.sleep(5)
-            continue
+        # Block until this book's cropping jobs have recorded that they finished in the run journal
+        self.wait_for_jobs([self.__get_autocrop_job_name(Path(p_book_directory).name, autocrop_type) \
+            for autocrop_type in AUTOCROP_TYPES])
 
         print("Exiting QA_Autocrop.__wait_for_autocrop_on_book")
-    
+
     def __wait_for_autocrop_on_all_books(self):
 
-        print("Entering/exiting QA_Autocrop.__wait_for_autocrop_on_all_books")
+        print("Entering QA_Autocrop.__wait_for_autocrop_on_all_books")
+
+        # Block until every book's cropping jobs have recorded that they finished in the run journal
+        self.wait_for_jobs([self.__get_autocrop_job_name(book_name, autocrop_type) \
+            for book_name in self.directory_snapshot.get_book_names() \
+            if RESULTS_DIRECTORY != book_name \
+            for autocrop_type in AUTOCROP_TYPES])
+
+        print("Exiting QA_Autocrop.__wait_for_autocrop_on_all_books")
+
+
+# Functions
+
+# NOTE: Per page stats are module level functions so that they can be run in a pool of worker processes
+
+def compare_to_original(p_original_stats, p_original_bin_mtx, p_cropped_img, p_config):
+
+    cropped_stats = {}
+
+    # 1. Image area comparison
+    cropped_stats["image_width"] = p_cropped_img.size[0]
+    cropped_stats["image_height"] = p_cropped_img.size[1]
+
+    # min( (width - width_original) / width_original, (height - height_original) / height_original) )
+    original_width = p_original_stats["image_width"]
+    original_height = p_original_stats["image_height"]
+    cropped_stats["min_pct_dimension_difference"] = \
+        min((cropped_stats["image_width"] - original_width) / original_width,
+            (cropped_stats["image_height"] - original_height) / original_height)
+
+    cropped_stats["image_area"] = p_cropped_img.size[0] * p_cropped_img.size[1]
+    cropped_stats["area_diff_from_original"] = p_original_stats["image_area"] - cropped_stats["image_area"]
+    cropped_stats["percent_area_diff_from_original"] = 100.0 * \
+        (float(cropped_stats["image_area"]) / float(p_original_stats["image_area"]))
+
+    # 2. Frobenius norm between original and autocropped images
+    if COMPARISON_MODE_OVERLAP == p_config.get(AUTOCROP_COMPARISON_MODE, COMPARISON_MODE_PADDED):
+
+        # A. Binarize just the autocropped image (clipped to the size of the original, as pasting would)
+        # NOTE: Saves allocating, pasting into, and binarizing a full page sized canvas, though pixels
+        # near the crop's edges may binarize slightly differently without the canvas's padding around them
+        autocrop_img_mtx = np.asarray(binarize_img(p_cropped_img)[0])[0:original_height, 0:original_width]
+    else:
+
+        # A. Pad the autocropped image to the size of the original
+        new_image = Image.new(p_cropped_img.mode, (original_width, original_height))
+        new_image.paste(p_cropped_img, (0, 0))
+
+        # B. Binarize the padded autocropped image
+        autocrop_img_mtx = np.asarray(binarize_img(new_image)[0])
+
+    # C. Calculate the Frobenius norm between the two binarized images
+    # NOTE: Compared as packed bits, since the norm of a difference of binary images is sqrt(# differing pixels).
+    # The blank padding always binarizes to unset pixels, so outside of the crop this counts the set pixels of
+    # the original, with or without a padded canvas
+    cropped_stats["frobenius_norm_from_original"] = binary_frobenius_norm(p_original_bin_mtx, autocrop_img_mtx)
+
+    # 3. All images found are likely not errored
+    cropped_stats["error"] = "N/A"
+
+    return cropped_stats
+
+def output_stats_on_original(p_original_filepath, p_original_img, p_config):
+
+    # 1. Binarize the original image (the most expensive step of output_stats)
+    # NOTE: Originals don't change between autocrop runs, so their binarizations can be
+    # reused from the book's cache across run UUIDs
+    if p_config.get(BINARIZATION_CACHE, False):
+        cache_directory = os.path.join(Path(p_original_filepath).parent, BOOK_CACHE_DIRECTORY, BINARIZATION_CACHE_DIRECTORY)
+        original_stats = { "binarized_image": binarize_img_cached(p_original_filepath, cache_directory, im=p_original_img) }
+    else:
+        original_stats = { "binarized_image": np.asarray(binarize_img(p_original_img)[0]) }
+
+    # 2. Image area
+    original_stats["image_width"] = p_original_img.size[0]
+    original_stats["image_height"] = p_original_img.size[1]
+    original_stats["image_area"] = p_original_img.size[0] * p_original_img.size[1]
+
+    # 3. N/A values
+    original_stats["area_diff_from_original"] = 0
+    original_stats["percent_area_diff_from_original"] = 0
+    original_stats["frobenius_norm_from_original"] = 0
+    original_stats["min_pct_dimension_difference"] = 0
+    original_stats["error"] = "N/A"
+
+    return original_stats
+
+def output_stats_on_page(p_image_filepath, p_results_folder, p_config):
+
+    # Returns:
+    # 1. Image filename
+    # 2. Stats on the original image (or None if it could not be opened)
+    # 3. Stats on each cropping run's version of the image keyed by autocrop type
+    # 4. Errors for this image keyed by autocrop type
+
+    print("Loop for original image: {0}".format(p_image_filepath))
+
+    image_name = os.path.basename(p_image_filepath)
+    cropped_stats = {}
+    page_errors = {}
+
+    # 1. Gather stats on the original book image
+    try:
+        img = Image.open(p_image_filepath)
+    except UnidentifiedImageError:
+        print("Unidentified image error for {0}".format(image_name))
+        for autocrop_type in AUTOCROP_TYPES:
+            page_errors[autocrop_type] = str(traceback.format_exc())
+        return image_name, None, cropped_stats, page_errors
+
+    original_stats = output_stats_on_original(p_image_filepath, img, p_config)
+    original_bin_mtx = original_stats.pop("binarized_image")
+
+    # 2. Compare each cropping run's version of this image to the original
+    for autocrop_type in AUTOCROP_TYPES:
+
+        cropped_filepath = "{0}{1}{2}{3}".format(p_results_folder, autocrop_type, os.sep, image_name)
+        if not os.path.exists(cropped_filepath):
+            continue
+
+        print("Comparing cropped image: {0}".format(cropped_filepath))
+
+        try:
+            cropped_img = Image.open(cropped_filepath)
+        except Exception as e:
+            print("Image opening exception for {0}".format(cropped_filepath))
+            page_errors[autocrop_type] = str(traceback.format_exc())
+            continue
+
+        try:
+            cropped_stats[autocrop_type] = compare_to_original(original_stats, original_bin_mtx, cropped_img, p_config)
+        except:
+            print("ERROR: Problem comparing cropped image with original in output_stats_on_page.")
+            print("Image: {0}".format(image_name))
+            page_errors[autocrop_type] = str(traceback.format_exc())
 
-        return all([self.__wait_for_autocrop_on_book(format_path(self.config[BOOK_DIRECTORY] + book_name)) \
-                    for book_name in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]) \
-                    if RESULTS_DIRECTORY != book_name])
+    return image_name, original_stats, cropped_stats, page_errors
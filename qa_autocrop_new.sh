@@ -5,11 +5,9 @@
 # Script Info:
 # Runs autocrop script on given book directory
 
-# 1. Load the environment
-source ~/.bashrc
-module load anaconda3
-conda init
-conda activate "/ocean/projects/hum160002p/gsell/.conda/envs/my_env"
+# 1. Load the environment (unless the group of packed jobs running this one already has)
+source "$(dirname "${BASH_SOURCE[0]}")/qa_environment.sh"
+activate_qa_environment autocrop
 
 echo "In qa_autocrop_new.sh"
 echo "with args"
@@ -8,25 +8,101 @@
 import os
 
 # Directories and filenames
+ARCHIVE_BUNDLE_FILENAME = "run_{0}.tar"
 ARCHIVE_DIRECTORY = "archive"
+ARCHIVE_INDEX_FILENAME = "run_{0}.index.json"
+BINARIZATION_CACHE_DIRECTORY = "binarized"
+BOOK_CACHE_DIRECTORY = ".qa_cache"
 DEFAULT_OUTPUT_DIRECTORY = "{0}{1}output{1}".format(os.getcwd(), os.sep)
+PAGE_INDEX_FILENAME = "page_index.json"
 QA_CODE_DIRECTORY = "/ocean/projects/hum160002p/shared/books/code/"
 RESULTS_DIRECTORY = "results"
+RUN_CATALOG_FILENAME = "qa_run_catalog.sqlite"
+RUN_JOURNAL_FILENAME = "run_journal_{0}.jsonl"
+STATS_MANIFEST_DIRECTORY = "stats_manifests"
+TRASH_DIRECTORY = ".qa_trash"
 
 MERGED_RESULTS_FILENAME_PREFIX = "all_results_merged"
 
 # Yaml config keys
+ARCHIVE_BUNDLES = "ARCHIVE_BUNDLES"
+AUTOCROP_COMPARISON_MODE = "AUTOCROP_COMPARISON_MODE"
+AUTOCROP_STATS_PAGES_IN_FLIGHT = "AUTOCROP_STATS_PAGES_IN_FLIGHT"
+AUTOCROP_STATS_STREAMING = "AUTOCROP_STATS_STREAMING"
+AUTOCROP_STATS_WORKERS = "AUTOCROP_STATS_WORKERS"
+BINARIZATION_CACHE = "BINARIZATION_CACHE"
 BOOK_DIRECTORY = "BOOK_DIRECTORY"
 COMMANDS = "COMMANDS"
+CONFIG_FILE = "CONFIG_FILE"
+EXECUTOR = "EXECUTOR"
+INCREMENTAL_STATS = "INCREMENTAL_STATS"
+LINEEXTRACTION_STATS_WORKERS = "LINEEXTRACTION_STATS_WORKERS"
+LOCAL_MAX_PROCESSES = "LOCAL_MAX_PROCESSES"
+LOCAL_PROCESS_TIMEOUT = "LOCAL_PROCESS_TIMEOUT"
 OUTPUT_DIRECTORY = "OUTPUT_DIRECTORY"
+PAGE_STAGING = "PAGE_STAGING"
 QA_TYPE = "QA_TYPE"
 RUN_TYPE = "RUN_TYPE"
 RUN_UUID = "RUN_UUID"
+SLURM_ARRAY_THROTTLE = "SLURM_ARRAY_THROTTLE"
+SLURM_DEPENDENCY_CHAINING = "SLURM_DEPENDENCY_CHAINING"
+SLURM_JOB_ARRAYS = "SLURM_JOB_ARRAYS"
+SLURM_PACKING = "SLURM_PACKING"
+SLURM_PACKING_TARGET = "SLURM_PACKING_TARGET"
+SLURM_PACKING_WORKERS = "SLURM_PACKING_WORKERS"
+SLURM_SACCT_COMMAND = "SLURM_SACCT_COMMAND"
+SLURM_SBATCH_COMMAND = "SLURM_SBATCH_COMMAND"
+SLURM_SQUEUE_COMMAND = "SLURM_SQUEUE_COMMAND"
+SLURM_STATUS_POLL_SECONDS = "SLURM_STATUS_POLL_SECONDS"
+SLURM_SUBMIT_CONCURRENCY = "SLURM_SUBMIT_CONCURRENCY"
+STREAMING_PIPELINE = "STREAMING_PIPELINE"
+
+# Slurm
+SLURM_MAX_ARRAY_SIZE = 1000
+
+# Resources for jobs that run one QA command (e.g. 'collate') after the jobs before it
+SLURM_COMMAND_JOB_DIRECTIVES = {
+    "-c": "1",
+    "-p": "RM-shared",
+    "-t": "12:00:00"
+}
+
+# sbatch dependency types
+DEPENDENCY_AFTERANY = "afterany"
+DEPENDENCY_AFTEROK = "afterok"
+
+# Conda environments that jobs run in (named as in qa_environment.sh)
+ENVIRONMENT_AUTOCROP = "autocrop"
+ENVIRONMENT_EYNOLLAH = "eynollah"
+ENVIRONMENT_NONE = "none"
+ENVIRONMENT_WATERSHED = "watershed"
+
+# Job states in which slurm has not finished with a job (see squeue's JOB STATE CODES)
+SLURM_ACTIVE_STATES = [
+    "COMPLETING",
+    "CONFIGURING",
+    "PENDING",
+    "REQUEUED",
+    "REQUEUE_FED",
+    "REQUEUE_HOLD",
+    "RESIZING",
+    "RUNNING",
+    "SIGNALING",
+    "STAGE_OUT",
+    "STOPPED",
+    "SUSPENDED"
+]
 
 # Temp
 ERROR_FILE_RUN_UUID = "ERROR_FILE_RUN_UUID"
 
 # Yaml config values
+COMPARISON_MODE_OVERLAP = "overlap"
+COMPARISON_MODE_PADDED = "padded"
+VALID_COMPARISON_MODES = [
+    COMPARISON_MODE_OVERLAP,
+    COMPARISON_MODE_PADDED
+]
 COMMAND_ARCHIVE = "archive"
 COMMAND_ARCHIVE_LOGS = "archive_logs"
 COMMAND_ARCHIVE_RESULTS = "archive_results"
@@ -68,8 +144,64 @@ VALID_QA_TYPES = [
     QA_TYPE_LINE_EXTRACTION_EYNOLLAH,
     QA_TYPE_LINE_EXTRACTION_WATERSHED
 ]
+PACKING_BYTES = "bytes"
+PACKING_NONE = "none"
+PACKING_PAGES = "pages"
+VALID_PACKING_MODES = [
+    PACKING_BYTES,
+    PACKING_NONE,
+    PACKING_PAGES
+]
+# Most pages or bytes of books per packed job when SLURM_PACKING_TARGET is not given
+PACKING_TARGET_DEFAULTS = {
+    PACKING_BYTES: 4 * 1024 ** 3,
+    PACKING_PAGES: 500
+}
 RUN_TYPE_MULTI = "multi"
 RUN_TYPE_SINGLE = "single"
 VALID_RUN_TYPES = [
     RUN_TYPE_MULTI, RUN_TYPE_SINGLE
-]
\ No newline at end of file
+]
+WORKERS_AUTO = "auto"
+
+EXECUTOR_LOCAL = "local"
+EXECUTOR_SLURM = "slurm"
+VALID_EXECUTORS = [EXECUTOR_LOCAL, EXECUTOR_SLURM]
+
+STAGING_COPY = "copy"
+STAGING_LINK = "link"
+VALID_STAGING_MODES = [STAGING_COPY, STAGING_LINK]
+
+# Kinds of files recorded in the run catalog
+ARTIFACT_BOOK_RESULTS = "book_results"
+ARTIFACT_ERRORS = "errors"
+ARTIFACT_RUN_RESULTS = "run_results"
+ARTIFACT_STATS = "stats"
+
+# Optional yaml config keys and their default values
+OPTIONAL_CONFIG_DEFAULTS = {
+    ARCHIVE_BUNDLES: False,
+    AUTOCROP_COMPARISON_MODE: COMPARISON_MODE_PADDED,
+    AUTOCROP_STATS_PAGES_IN_FLIGHT: WORKERS_AUTO,
+    AUTOCROP_STATS_STREAMING: False,
+    AUTOCROP_STATS_WORKERS: 1,
+    BINARIZATION_CACHE: False,
+    EXECUTOR: EXECUTOR_SLURM,
+    INCREMENTAL_STATS: True,
+    LINEEXTRACTION_STATS_WORKERS: 1,
+    LOCAL_MAX_PROCESSES: WORKERS_AUTO,
+    LOCAL_PROCESS_TIMEOUT: None,
+    PAGE_STAGING: STAGING_COPY,
+    SLURM_ARRAY_THROTTLE: None,
+    SLURM_DEPENDENCY_CHAINING: False,
+    SLURM_JOB_ARRAYS: False,
+    SLURM_PACKING: PACKING_NONE,
+    SLURM_PACKING_TARGET: None,
+    SLURM_PACKING_WORKERS: 4,
+    SLURM_SACCT_COMMAND: "sacct",
+    SLURM_SBATCH_COMMAND: "sbatch",
+    SLURM_SQUEUE_COMMAND: "squeue",
+    SLURM_STATUS_POLL_SECONDS: 30,
+    SLURM_SUBMIT_CONCURRENCY: 8,
+    STREAMING_PIPELINE: False
+}
\ No newline at end of file
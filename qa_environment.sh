@@ -0,0 +1,27 @@
+#!/bin/bash
+
+# Script Info:
+# Sourced by QA job scripts for activate_qa_environment, which activates the conda environment a QA job runs in.
+# A group of packed jobs (see qa_job_group.sh) activates its jobs' environment once and exports QA_ACTIVATED_ENVIRONMENT,
+# so each job it runs skips activating the environment again.
+
+# Conda environment directory for each QA environment name
+qa_environment_directory() {
+  case "$1" in
+    autocrop) echo "/ocean/projects/hum160002p/gsell/.conda/envs/my_env" ;;
+    eynollah) echo "/ocean/projects/hum160002p/nikolaiv/miniconda3/envs/eynollah" ;;
+    watershed) echo "/ocean/projects/hum160002p/nikolaiv/miniconda3/envs/dh_segment" ;;
+  esac
+}
+
+# Activates the named QA environment, returning 1 (without doing anything) if a job group already activated it
+activate_qa_environment() {
+  if [ "$QA_ACTIVATED_ENVIRONMENT" == "$1" ]; then
+    return 1
+  fi
+  source ~/.bashrc
+  module load anaconda3
+  conda init
+  conda activate "$(qa_environment_directory "$1")"
+  export QA_ACTIVATED_ENVIRONMENT="$1"
+}
@@ -0,0 +1,16 @@
+#!/bin/bash
+
+# Script Info:
+# Runs a group of QA jobs packed into one slurm job, activating the conda environment they share once for the whole group
+# Usage: qa_job_group.sh <environment name, or "none"> <group manifest file> <worker count>
+
+source "$(dirname "${BASH_SOURCE[0]}")/qa_environment.sh"
+
+# 1. Activate the jobs' environment (the jobs then skip activating it themselves)
+if [ "none" != "$1" ]; then
+  echo "Loading conda environment $1 for the job group..."
+  activate_qa_environment "$1"
+fi
+
+# 2. Run the group's jobs
+python3 qa_utilities.py run_job_group "$2" "$3"
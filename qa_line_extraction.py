@@ -5,20 +5,23 @@
 # Imports
 
 # Built-ins
-import ast
+import collections
 import csv
 import glob
-import math
 import os
+import re
 import shutil
 import subprocess
+import sys
 import traceback
 from abc import abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from statistics import median, variance
 
 # Third party
+import numpy as np
 from PIL import Image
 from PIL import UnidentifiedImageError
 
@@ -30,6 +33,9 @@ from qa_utilities import *
 
 # Globals
 
+# Line extraction QA module of a stats worker process (built once by its initializer, see init_stats_worker)
+stats_worker_qa_module = None
+
 # Constants
 DIRECTORY_PAGES = "pages" + os.sep
 DIRECTORY_PAGES_COLOR = "pages_color" + os.sep
@@ -54,6 +60,11 @@ WATERSHED_ERROR_FILENAME = "le_watershed_errors_*.txt"
 WATERSHED_MERGED_ERROR_FILENAME_BOOK = "le_watershed_{}_errors_{}.txt"
 WATERSHED_MERGED_ERROR_FILENAME_RUN = "le_watershed_all_errors_{}.txt"
 
+# line_df.csv columns
+LINE_DF_PAGE_SEPARATOR = "_page1r_"
+# Angle of a line's rotated rect, the last element of a "((x, y), (width, height), angle)" tuple
+LINE_RECT_ANGLE_REGEX = re.compile(r"[\)\]]\s*,\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*[\)\]]\s*$")
+
 # Eynollah files and directories
 
 EYNOLLAH_LINE_IMAGE_EXTRACTION_SCRIPT = "eynollah_line_image_extraction.py"
@@ -70,6 +81,21 @@ QA_OUTPUT_PREFIX = "le_{}_"
 RESULTS_FILENAME_PREFIX = QA_OUTPUT_PREFIX + "results_"
 ERRORS_FILENAME_PREFIX = QA_OUTPUT_PREFIX + "errors_"
 
+# Columns of the page level stats files (after "image_name")
+EYNOLLAH_PAGELEVEL_STATS_COLUMNS = [
+    "image_width",
+    "image_height",
+    "image_area",
+    "area_all_lines",
+    "num_lines",
+    "variance_line_height",
+    "median_line_height",
+    "median_norm_height"
+]
+WATERSHED_PAGELEVEL_STATS_COLUMNS = EYNOLLAH_PAGELEVEL_STATS_COLUMNS[:-1]
+# Integer columns of the page level stats files (the rest are floats)
+PAGELEVEL_STATS_INT_COLUMNS = ["image_width", "image_height", "image_area", "num_lines"]
+
 # sbatch parameters
 
 SBATCH_NTASKS_PER_NODE = "1"
@@ -89,8 +115,9 @@ class QA_LineExtraction(QA_Module):
 
         print("Entering QA_LineExtraction.__init__")
 
-        self.config = p_config
+        super().__init__(p_config)
         self.slurm_job_results = []
+        self.pipeline_booklevel_stats = {}
 
         print("Exiting QA_LineExtraction.__init__")
 
@@ -104,11 +131,9 @@ class QA_LineExtraction(QA_Module):
         if not os.path.exists(self.config[OUTPUT_DIRECTORY] + ARCHIVE_DIRECTORY):
             os.makedirs(self.config[OUTPUT_DIRECTORY] + ARCHIVE_DIRECTORY)
 
-        # 1. Move each item (that's not the archive folder or master log for this run) into the archive folder
-        for item in get_items_in_dir(self.config[OUTPUT_DIRECTORY], ["directories", "files"]):
-            if ARCHIVE_DIRECTORY != item and MASTER_LOG_FILENAME_PREFIX not in item:
-                os.rename(self.config[OUTPUT_DIRECTORY] + item,
-                    "{0}archive{1}{2}".format(self.config[OUTPUT_DIRECTORY], os.sep, item))
+        # 1. Archive each item (that's not the archive folder or master log for this run)
+        self.archive_output_items([item for item in get_items_in_dir(self.config[OUTPUT_DIRECTORY], ["directories", "files"]) \
+            if ARCHIVE_DIRECTORY != item and MASTER_LOG_FILENAME_PREFIX not in item and RUN_CATALOG_FILENAME != item])
         
         print("Exiting archive_logs")
 
@@ -151,23 +176,121 @@ class QA_LineExtraction(QA_Module):
         print("Entering QA_LineExtraction.__output_stats_on_all_books")
         
         # 1. Output a results file per book and store booklevel stats that are returned
-        booklevel_stats = {}
-        for book_name in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]):
-            if DIRECTORY_QA_RESULTS != book_name:
-                booklevel_stats[book_name] = self._Base__output_stats_on_book(format_path(self.config[BOOK_DIRECTORY] + book_name))
+        book_names = [book_name for book_name in self.directory_snapshot.get_book_names() if DIRECTORY_QA_RESULTS != book_name]
+        booklevel_stats = dict(zip(book_names, self.__map_stats_over_books(book_names)))
 
         # 2. Output one file containing booklevel stats of for whole line extraction run
         self.__output_stats_runlevel(booklevel_stats)
 
         # 3. Create a master file of all book level stats for this run for all line extraction types
-        self.__merge_booklevel_statsfiles()
+        # (from the page level stats returned for each book rather than reading back their stats files)
+        self.__merge_booklevel_statsfiles(booklevel_stats)
 
         print("Exiting QA_LineExtraction.__output_stats_on_all_books")
 
+    def __map_stats_over_books(self, p_book_names):
+
+        # 0. Number of worker processes (1 keeps all work in this process)
+        worker_count = min(get_worker_count(self.config.get(LINEEXTRACTION_STATS_WORKERS, 1)), max(1, len(p_book_names)))
+        book_directories = [format_path(self.config[BOOK_DIRECTORY] + book_name) for book_name in p_book_names]
+
+        print("Calculating stats for {0} books with {1} worker process(es)".format(len(p_book_names), worker_count))
+
+        # 1. Yield each book's stats in book order
+        # NOTE: Each worker process builds its own instance of this QA module once, then outputs its books' stats files with it
+        if worker_count > 1:
+            with ProcessPoolExecutor(max_workers=worker_count, initializer=init_stats_worker, initargs=(type(self), self.config)) as executor:
+                yield from executor.map(output_stats_on_book, book_directories)
+        else:
+            for book_directory in book_directories:
+                yield self._Base__output_stats_on_book(book_directory)
+
     @abstractmethod
     def _Base__output_stats_on_book(self, p_book_directory):
         raise NotImplementedError("Must override QA_LineExtraction.__output_stats_on_book")
 
+    def load_current_pagelevel_stats(self, p_book_directory, p_stats_filepath, p_le_type, p_line_df_filepath):
+
+        # Returns:
+        # 1. Manifest of the pages in the book's stats file (None if stats are not being output incrementally)
+        # 2. Page level stats read back from the stats file for pages that are up to date, keyed by image name
+        # 3. Whether new rows should be appended to the stats file
+        # 4. Settings to record pages in the manifest with
+
+        # NOTE: Every page's lines come from the book's line_df.csv, so all pages are recalculated if it changes
+        line_df_size, line_df_mtime_ns = get_file_signature(p_line_df_filepath)
+        settings = "{0}:{1}".format(line_df_size, line_df_mtime_ns)
+
+        if not self.config.get(INCREMENTAL_STATS, False):
+            return None, {}, False, settings
+
+        # 1. Drop rows of pages that have changed since they were written, reading back the stats of the pages
+        # that are still up to date (rows that can't be read back, e.g. cut short by a partial run, are dropped too)
+        pages_color_folder = p_book_directory + DIRECTORY_PAGES_COLOR
+        manifest = QAStatsManifest(
+            os.path.join(p_book_directory, BOOK_CACHE_DIRECTORY, STATS_MANIFEST_DIRECTORY, Path(p_stats_filepath).name + ".jsonl"),
+            p_stats_filepath)
+        current_stats = {}
+        def row_is_current(p_row):
+            if not manifest.is_current(pages_color_folder + p_row["image_name"] + ".tif", p_le_type, settings):
+                return False
+            page_stats = parse_pagelevel_stats_row(p_row)
+            if page_stats is None:
+                return False
+            current_stats[p_row["image_name"]] = page_stats
+            return True
+
+        # 2. Stats files without usable rows are written from scratch
+        if manifest.prune_stats_file(row_is_current) is None:
+            manifest.reset()
+            return manifest, {}, False, settings
+
+        print("Skipping {0} pages with up to date stats in {1}".format(len(current_stats), p_stats_filepath))
+
+        return manifest, current_stats, True, settings
+
+    # Streaming pipeline methods
+
+    def _QA_LineExtraction__collate_on_book(self, p_book_directory):
+        pass
+
+    def finish_pipeline(self):
+
+        print("Entering QA_LineExtraction.finish_pipeline")
+
+        # Master file of all books' page level stats
+        if len(self.pipeline_booklevel_stats):
+            self.__merge_booklevel_statsfiles(self.pipeline_booklevel_stats)
+
+        print("Exiting QA_LineExtraction.finish_pipeline")
+
+    @property
+    def pipeline_book_stages(self):
+        return [COMMAND_RUN, COMMAND_COLLATE, COMMAND_OUTPUT_STATS]
+
+    def start_book_stage(self, p_command_name, p_book_directory):
+
+        print("Entering QA_LineExtraction.start_book_stage for {0} on {1}".format(p_command_name, p_book_directory))
+
+        stage_jobs, sbatch_directives = [], None
+
+        # 1. Line extraction is done by a job
+        if COMMAND_RUN == p_command_name:
+            stage_jobs, sbatch_directives = [self.__get_run_job(p_book_directory)], self.get_sbatch_directives()
+
+        # 2. Errors are collated here
+        elif COMMAND_COLLATE == p_command_name:
+            self.__collate_on_book(p_book_directory)
+
+        # 3. Stats are output here, and the run level stats file is rewritten with each book that has landed so far
+        elif COMMAND_OUTPUT_STATS == p_command_name:
+            self.pipeline_booklevel_stats[Path(p_book_directory).name] = self._Base__output_stats_on_book(p_book_directory)
+            self.__output_stats_runlevel(self.pipeline_booklevel_stats)
+
+        print("Exiting QA_LineExtraction.start_book_stage")
+
+        return stage_jobs, sbatch_directives
+
     # 'run' command and helpers
 
     def run(self):
@@ -190,15 +313,49 @@ class QA_LineExtraction(QA_Module):
 
     def __run_on_all_books(self):
 
-        print("Entering/exiting __run_on_all_books")
+        print("Entering QA_LineExtraction.__run_on_all_books")
 
-        return [ self.__run_on_book(format_path(self.config[BOOK_DIRECTORY] + book_name)) \
-            for book_name in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]) \
+        # 1. Gather the line extraction job for every book
+        le_jobs = [ self.__get_run_job(format_path(self.config[BOOK_DIRECTORY] + book_name)) \
+            for book_name in self.directory_snapshot.get_book_names() \
             if Path(self.config[OUTPUT_DIRECTORY]).name != book_name ]
-    
-    @abstractmethod
+
+        # 2. Submit them together (as one job array, unless job arrays are turned off)
+        slurm_results = self.submit_jobs(le_jobs, self.get_sbatch_directives(),
+            "le_{0}_{1}".format(self.le_type, self.config[RUN_UUID]))
+
+        print("Exiting QA_LineExtraction.__run_on_all_books")
+
+        return slurm_results
+
     def _Base__run_on_book(self, p_book_directory):
-        raise NotImplementedError("Must override QA_LineExtraction.__run_on_book")
+
+        print("Entering QA_LineExtraction.__run_on_book")
+
+        # Start up a slurm job to test line extraction on this book
+        slurm_results = self.submit_jobs([self.__get_run_job(p_book_directory)], self.get_sbatch_directives(),
+            "le_{0}_{1}_{2}".format(self.le_type, Path(p_book_directory).name, self.config[RUN_UUID]))
+
+        print("Exiting QA_LineExtraction.__run_on_book")
+
+        return slurm_results
+
+    @abstractmethod
+    def _QA_LineExtraction__get_run_job(self, p_book_directory):
+        raise NotImplementedError("Must override QA_LineExtraction.__get_run_job")
+
+    def get_sbatch_directives(self):
+
+        return {
+            "--ntasks-per-node": SBATCH_NTASKS_PER_NODE,
+            "-p": SBATCH_PARTITION,
+            "-t": SBATCH_TIME
+        }
+
+    @property
+    @abstractmethod
+    def le_type(self):
+        raise NotImplementedError("Must override QA_LineExtraction.le_type")
 
 class QA_LineExtraction_Eynollah(QA_LineExtraction):
 
@@ -232,15 +389,15 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
         if RUN_TYPE_SINGLE == self.config[RUN_TYPE]:
             book_directories.append(self.config[BOOK_DIRECTORY])
         elif RUN_TYPE_MULTI == self.config[RUN_TYPE]:
-            book_directories.extend([self.config[BOOK_DIRECTORY] + directory + os.sep for directory in get_items_in_dir(format_path(self.config[BOOK_DIRECTORY]), ["directories"])])
+            book_directories.extend([self.config[BOOK_DIRECTORY] + directory + os.sep for directory in self.directory_snapshot.get_book_names()])
 
         # 2. Delete listed line extraction subdirectories in all book directories
         for book_directory in book_directories:
             for directory in directories_to_be_removed:
                 directory_to_be_removed = book_directory + directory
-                if os.path.exists(directory_to_be_removed):
-                    shutil.rmtree(directory_to_be_removed, ignore_errors=True)
-                    wait_while_exists(directory_to_be_removed)
+                if self.directory_snapshot.has_directory(book_directory, directory):
+                    self.trash.delete(directory_to_be_removed)
+        self.directory_snapshot.invalidate()
 
         print("Exiting QA_LineExtraction_Eynollah.clear_results")
 
@@ -380,6 +537,11 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
         line_df_filepath = lines_color_folder + EYNOLLAH_METADATA_FILE
         pages_color_folder = p_book_directory + DIRECTORY_PAGES_COLOR
         results_folder = format_path(p_book_directory + DIRECTORY_QA_RESULTS)
+        stats_filepath = results_folder + "{0}{1}_{2}.csv".format(
+            RESULTS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_EYNOLLAH),
+            Path(p_book_directory).name,
+            self.config[RUN_UUID]
+        )
 
         # 0. Make a folder for the new output stats file
         if not os.path.exists(results_folder):
@@ -387,159 +549,67 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
 
         # 1. Potential error file for this line extraction run for this book
         # TODO: Writing error processing hooks in eynollah line extraction scripts to output error file
-            
+
         # 2. Determine info about the lines extracted for the book pages
         if not os.path.exists(line_df_filepath):
 
             print(f"ERROR: Could not find {EYNOLLAH_METADATA_FILE} for {Path(p_book_directory).name}")
             print("Exiting QA_LineExtraction.__output_stats_on_book_watershed")
             return csv_results
-        
-        print(f"line_df_filepath: {line_df_filepath}")
-        with open(line_df_filepath, "r") as line_df_file:
-
-            csv_reader = csv.DictReader(line_df_file)
-
-            # A. Store information for each line on each page
-            for line_row in csv_reader:
-
-                print(f"Examining {EYNOLLAH_METADATA_FILE} row: {line_row}")
-
-                file_name_parts = line_row["file_name"].split("_page1r_")
-                image_name = file_name_parts[0]
-                line_number = file_name_parts[1]
-
-                if image_name not in csv_results["images"]:
-                    csv_results["images"][image_name] = { "lines": {} }
-
-                # I. Save angle of rotation, width, and height
-                try:
-                    angle_of_rotation = float(ast.literal_eval(line_row["rect"])[2])
-                except:
-                    print("ERROR: Problem reading angle of rotation for line: {0}".format(line_row["file_name"]))
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": "N/A",
-                        "width": line_row["width"],
-                        "height": line_row["height"]
-                    }
-                    continue
-
-                # a. Determine if dimensions need to be flipped due to angle
-                if math.isclose(angle_of_rotation, 90, abs_tol=1):
-
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": angle_of_rotation,
-                        "width": line_row["height"],
-                        "height": line_row["width"]
-                    }
-                elif math.isclose(angle_of_rotation, 00, abs_tol=1):
-
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": angle_of_rotation,
-                        "width": line_row["width"],
-                        "height": line_row["height"]
-                    }
-                else:
-
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": angle_of_rotation,
-                        "width": line_row["width"],
-                        "height": line_row["height"]
-                    }
-                
-                # II. Save norm height
-                csv_results["images"][image_name]["lines"][line_number]["norm_height"] = line_row["norm_height"]
-
-                # III. Save any errors from error lookup for this line
-                # NOTE: Uncomment when error processing is enabled
-                # csv_results["images"][image_name]["lines"][line_number]["error(s)"] = "N/A"
-                # if line_row["file_name"] in error_lookup:
-                #     csv_results["images"][image_name]["lines"][line_number]["error(s)"] = error_lookup[line_row["file_name"]]
-
-            # B. Calculate line metrics for page
-            for image_name in csv_results["images"]:
 
-                # I. Number of lines on page
-                csv_results["images"][image_name]["num_lines"] = len(csv_results["images"][image_name]["lines"].keys())
+        # NOTE: Pages already in the stats file from a previous output_stats are skipped if nothing has changed
+        manifest, current_stats, appending, manifest_settings = self.load_current_pagelevel_stats(
+            p_book_directory, stats_filepath, LINEEXTRACTION_TYPE_EYNOLLAH, line_df_filepath)
 
-                # II. Median height of lines on page
-                csv_results["images"][image_name]["median_line_height"] = median([
-                    float(csv_results["images"][image_name]["lines"][line_number]["height"]) \
-                        for line_number in csv_results["images"][image_name]["lines"]
-                ])
-
-                # III. Variance of line height on page
-                if len(csv_results["images"][image_name]["lines"].keys()) < 2:
-                    csv_results["images"][image_name]["variance_line_height"] = 0.0
-                else:
-                    csv_results["images"][image_name]["variance_line_height"] = variance([
-                        float(csv_results["images"][image_name]["lines"][line_number]["height"]) \
-                            for line_number in csv_results["images"][image_name]["lines"]
-                    ])
-
-                # IV. Page dimensions
-                try:
-                    img = Image.open(pages_color_folder + image_name + ".tif")
-                except UnidentifiedImageError:
-                    print(str(traceback.format_exc()))
-                    continue
-                csv_results["images"][image_name]["image_width"] = img.size[0]
-                csv_results["images"][image_name]["image_height"] = img.size[1]
-                csv_results["images"][image_name]["image_area"]  = img.size[0] * img.size[1]
-
-                # V. Area of page that is lines
-                areas = [
-                    (float(csv_results["images"][image_name]["lines"][line_number]["width"]) * \
-                    float(csv_results["images"][image_name]["lines"][line_number]["height"])) \
-                        for line_number in csv_results["images"][image_name]["lines"]
-                ]
-                csv_results["images"][image_name]["area_all_lines"] = sum(areas)
-
-                # VI. Median norm height
-                norm_heights = [
-                    float(csv_results["images"][image_name]["lines"][line_number]["norm_height"])
-                    for line_number in csv_results["images"][image_name]["lines"]      
-                ]
-                csv_results["images"][image_name]["median_norm_height"] = median(norm_heights)
-
-        # 3. Output a csv file of these stats in the line extraction results folder    
-        stats_filepath = results_folder + "{0}{1}_{2}.csv".format(
-            RESULTS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_EYNOLLAH),
-            Path(p_book_directory).name,
-            self.config[RUN_UUID]
-        )
+        print(f"line_df_filepath: {line_df_filepath}")
+        line_df = load_line_df(line_df_filepath)
+        print(f"Read {len(line_df['file_name'])} lines from {EYNOLLAH_METADATA_FILE}")
+
+        # A. Group the lines by page
+        line_groups = group_lines_by_page(line_df, current_stats)
+
+        # B. Calculate line metrics for page (reading the pages' dimensions from the book's page index up front)
+        csv_results["images"] = aggregate_lines_by_page(line_groups, line_df["width"], line_df["height"], line_df["norm_height"])
+        page_metadata = QAPageIndex(p_book_directory).get_pages(
+            [pages_color_folder + image_name + ".tif" for image_name in csv_results["images"]])
+        for image_name in csv_results["images"]:
+
+            # I. Page dimensions (from the book's page index)
+            # NOTE: Pages that are missing or can't be read get N/A dimensions, which are left out of the book level stats
+            # (and are read again by the next output_stats, as their rows don't read back as page stats)
+            metadata = page_metadata[pages_color_folder + image_name + ".tif"]
+            if metadata is None:
+                print("WARNING: Could not read the dimensions of page {0}{1}.tif".format(pages_color_folder, image_name))
+                csv_results["images"][image_name]["image_width"] = "N/A"
+                csv_results["images"][image_name]["image_height"] = "N/A"
+                csv_results["images"][image_name]["image_area"] = "N/A"
+                continue
+            csv_results["images"][image_name]["image_width"] = metadata["width"]
+            csv_results["images"][image_name]["image_height"] = metadata["height"]
+            csv_results["images"][image_name]["image_area"]  = metadata["width"] * metadata["height"]
 
-        with open(stats_filepath, "w") as output_file:
+        # 3. Output a csv file of these stats in the line extraction results folder
+        # (or add the new pages' stats to the end of the one from a previous output_stats)
+        with open(stats_filepath, "a" if appending else "w") as output_file:
 
             print(f"Writing stats file for book {Path(stats_filepath).name}")
 
             csv_writer = csv.writer(output_file)
 
-            csv_writer.writerow([
-                "image_name",
-                "image_width",
-                "image_height",                    
-                "image_area",
-                "area_all_lines",
-                "num_lines",
-                "variance_line_height",
-                "median_line_height",
-                "median_norm_height"
-            ])
+            if not appending:
+                csv_writer.writerow(["image_name"] + EYNOLLAH_PAGELEVEL_STATS_COLUMNS)
 
             for image_name in csv_results["images"]:
+                csv_writer.writerow([image_name] + [csv_results["images"][image_name][column] for column in EYNOLLAH_PAGELEVEL_STATS_COLUMNS])
 
-                csv_writer.writerow([
-                    image_name,
-                    csv_results["images"][image_name]["image_width"],
-                    csv_results["images"][image_name]["image_height"],
-                    csv_results["images"][image_name]["image_area"],
-                    csv_results["images"][image_name]["area_all_lines"],
-                    csv_results["images"][image_name]["num_lines"],
-                    csv_results["images"][image_name]["variance_line_height"],
-                    csv_results["images"][image_name]["median_line_height"],
-                    csv_results["images"][image_name]["median_norm_height"]
-                ])
+        # 4. Note the pages now in the stats file and add back the stats of pages that were skipped
+        if manifest is not None:
+            for image_name in csv_results["images"]:
+                manifest.record(pages_color_folder + image_name + ".tif", LINEEXTRACTION_TYPE_EYNOLLAH, manifest_settings)
+            manifest.save()
+        # NOTE: Skipped pages come first, as their rows do in the stats file
+        csv_results["images"] = { **current_stats, **csv_results["images"] }
+        self.record_artifact(stats_filepath, Path(p_book_directory).name, ARTIFACT_STATS)
 
         print("Exiting QA_LineExtraction_Eynollah.__output_stats_on_book_eynollah")                
         
@@ -574,7 +644,9 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
 
             # Images
 
-            # Dimensions
+            # Dimensions (of pages that could be read)
+            if "N/A" == p_pagelevel_stats["images"][image_name]["image_width"]:
+                continue
             image_widths.append(p_pagelevel_stats["images"][image_name]["image_width"])
             image_heights.append(p_pagelevel_stats["images"][image_name]["image_height"])
             image_areas.append(p_pagelevel_stats["images"][image_name]["image_area"])
@@ -639,13 +711,14 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
 
         if len(p_pagelevel_stats["images"]) > 0:
             booklevel_stats["median_area_all_lines"] = median(areas_all_lines)
-            booklevel_stats["median_image_area"] = median(image_areas)
-            booklevel_stats["median_image_height"] = median(image_heights)
-            booklevel_stats["median_image_width"] = median(image_widths)
             booklevel_stats["median_line_height_median"] = median(line_height_medians)
             booklevel_stats["median_line_norm_height_median"] = median(line_norm_height_medians)
             booklevel_stats["median_page_line_count"] = median(line_counts)
             booklevel_stats["median_variance_line_height"] = median(line_height_variances)
+        if len(image_widths) > 0:
+            booklevel_stats["median_image_area"] = median(image_areas)
+            booklevel_stats["median_image_height"] = median(image_heights)
+            booklevel_stats["median_image_width"] = median(image_widths)
 
         # NOTE: Uncomment when error processing for eynollah is enabled
         # booklevel_stats["total_errors"] = total_errors
@@ -658,7 +731,7 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
 
         return booklevel_stats
 
-    def __merge_booklevel_statsfiles(self):
+    def _QA_LineExtraction__merge_booklevel_statsfiles(self, p_booklevel_stats):
 
         print("Entering QA_LineExtraction_Eynollah.__merge_booklevel_statsfiles")
 
@@ -666,28 +739,21 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
 
         with open(self.config[OUTPUT_DIRECTORY] + master_stats_filename, "w") as output_file:
 
-            # 1. Read the outputted stats file for each book and write it to the master stats file
-            header_written = False
-            for book_directory in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]):
+            # NOTE: Rows end in plain newlines, as those read back from the books' stats files did
+            csv_writer = csv.writer(output_file, lineterminator="\n")
+            csv_writer.writerow(["image_name"] + EYNOLLAH_PAGELEVEL_STATS_COLUMNS)
 
-                results_directory = format_path(self.config[BOOK_DIRECTORY] + book_directory + os.sep + DIRECTORY_QA_RESULTS)
-                bookstats_filename =  "{0}{1}_{2}.csv".format(
-                    RESULTS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_EYNOLLAH),
-                    book_directory,
-                    self.config[RUN_UUID]
-                )
+            # 1. Write the page level stats of each book (the rows of its stats file) to the master stats file
+            for book_name in self.directory_snapshot.get_book_names():
 
-                if not os.path.exists(results_directory + bookstats_filename):
-                    print("ERROR: Stats file does not exist for {0} at {1}".format(book_directory, results_directory + bookstats_filename))
-                    continue 
+                if book_name not in p_booklevel_stats:
+                    continue
 
-                # Add the book stats file contents to the master stats file (skipping the header if already written)
-                with open(results_directory + bookstats_filename, "r") as input_file:
-                    
-                    output_file.writelines(input_file.readlines()[1:] if header_written else input_file.readlines())
-                    header_written = True
+                pagelevel_stats = p_booklevel_stats[book_name]["page"]["images"]
+                for image_name in pagelevel_stats:
+                    csv_writer.writerow([image_name] + [pagelevel_stats[image_name][column] for column in EYNOLLAH_PAGELEVEL_STATS_COLUMNS])
 
-        print("Exiting QA_LineExtraction_Eynollah.__merge_booklevel_statsfiles_watershed")
+        print("Exiting QA_LineExtraction_Eynollah.__merge_booklevel_statsfiles")
 
     def _QA_LineExtraction__output_stats_runlevel(self, p_booklevel_stats):
 
@@ -737,58 +803,35 @@ class QA_LineExtraction_Eynollah(QA_LineExtraction):
                     p_booklevel_stats[book_name]["book"]["median_variance_line_height"],
                     p_booklevel_stats[book_name]["book"]["median_line_norm_height_median"]
                 ])                    
+        self.record_artifact(results_filepath, "", ARTIFACT_RUN_RESULTS)
 
         print("Exiting QA_LineExtraction_Eynollah.__output_stats_runlevel")
 
     # 'run' helpers
 
-    def _Base__run_on_book(self, p_book_directory):
-
-        print("Entering QA_LineExtraction_Eynollah.__run_on_book")
+    def _QA_LineExtraction__get_run_job(self, p_book_directory):
 
         book_name = Path(p_book_directory).name
-        slurm_results = []       
-        
-        # 1. Start up slurm jobs to test the Eynollah line extraction methods on this book        
-        print("Creating slurm job for QA of line extraction {0} with line extraction type {1}".format(book_name, LINEEXTRACTION_TYPE_EYNOLLAH))
-
-        # A. Run line extraction on the book with the given arguments
 
-        # I. sbatch arguments
-        sbatch_directives = {
+        print("Creating slurm job for QA of line extraction {0} with line extraction type {1}".format(book_name, LINEEXTRACTION_TYPE_EYNOLLAH))
 
-            "-ntasks-per-node": SBATCH_NTASKS_PER_NODE,
-            "-o": "{0}slurm-{1}_{2}_{3}.out".format(
+        # Run line extraction on the book via the eynollah QA shell script
+        return QAJob(
+            "{0}_{1}_{2}".format(book_name, LINEEXTRACTION_TYPE_EYNOLLAH, self.config[RUN_UUID]),
+            "bash {0}{1}qa_line_extraction_eynollah.sh {2} {3}".format(
+                os.getcwd(), os.sep,
+                p_book_directory, self.config[RUN_UUID]),
+            "{0}slurm-{1}_{2}_{3}.out".format(
                 self.config[OUTPUT_DIRECTORY],
                 book_name,
                 LINEEXTRACTION_TYPE_EYNOLLAH,
                 self.config[RUN_UUID]),
-            "-p": SBATCH_PARTITION,                
-            "-t": SBATCH_TIME
-        }        
-
-        # II. Build the sbatch call
-        subprocess_cmd = "sbatch"
-        for arg in sbatch_directives:
-            subprocess_cmd += " {0} {1}".format(arg, sbatch_directives[arg])
-        subprocess_cmd += " {0}{1}qa_line_extraction_eynollah.sh {2} {3} {4}".format(
-            os.getcwd(), os.sep,
-            p_book_directory, self.config[RUN_UUID])
-
-        # III. Run sbatch and save results
-        slurm_results.append(
-            subprocess.Popen(
-                subprocess_cmd,
-                shell=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                text=True
-            )
+            p_book_directory
         )
 
-        print("Exiting QA_LineExtraction_Eynollah.__run_on_book")           
-        
-        return slurm_results
+    @property
+    def le_type(self):
+        return LINEEXTRACTION_TYPE_EYNOLLAH
 
 class QA_LineExtraction_Watershed(QA_LineExtraction):
 
@@ -813,15 +856,15 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
         if RUN_TYPE_SINGLE == self.config[RUN_TYPE]:
             book_directories.append(self.config[BOOK_DIRECTORY])
         elif RUN_TYPE_MULTI == self.config[RUN_TYPE]:
-            book_directories.extend([self.config[BOOK_DIRECTORY] + directory + os.sep for directory in get_items_in_dir(format_path(self.config[BOOK_DIRECTORY]), ["directories"])])
+            book_directories.extend([self.config[BOOK_DIRECTORY] + directory + os.sep for directory in self.directory_snapshot.get_book_names()])
 
         # 2. Delete listed line extraction subdirectories in all book directories
         for book_directory in book_directories:
             for directory in directories_to_be_removed:
                 directory_to_be_removed = book_directory + directory
-                if os.path.exists(directory_to_be_removed):
-                    shutil.rmtree(directory_to_be_removed, ignore_errors=True)
-                    wait_while_exists(directory_to_be_removed)
+                if self.directory_snapshot.has_directory(book_directory, directory):
+                    self.trash.delete(directory_to_be_removed)
+        self.directory_snapshot.invalidate()
 
         print("Exiting QA_LineExtraction_Watershed.clear_results")
 
@@ -847,7 +890,7 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
         if RUN_TYPE_SINGLE == self.config[RUN_TYPE]:
             self.__collate_errors_on_book(self.config[BOOK_DIRECTORY])
         elif RUN_TYPE_MULTI == self.config[RUN_TYPE]:
-            for book_directory in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]):
+            for book_directory in self.directory_snapshot.get_book_names():
                 self.__collate_errors_on_book(format_path(self.config[BOOK_DIRECTORY] + book_directory))
             
         # 2. Merge all errors into one file in the output directory
@@ -900,39 +943,48 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
         if RUN_TYPE_SINGLE == self.config[RUN_TYPE]:
             book_directories = [self.config[BOOK_DIRECTORY]]
         elif RUN_TYPE_MULTI == self.config[RUN_TYPE]:
-            for book_directory in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]):
+            for book_directory in self.directory_snapshot.get_book_names():
                 book_directories.append(self.config[BOOK_DIRECTORY] + os.sep + book_directory + os.sep)
 
         # 2. Add errors to a master error file in the output directory
         for book_directory in book_directories:
-            
-            results_directory = book_directory + DIRECTORY_QA_RESULTS + os.sep
-            combined_error_filepath = results_directory + \
-                "{0}{1}_{2}.csv".format(ERRORS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_WATERSHED),
-                                        Path(book_directory).name, self.config[RUN_UUID])
-            merge_all_filepath = self.config[OUTPUT_DIRECTORY] + WATERSHED_MERGED_ERROR_FILENAME_RUN.format(self.config[RUN_UUID])
-            
-            # A. Read in errors from this file
-            error_lookup = {}
-            with open(combined_error_filepath, "r") as input_file:
-                csv_reader = csv.DictReader(input_file)
-                for row in csv_reader:
-                    error_lookup[row["error_source"]] = row["error"]
+            self.__add_book_errors_to_run_errors(book_directory)
 
-            # B. Add the errors to the merged master error file
-            write_header = False
-            if not os.path.exists(merge_all_filepath):
-                write_header = True
+        print("Exiting QA_LineExtraction_Watershed.__collate_all_errors")
+
+    def __add_book_errors_to_run_errors(self, p_book_directory):
+
+        results_directory = p_book_directory + DIRECTORY_QA_RESULTS + os.sep
+        combined_error_filepath = results_directory + \
+            "{0}{1}_{2}.csv".format(ERRORS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_WATERSHED),
+                                    Path(p_book_directory).name, self.config[RUN_UUID])
+        merge_all_filepath = self.config[OUTPUT_DIRECTORY] + WATERSHED_MERGED_ERROR_FILENAME_RUN.format(self.config[RUN_UUID])
+        
+        # A. Read in errors from this file
+        error_lookup = {}
+        with open(combined_error_filepath, "r") as input_file:
+            csv_reader = csv.DictReader(input_file)
+            for row in csv_reader:
+                error_lookup[row["error_source"]] = row["error"]
 
-            with open(merge_all_filepath, "a") as output_file:
+        # B. Add the errors to the merged master error file
+        write_header = False
+        if not os.path.exists(merge_all_filepath):
+            write_header = True
 
-                if write_header:
-                    output_file.write("error_source,error\n")
+        with open(merge_all_filepath, "a") as output_file:
 
-                for error_source in error_lookup:
-                    output_file.write(f"{error_source},{error_lookup[error_source]}\n")
+            if write_header:
+                output_file.write("error_source,error\n")
 
-        print("Exiting QA_LineExtraction_Watershed.__collate_all_errors")
+            for error_source in error_lookup:
+                output_file.write(f"{error_source},{error_lookup[error_source]}\n")
+
+    def _QA_LineExtraction__collate_on_book(self, p_book_directory):
+
+        # Streaming pipeline collation: this book's errors, added to the run's merged errors
+        self.__collate_errors_on_book(p_book_directory)
+        self.__add_book_errors_to_run_errors(p_book_directory)
                 
     # 'output_stats' helpers
 
@@ -946,7 +998,7 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
         csv_results["page"] = self.__output_stats_on_book_watershed(p_book_directory)
 
         # 2. Tally book stats for potential use outside of function
-        csv_results["book"] = self.__tally_booklevel_stats_watershed(p_book_directory, csv_results[le_type]["page"])
+        csv_results["book"] = self.__tally_booklevel_stats_watershed(p_book_directory, csv_results["page"])
 
         print("Exiting QA_LineExtraction_Watershed.__output_stats_on_book")
 
@@ -962,22 +1014,18 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
         line_df_filepath = lines_color_folder + LINEEXTRACTION_WATERSHED_METADATA_FILE
         pages_color_folder = p_book_directory + DIRECTORY_PAGES_COLOR
         results_folder = format_path(p_book_directory + DIRECTORY_QA_RESULTS)
+        stats_filepath = results_folder + "{0}{1}_{2}.csv".format(
+            RESULTS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_WATERSHED),
+            Path(p_book_directory).name,
+            self.config[RUN_UUID]
+        )
 
         # 0. Make a folder for the new output stats file
         if not os.path.exists(results_folder):
             os.makedirs(results_folder)
 
         # 1. Potential error file for this line extraction run for this book
-        error_lookup = {}
-        error_filepath = ""
-        for filepath in glob.glob(results_folder + WATERSHED_MERGED_ERROR_FILENAME_BOOK.replace("{}", "*")):
-            error_filepath = filepath
-            break
-        if error_filepath:
-            with open(error_filepath, "r") as merged_error_file:
-                csv_reader = csv.DictReader(merged_error_file)
-                for row in csv_reader:
-                    error_lookup[row["error_source"]] = row["error"]
+        # NOTE: Line errors are tallied from the book's merged error file in __tally_booklevel_stats_watershed
 
         # 2. Determine info about the lines extracted for the book pages
 
@@ -987,141 +1035,62 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
             print("Exiting QA_LineExtraction.__output_stats_on_book_watershed")
             return csv_results
         
-        with open(line_df_filepath, "r") as line_df_file:
-
-            csv_reader = csv.DictReader(line_df_file)
-
-            if 0 == len(list(csv_reader)):
-                print(f"ERROR: Line extraction output file {LINEEXTRACTION_WATERSHED_METADATA_FILE} is empty.")
-                print("Exiting QA_LineExtraction.__output_stats_on_book_watershed")
-                return csv_results
-
-            # A. Store information for each line on each page
-            for line_row in csv_reader:
-
-                file_name_parts = line_row["file_name"].split("_page1r_")
-                image_name = file_name_parts[0]
-                line_number = file_name_parts[1]
-
-                if image_name not in csv_results["images"]:
-                    csv_results["images"][image_name] = { "lines": {} }
-
-                # I. Save angle of rotation, width, and height
-                try:
-                    angle_of_rotation = float(ast.literal_eval(line_row["rect"])[2])
-                except:
-                    print("ERROR: Problem reading angle of rotation for line: {0}".format(line_row["file_name"]))
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": "N/A",
-                        "width": line_row["width"],
-                        "height": line_row["height"]
-                    }
-                    continue
-
-                # a. Determine if dimensions need to be flipped due to angle
-                if math.isclose(angle_of_rotation, 90, abs_tol=1):
-
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": angle_of_rotation,
-                        "width": line_row["height"],
-                        "height": line_row["width"]
-                    }
-                elif math.isclose(angle_of_rotation, 00, abs_tol=1):
-
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": angle_of_rotation,
-                        "width": line_row["width"],
-                        "height": line_row["height"]
-                    }
-                else:
-
-                    csv_results["images"][image_name]["lines"][line_number] = {
-                        "angle": angle_of_rotation,
-                        "width": line_row["width"],
-                        "height": line_row["height"]
-                    }
-
-                # II. Save any errors from error lookup for this line
-                csv_results["images"][image_name]["lines"][line_number]["error(s)"] = "N/A"
-                if line_row["file_name"] in error_lookup:
-                    csv_results["images"][image_name]["lines"][line_number]["error(s)"] = error_lookup[line_row["file_name"]]
-
-            # B. Calculate line metrics for page
-            for image_name in csv_results["images"]:
+        # NOTE: Pages already in the stats file from a previous output_stats are skipped if nothing has changed
+        manifest, current_stats, appending, manifest_settings = self.load_current_pagelevel_stats(
+            p_book_directory, stats_filepath, LINEEXTRACTION_TYPE_WATERSHED, line_df_filepath)
 
-                # I. Number of lines on page
-                csv_results["images"][image_name]["num_lines"] = len(csv_results["images"][image_name]["lines"].keys())
+        line_df = load_line_df(line_df_filepath)
 
-                # II. Median height of lines on page
-                csv_results["images"][image_name]["median_line_height"] = median([
-                    float(csv_results["images"][image_name]["lines"][line_number]["height"]) \
-                        for line_number in csv_results["images"][image_name]["lines"]
-                ])
+        if 0 == len(line_df["file_name"]):
+            print(f"ERROR: Line extraction output file {LINEEXTRACTION_WATERSHED_METADATA_FILE} is empty.")
+            print("Exiting QA_LineExtraction.__output_stats_on_book_watershed")
+            return csv_results
 
-                # III. Variance of line height on page
-                if len(csv_results["images"][image_name]["lines"].keys()) < 2:
-                    csv_results["images"][image_name]["variance_line_height"] = 0.0
-                else:
-                    csv_results["images"][image_name]["variance_line_height"] = variance([
-                        float(csv_results["images"][image_name]["lines"][line_number]["height"]) \
-                            for line_number in csv_results["images"][image_name]["lines"]
-                    ])
-
-                # IV. Page dimensions
-                try:
-                    img = Image.open(pages_color_folder + image_name + ".tif")
-                except UnidentifiedImageError:
-                    print(str(traceback.format_exc()))
-                    continue
-                csv_results["images"][image_name]["image_width"] = img.size[0]
-                csv_results["images"][image_name]["image_height"] = img.size[1]
-                csv_results["images"][image_name]["image_area"]  = img.size[0] * img.size[1]
-
-                # V. Area of page that is lines
-                areas = [
-                    (float(csv_results["images"][image_name]["lines"][line_number]["width"]) * \
-                    float(csv_results["images"][image_name]["lines"][line_number]["height"])) \
-                        for line_number in csv_results["images"][image_name]["lines"]
-                ]
-                csv_results["images"][image_name]["area_all_lines"] = sum(areas)
+        # A. Group the lines by page
+        line_groups = group_lines_by_page(line_df, current_stats)
+
+        # B. Calculate line metrics for page (reading the pages' dimensions from the book's page index up front)
+        csv_results["images"] = aggregate_lines_by_page(line_groups, line_df["width"], line_df["height"])
+        page_metadata = QAPageIndex(p_book_directory).get_pages(
+            [pages_color_folder + image_name + ".tif" for image_name in csv_results["images"]])
+        for image_name in csv_results["images"]:
+
+            # I. Page dimensions (from the book's page index)
+            # NOTE: Pages that are missing or can't be read get N/A dimensions, which are left out of the book level stats
+            # (and are read again by the next output_stats, as their rows don't read back as page stats)
+            metadata = page_metadata[pages_color_folder + image_name + ".tif"]
+            if metadata is None:
+                print("WARNING: Could not read the dimensions of page {0}{1}.tif".format(pages_color_folder, image_name))
+                csv_results["images"][image_name]["image_width"] = "N/A"
+                csv_results["images"][image_name]["image_height"] = "N/A"
+                csv_results["images"][image_name]["image_area"] = "N/A"
+                continue
+            csv_results["images"][image_name]["image_width"] = metadata["width"]
+            csv_results["images"][image_name]["image_height"] = metadata["height"]
+            csv_results["images"][image_name]["image_area"]  = metadata["width"] * metadata["height"]
 
         # 3. Output a csv file of these stats in the line extraction results folder
-
-        stats_filepath = results_folder + "{0}{1}_{2}.csv".format(
-            RESULTS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_WATERSHED),
-            Path(p_book_directory).name,
-            self.config[RUN_UUID]
-        )
-
-        with open(stats_filepath, "w") as output_file:
+        # (or add the new pages' stats to the end of the one from a previous output_stats)
+        with open(stats_filepath, "a" if appending else "w") as output_file:
 
             print(f"Writing stats file for book {Path(stats_filepath).name}")
 
             csv_writer = csv.writer(output_file)
 
-            csv_writer.writerow([
-                "image_name",
-                "image_width",
-                "image_height",                    
-                "image_area",
-                "area_all_lines",
-                "num_lines",
-                "variance_line_height",
-                "median_line_height"
-            ])
+            if not appending:
+                csv_writer.writerow(["image_name"] + WATERSHED_PAGELEVEL_STATS_COLUMNS)
 
             for image_name in csv_results["images"]:
+                csv_writer.writerow([image_name] + [csv_results["images"][image_name][column] for column in WATERSHED_PAGELEVEL_STATS_COLUMNS])
 
-                csv_writer.writerow([
-                    image_name,
-                    csv_results["images"][image_name]["image_width"],
-                    csv_results["images"][image_name]["image_height"],
-                    csv_results["images"][image_name]["image_area"],
-                    csv_results["images"][image_name]["area_all_lines"],
-                    csv_results["images"][image_name]["num_lines"],
-                    csv_results["images"][image_name]["variance_line_height"],
-                    csv_results["images"][image_name]["median_line_height"]
-                ])
+        # 4. Note the pages now in the stats file and add back the stats of pages that were skipped
+        if manifest is not None:
+            for image_name in csv_results["images"]:
+                manifest.record(pages_color_folder + image_name + ".tif", LINEEXTRACTION_TYPE_WATERSHED, manifest_settings)
+            manifest.save()
+        # NOTE: Skipped pages come first, as their rows do in the stats file
+        csv_results["images"] = { **current_stats, **csv_results["images"] }
+        self.record_artifact(stats_filepath, Path(p_book_directory).name, ARTIFACT_STATS)
 
         print("Exiting QA_LineExtraction_Watershed.__output_stats_on_book_watershed")                
         
@@ -1154,7 +1123,9 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
 
             # Images
 
-            # Dimensions
+            # Dimensions (of pages that could be read)
+            if "N/A" == p_pagelevel_stats["images"][image_name]["image_width"]:
+                continue
             image_widths.append(p_pagelevel_stats["images"][image_name]["image_width"])
             image_heights.append(p_pagelevel_stats["images"][image_name]["image_height"])
             image_areas.append(p_pagelevel_stats["images"][image_name]["image_area"])
@@ -1217,12 +1188,13 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
 
         if len(p_pagelevel_stats["images"]) > 0:
             booklevel_stats["median_area_all_lines"] = median(areas_all_lines)
-            booklevel_stats["median_image_area"] = median(image_areas)
-            booklevel_stats["median_image_height"] = median(image_heights)
-            booklevel_stats["median_image_width"] = median(image_widths)
             booklevel_stats["median_line_height_median"] = median(line_height_medians)
             booklevel_stats["median_page_line_count"] = median(line_counts)
             booklevel_stats["median_variance_line_height"] = median(line_height_variances)
+        if len(image_widths) > 0:
+            booklevel_stats["median_image_area"] = median(image_areas)
+            booklevel_stats["median_image_height"] = median(image_heights)
+            booklevel_stats["median_image_width"] = median(image_widths)
 
         booklevel_stats["total_errors"] = total_errors
         booklevel_stats["total_unique_errors"] = total_unique_errors
@@ -1233,7 +1205,7 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
 
         return booklevel_stats      
 
-    def __merge_booklevel_statsfiles(self):
+    def _QA_LineExtraction__merge_booklevel_statsfiles(self, p_booklevel_stats):
 
         print("Entering QA_LineExtraction_Watershed.__merge_booklevel_statsfiles")
 
@@ -1241,26 +1213,19 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
 
         with open(self.config[OUTPUT_DIRECTORY] + master_stats_filename, "w") as output_file:
 
-            # 1. Read the outputted stats file for each book and write it to the master stats file
-            header_written = False
-            for book_directory in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]):
+            # NOTE: Rows end in plain newlines, as those read back from the books' stats files did
+            csv_writer = csv.writer(output_file, lineterminator="\n")
+            csv_writer.writerow(["image_name"] + WATERSHED_PAGELEVEL_STATS_COLUMNS)
 
-                results_directory = format_path(self.config[BOOK_DIRECTORY] + book_directory + os.sep + DIRECTORY_QA_RESULTS)
-                bookstats_filename =  "{0}{1}_{2}.csv".format(
-                    RESULTS_FILENAME_PREFIX.format(LINEEXTRACTION_TYPE_WATERSHED),
-                    book_directory,
-                    self.config[RUN_UUID]
-                )
+            # 1. Write the page level stats of each book (the rows of its stats file) to the master stats file
+            for book_name in self.directory_snapshot.get_book_names():
 
-                if not os.path.exists(results_directory + bookstats_filename):
-                    print("ERROR: Stats file does not exist for {0} at {1}".format(book_directory, results_directory + bookstats_filename))
-                    continue 
+                if book_name not in p_booklevel_stats:
+                    continue
 
-                # Add the book stats file contents to the master stats file (skipping the header if already written)
-                with open(results_directory + bookstats_filename, "r") as input_file:
-                    
-                    output_file.writelines(input_file.readlines()[1:] if header_written else input_file.readlines())
-                    header_written = True
+                pagelevel_stats = p_booklevel_stats[book_name]["page"]["images"]
+                for image_name in pagelevel_stats:
+                    csv_writer.writerow([image_name] + [pagelevel_stats[image_name][column] for column in WATERSHED_PAGELEVEL_STATS_COLUMNS])
 
         print("Exiting QA_LineExtraction_Watershed.__merge_booklevel_statsfiles")
 
@@ -1296,66 +1261,199 @@ class QA_LineExtraction_Watershed(QA_LineExtraction):
                 csv_writer.writerow([
 
                     book_name,
-                    p_booklevel_stats[book_name]["total_pages"],
-                    p_booklevel_stats[book_name]["total_lines"],
-                    p_booklevel_stats[book_name]["total_errors"],
-                    p_booklevel_stats[book_name]["total_unique_errors"],
-                    p_booklevel_stats[book_name]["median_image_width"],
-                    p_booklevel_stats[book_name]["median_image_height"],
-                    p_booklevel_stats[book_name]["median_image_area"],
-                    p_booklevel_stats[book_name]["median_area_all_lines"],
-                    p_booklevel_stats[book_name]["median_line_height_median"],
-                    p_booklevel_stats[book_name]["median_variance_line_height"]
+                    p_booklevel_stats[book_name]["book"]["total_pages"],
+                    p_booklevel_stats[book_name]["book"]["total_lines"],
+                    p_booklevel_stats[book_name]["book"]["total_errors"],
+                    p_booklevel_stats[book_name]["book"]["total_unique_errors"],
+                    p_booklevel_stats[book_name]["book"]["median_image_width"],
+                    p_booklevel_stats[book_name]["book"]["median_image_height"],
+                    p_booklevel_stats[book_name]["book"]["median_image_area"],
+                    p_booklevel_stats[book_name]["book"]["median_area_all_lines"],
+                    p_booklevel_stats[book_name]["book"]["median_line_height_median"],
+                    p_booklevel_stats[book_name]["book"]["median_variance_line_height"]
                 ])
+        self.record_artifact(results_filepath, "", ARTIFACT_RUN_RESULTS)
 
         print("Exiting QA_LineExtraction_Watershed.__output_stats_runlevel")
 
     # 'run' helpers
 
-    def _Base__run_on_book(self, p_book_directory):
-
-        print("Entering QA_LineExtraction_Watershed.__run_on_book")
+    def _QA_LineExtraction__get_run_job(self, p_book_directory):
 
         book_name = Path(p_book_directory).name
-        slurm_results = []       
-        
-        # 1. Start up slurm jobs to test watershed line extraction on this book
-        
+
         print("Creating slurm job for QA of line extraction {0} with line extraction type {1}".format(book_name, LINEEXTRACTION_TYPE_WATERSHED))
 
-        # A. Run line extraction on the book with the given arguments
+        # Run line extraction on the book via the line extraction QA shell script
+        return QAJob(
+            "{0}_{1}_{2}".format(book_name, LINEEXTRACTION_TYPE_WATERSHED, self.config[RUN_UUID]),
+            "bash {0}{1}qa_line_extraction_final.sh {2} {3} {4} {5}".format(
+                os.getcwd(), os.sep,
+                LINEEXTRACTION_TYPE_WATERSHED, p_book_directory, self.config[RUN_UUID],
+                self.config.get(PAGE_STAGING, STAGING_COPY)),
+            "{0}slurm-{1}_{2}_{3}.out".format(self.config[OUTPUT_DIRECTORY], book_name, LINEEXTRACTION_TYPE_WATERSHED, self.config[RUN_UUID]),
+            p_book_directory,
+            p_environment=ENVIRONMENT_WATERSHED
+        )
 
-        # I. sbatch arguments
-        sbatch_directives = {
+    @property
+    def le_type(self):
+        return LINEEXTRACTION_TYPE_WATERSHED
 
-            "--ntasks-per-node": SBATCH_NTASKS_PER_NODE,
-            "-o": "{0}slurm-{1}_{2}_{3}.out".format(self.config[OUTPUT_DIRECTORY], book_name, le_type, self.config[RUN_UUID]),
-            "-p": SBATCH_PARTITION,                
-            "-t": SBATCH_TIME
-        }
+# Functions
 
-        # II. Build the sbatch call
-        subprocess_cmd = "sbatch"
-        for arg in sbatch_directives:
-            subprocess_cmd += " {0} {1}".format(arg, sbatch_directives[arg])
-        subprocess_cmd += " {0}{1}qa_line_extraction_final.sh {2} {3} {4}".format(
-            os.getcwd(), os.sep,
-            le_type, p_book_directory, self.config[RUN_UUID])
-
-        # III. Run sbatch and save results
-        slurm_results.append(
-            subprocess.Popen(
-                subprocess_cmd,
-                shell=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                text=True
-            )
-        )
+def aggregate_lines_by_page(p_line_groups, p_widths, p_heights, p_norm_heights=None):
 
-        print("Exiting QA_LineExtraction_Watershed.__run_on_book")           
-        
-        return slurm_results
+    ''' Calculates each page's line metrics from lines grouped by group_lines_by_page
+        NOTE: Values match those of statistics.median/variance and sum() over the page's lines in line_df order '''
+
+    page_names, rows, starts = p_line_groups
+    counts = np.diff(np.append(starts, len(rows)))
+    page_of_row = np.repeat(np.arange(len(page_names)), counts)
+
+    # 1. Median of each page's values (sorted within each page in one pass)
+    def segmented_median(p_values):
+
+        sorted_values = p_values[np.lexsort((p_values, page_of_row))]
+        middles = starts + counts // 2
+        medians = sorted_values[middles]
+        even = 0 == counts % 2
+        medians[even] = (sorted_values[middles[even] - 1] + sorted_values[middles[even]]) / 2
+        return medians.tolist()
+
+    heights = p_heights[rows]
+    line_areas = (p_widths[rows] * p_heights[rows]).tolist()
+    line_heights = heights.tolist()
+    median_line_heights = segmented_median(heights)
+    if p_norm_heights is not None:
+        median_norm_heights = segmented_median(p_norm_heights[rows])
+
+    # 2. Metrics for each page
+    page_stats = {}
+    for index, page_name in enumerate(page_names):
+
+        start = starts[index]
+        end = start + counts[index]
+        page_stats[page_name] = {
+            "num_lines": int(counts[index]),
+            "median_line_height": median_line_heights[index],
+
+            # NOTE: variance is left to statistics (exact over the page's lines) and the area total to
+            # sum() (added in line order), since numpy's pairwise sums can differ in the last bits
+            "variance_line_height": 0.0 if counts[index] < 2 else variance(line_heights[start:end]),
+            "area_all_lines": sum(line_areas[start:end])
+        }
+        if p_norm_heights is not None:
+            page_stats[page_name]["median_norm_height"] = median_norm_heights[index]
+
+    return page_stats
+
+def group_lines_by_page(p_line_df, p_skip_pages):
+
+    ''' Groups the lines of a line_df by page, pages and their lines ordered by first appearance
+        (a line listed more than once takes its last row), and skipping any pages given.
+        Returns the page names, the line_df rows of the lines sorted by page, and the start of each page's rows '''
+
+    image_names = np.array(p_line_df["image_name"], dtype=str)
+    line_numbers = np.array(p_line_df["line_number"], dtype=str)
+
+    # 1. Drop the lines of skipped pages
+    kept_rows = np.flatnonzero(~np.isin(image_names, list(p_skip_pages))) if len(p_skip_pages) else np.arange(len(image_names))
+
+    # 2. One row per line, its last row, in order of the line's first appearance
+    line_keys = np.char.add(np.char.add(image_names[kept_rows], LINE_DF_PAGE_SEPARATOR), line_numbers[kept_rows])
+    _, first_rows, line_ids = np.unique(line_keys, return_index=True, return_inverse=True)
+    last_rows = np.zeros(len(first_rows), dtype=np.int64)
+    np.maximum.at(last_rows, line_ids.ravel(), np.arange(len(kept_rows)))
+    rows = kept_rows[last_rows[np.argsort(first_rows, kind="stable")]]
+
+    # 3. Sort the lines by page (stable, so each page's lines keep their order) with pages by first appearance
+    page_names, page_first_rows, page_ids = np.unique(image_names[rows], return_index=True, return_inverse=True)
+    page_order = np.argsort(page_first_rows, kind="stable")
+    page_ranks = np.empty(len(page_order), dtype=np.int64)
+    page_ranks[page_order] = np.arange(len(page_order))
+    row_page_ranks = page_ranks[page_ids.ravel()]
+    by_page = np.argsort(row_page_ranks, kind="stable")
+    starts = np.searchsorted(row_page_ranks[by_page], np.arange(len(page_order)))
+
+    return page_names[page_order].tolist(), rows[by_page], starts
+
+def init_stats_worker(p_le_class, p_config):
+
+    ''' Builds the line extraction QA module a stats worker process outputs all of its books' stats with '''
+
+    global stats_worker_qa_module
+    stats_worker_qa_module = p_le_class(p_config)
+
+def load_line_df(p_line_df_filepath):
+
+    ''' Reads a line_df.csv in one pass into columns of page names, line numbers,
+        rect angles, and the lines' widths and heights (swapped for lines at 90 degrees) '''
+
+    # 1. Read the rows of the csv and pull out the columns used for stats
+    with open(p_line_df_filepath, "r", newline="") as line_df_file:
+        csv_reader = csv.reader(line_df_file)
+        header = next(csv_reader, [])
+        rows = list(csv_reader)
+
+    columns = { column_name: index for index, column_name in enumerate(header) }
+    file_names = [row[columns["file_name"]] for row in rows]
+    rects = [row[columns["rect"]] for row in rows]
+    widths = np.array([row[columns["width"]] for row in rows], dtype=np.float64)
+    heights = np.array([row[columns["height"]] for row in rows], dtype=np.float64)
+    if "norm_height" in columns:
+        norm_heights = np.array([row[columns["norm_height"]] for row in rows], dtype=np.float64)
+    else:
+        norm_heights = np.full(len(rows), np.nan)
+
+    # 2. Page name and line number from each line's file name
+    file_name_parts = [file_name.split(LINE_DF_PAGE_SEPARATOR) for file_name in file_names]
+
+    # 3. Angle of rotation of each line's rect (NaN when it cannot be read)
+    angles = np.full(len(rows), np.nan)
+    for index, rect in enumerate(rects):
+        match = LINE_RECT_ANGLE_REGEX.search(rect)
+        if match is None:
+            print("ERROR: Problem reading angle of rotation for line: {0}".format(file_names[index]))
+            continue
+        angles[index] = float(match.group(1))
+
+    # 4. Flip the dimensions of lines rotated 90 degrees
+    # NOTE: NaN angles are never close to 90, so lines whose angle can't be read keep their dimensions
+    swap = np.isclose(angles, 90, rtol=0, atol=1)
+
+    return {
+        "file_name": file_names,
+        "image_name": [parts[0] for parts in file_name_parts],
+        "line_number": [parts[1] for parts in file_name_parts],
+        "angle": angles,
+        "width": np.where(swap, heights, widths),
+        "height": np.where(swap, widths, heights),
+        "norm_height": norm_heights
+    }
+
+def output_stats_on_book(p_book_directory):
+
+    ''' Outputs the stats of one book in a stats worker process (with the QA module built by init_stats_worker)
+        and returns its page and book level stats '''
+
+    return stats_worker_qa_module._Base__output_stats_on_book(p_book_directory)
+
+def parse_pagelevel_stats_row(p_row):
+
+    ''' Reads a row of a page level stats file (as a csv.DictReader row) back into a page's stats,
+        or returns None if any of its values can't be read '''
+
+    page_stats = {}
+    for column in p_row:
+        if "image_name" == column:
+            continue
+        try:
+            page_stats[column] = int(p_row[column]) if column in PAGELEVEL_STATS_INT_COLUMNS else float(p_row[column])
+        except (TypeError, ValueError):
+            return None
+
+    return page_stats
 
 # Main script functions
 
@@ -1367,6 +1465,8 @@ def parse_args():
     parser.add_argument("line_extraction_type", help="Type of line extraction to be run. Current options: [watershed]")
     parser.add_argument("book_directory", help="Directory containing the images of one book copied using the create_autocrop_test_dir.py script")
     parser.add_argument("run_uuid", help="Unique ID for this autocrop run/batch of autocrop runs")
+    parser.add_argument("--page_staging", default=STAGING_COPY, choices=VALID_STAGING_MODES,
+        help="How page images are put in the line extraction subdirectories ('link' shares the originals' data instead of copying it)")
     
     args = parser.parse_args()
 
@@ -1388,11 +1488,17 @@ def run_line_extraction_watershed(p_args):
     makedirs(book_directory + DIRECTORY_LINES)
     makedirs(book_directory + DIRECTORY_LINES_COLOR)
 
-    # B. Copy the page images to the line extraction subdirectories
-    print("Copying original images to subdirectories...")
-    for image_filepath in glob.glob(book_directory + "*.tif"):
-        shutil.copy(image_filepath, book_directory + DIRECTORY_PAGES)
-        shutil.copy(image_filepath, book_directory + DIRECTORY_PAGES_COLOR)
+    # B. Stage the page images in the line extraction subdirectories
+    # (noting the originals' signatures when the staged images share their data)
+    print("Staging original images in subdirectories ({0})...".format(p_args.page_staging))
+    image_filepaths = glob.glob(book_directory + "*.tif")
+    image_signatures = { image_filepath: get_file_signature(image_filepath) for image_filepath in image_filepaths } \
+        if STAGING_LINK == p_args.page_staging else {}
+    staged_counts = collections.Counter()
+    for image_filepath in image_filepaths:
+        staged_counts[stage_file(image_filepath, book_directory + DIRECTORY_PAGES, p_args.page_staging)] += 1
+        staged_counts[stage_file(image_filepath, book_directory + DIRECTORY_PAGES_COLOR, p_args.page_staging)] += 1
+    print("Staged images by: {0}".format(dict(staged_counts)))
 
     # C. Copy Python scripts for parts of line extraction to subdirectories
     print("Copying scripts to subdirectories...")
@@ -1442,9 +1548,19 @@ def run_line_extraction_watershed(p_args):
 
     print("Done with watershed line extraction.")
 
+    # 3. Line extraction may only read staged images that share the originals' data
+    modified_filepaths = [image_filepath for image_filepath in image_signatures \
+        if get_file_signature(image_filepath) != image_signatures[image_filepath]]
+    if len(modified_filepaths):
+        print("ERROR: Line extraction wrote to {0} original page images through their staged links: {1}".format(
+            len(modified_filepaths), modified_filepaths))
+
     # 5. Move up one directory to return to top-level book directory
     os.chdir(book_directory)
 
+    if len(modified_filepaths):
+        sys.exit(1)
+
 if __name__ == "__main__":
 
     args = parse_args()
@@ -16,6 +16,12 @@ function fail {
     exit "${2-1}"  ## Return a code specified by $2 or 1 by default.
 }
 
+# Page staging (stage_pages and check_staged_pages)
+# NOTE: sbatch runs a copy of this script, so the file is found in the directory it was submitted from
+QA_SCRIPT_DIRECTORY="$(dirname "${BASH_SOURCE[0]}")"
+[ -f "$QA_SCRIPT_DIRECTORY/qa_staging.sh" ] || QA_SCRIPT_DIRECTORY="$SLURM_SUBMIT_DIR"
+source "$QA_SCRIPT_DIRECTORY/qa_staging.sh"
+
 echo "In qa_line_extraction.sh"
 
 # 0. Make sure at least a book directory and run ID have been passed to this script
@@ -45,26 +51,26 @@ echo "Making 'book' subdirectory"
 echo "Making 'book_color' subdirectory"
 mkdir book book_color
 
-# D. Copy original images to 'book_color' subdirectory
-cp *.tif book_color
-
-# E. Move page tifs to 'book' subdirectory
+# D. Move page tifs to 'book' subdirectory
 echo "Moving original page tifs to 'book' subdirectory"
 mv *.tif book/
 
+# E. Stage original images in 'book_color' subdirectory (after the move, so symlinks point to where they stay)
+stage_pages book_color book/*.tif
+
 # F. Make directory pages
 # G. Make directory pages_color
 echo "Making 'pages' subdirectory"
 echo "Making 'pages_color' subdirectory"
 mkdir pages pages_color
 
-# H. Copy all tifs in 'book' subdirectory to 'pages'
-echo "Copying page tifs to 'pages' subdirectory"
-cp book/*.tif pages/
+# H. Stage all tifs in 'book' subdirectory in 'pages'
+echo "Staging page tifs in 'pages' subdirectory"
+stage_pages pages book/*.tif
 
-# I. Copy all tifs in book_color to pages_color
-echo "Copying color page tifs to 'pages_color' subdirectory"
-cp book_color/*.tif pages_color/
+# I. Stage all tifs in 'book' subdirectory in 'pages_color' (the same images as 'book_color')
+echo "Staging color page tifs in 'pages_color' subdirectory"
+stage_pages pages_color book/*.tif
 
 # J. Copy code/run_dhsegment_on_book.py to 'pages'
 echo "Copying run_dhsegment_on_book.py to 'pages' subdirectory"
@@ -115,6 +121,9 @@ python3 -u watershed_line_extraction.py ../pages_color ../pages ../pages/dhsegme
 
 echo "Done with watershed line extraction."
 
+# Line extraction may only read staged pages that share the originals' data
+check_staged_pages || fail "Line extraction wrote to original page images through their staged links."
+
 # V. Date is shown
 date
 
@@ -8,6 +8,7 @@
 # Creation Date: October 31, 2023
 # Script Info:
 # Runs line extraction QA script on given book directory, mimicking run_workflow1_watershed.sh and line_extract_dhsegment.sh
+# (with an optional fourth argument for how page images are staged: "copy", the default, or "link")
 
 echo "In qa_line_extraction_final.sh"
 
@@ -17,33 +18,36 @@ if [ -z "$1" ] || [ -z "$2" ] || [ -z "$3" ]; then
 fi
 
 # Determine which conda environment to activate
+source "$(dirname "${BASH_SOURCE[0]}")/qa_environment.sh"
 if [ "watershed" == "$1" ]; then
-  environment_directory="/ocean/projects/hum160002p/nikolaiv/miniconda3/envs/dh_segment"
+  environment_name="watershed"
 else # [ "eynollah" == $1 ]; then
-  environment_directory="/ocean/projects/hum160002p/nikolaiv/miniconda3/envs/eynollah"
+  environment_name="eynollah"
 fi
 
 # Show QA line extraction start time
 date
 
-# 1. Activate the conda environment for line extraction
-echo "Loading conda environment for line extraction..."
-source ~/.bashrc
-module load anaconda3
-conda init
-conda activate $environment_directory
+# 1. Activate the conda environment for line extraction (unless the group of packed jobs running this one already has)
+if activate_qa_environment $environment_name; then
+  echo "Loaded conda environment for line extraction."
+  activated_environment=1
+fi
 
 # 2. Run QA for line extraction over this book directory
 line_extraction_type=$1
 book_directory=$2
 run_uuid=$3
-python3 -u qa_line_extraction.py $line_extraction_type $book_directory $run_uuid
+page_staging=${4:-copy}
+python3 -u qa_line_extraction.py $line_extraction_type $book_directory $run_uuid --page_staging $page_staging
 
 # Show QA line extraction end time
 date
 
-# 3. Deactivate the conda environment for line extraction
-conda deactivate
+# 3. Deactivate the conda environment for line extraction (if this script activated it)
+if [ -n "$activated_environment" ]; then
+  conda deactivate
+fi
 
 # 4. If line_extract_dhsegment.sh (and its processes) complete successfully, continue
 if [ $? -eq 0 ]; then
@@ -0,0 +1,44 @@
+#!/bin/bash
+
+# Script Info:
+# Sourced by line extraction job scripts for stage_pages, which puts page images in a directory for line extraction to read,
+# and check_staged_pages, which fails a job whose line extraction wrote to original page images through their staged links.
+
+# Signature (size, modification time and path) of each original page image staged by a link, one per line
+QA_STAGED_PAGE_SIGNATURES=""
+
+# Puts page images in a directory: copies, unless PAGE_STAGING is "link", in which case each is a hardlink
+# (else a reflink, else a symlink, else a copy) sharing the original's data, so staged pages must only be read.
+# NOTE: Linked pages are not made read-only, as that would change the permissions of the originals they share.
+# Their originals' signatures are noted instead, for check_staged_pages.
+stage_pages() {
+
+  destination_directory=$1
+  shift
+  for page in "$@"; do
+    rm -f "$destination_directory/$(basename "$page")"
+    if [ "link" == "${PAGE_STAGING:-copy}" ]; then
+      QA_STAGED_PAGE_SIGNATURES+="$(stat -L -c '%s %.9Y' "$page") $(realpath "$page")"$'\n'
+      ln "$page" "$destination_directory/" 2>/dev/null || \
+        cp --reflink=always "$page" "$destination_directory/" 2>/dev/null || \
+        ln -s "$(realpath "$page")" "$destination_directory/" 2>/dev/null || \
+        cp "$page" "$destination_directory/"
+    else
+      cp "$page" "$destination_directory/"
+    fi
+  done
+}
+
+# Returns 1 (listing them) if any original page image staged by a link has changed size or modification time since it was staged
+check_staged_pages() {
+
+  modified_count=0
+  while read -r size mtime page; do
+    if [ -n "$page" ] && [ "$size $mtime" != "$(stat -L -c '%s %.9Y' "$page" 2>/dev/null)" ]; then
+      echo "ERROR: Original page image $page was changed through its staged link" >&2
+      modified_count=$((modified_count + 1))
+    fi
+  done <<< "$(printf '%s' "$QA_STAGED_PAGE_SIGNATURES" | sort -u)"
+
+  [ 0 -eq "$modified_count" ]
+}
@@ -6,28 +6,88 @@
 
 # Built-ins
 import ast
+import asyncio
+import collections
 import csv
+import ctypes
+import fcntl
 import glob
+import gzip
 import importlib
 import inspect
+import json
 import math
 import os
-import queue
+import re
+import select
+import shlex
 import shutil
+import signal
+import socket
+import sqlite3
 import subprocess
 import sys
-import _thread
+import tarfile
+import tempfile
+import threading
+import time
 import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as wait_for_futures
 from pathlib import Path
 
 # Third party
+import numpy as np
 from PIL import Image
 from PIL import UnidentifiedImageError
 
 # Custom
 from qa_constants import *
 
+
+# Globals
+
+# Bytes of an archived file kept in memory while it's compressed (beyond this it spills to a temporary file)
+ARCHIVE_SPOOL_BYTES = 64 * 1024 * 1024
+
+# Threads reading page image headers for a book's page index
+PAGE_INDEX_WORKERS = 8
+
+# Rows of a binary image that are packed and compared at a time by count_binary_differences
+BINARY_DIFF_BAND_ROWS = 512
+
+# Number of set bits in each possible byte value (for numpy versions without np.bitwise_count)
+POPCOUNT_TABLE = np.array([bin(byte_value).count("1") for byte_value in range(256)], dtype=np.uint8)
+
+# Seconds between rereads of a run journal while waiting on jobs (doubling from the min to the max)
+JOURNAL_MIN_POLL_SECONDS = 1
+JOURNAL_MAX_POLL_SECONDS = 60
+
+# Seconds a run catalog connection waits on another's lock before giving up
+RUN_CATALOG_TIMEOUT_SECONDS = 60
+
+# Threads deleting trashed directory trees, and seconds between reports on their progress
+TRASH_DELETE_WORKERS = 8
+TRASH_PROGRESS_SECONDS = 10
+
+# Seconds since another run last used its trash directory before what's in it is taken for left behind
+# (longer than any run's jobs, so only runs that were killed or have ended are swept)
+TRASH_STALE_SECONDS = 3 * 24 * 60 * 60
+
+# Seconds between checks on whether a deleted item is gone (doubling up to the max)
+WAIT_WHILE_EXISTS_MIN_SECONDS = 0.01
+WAIT_WHILE_EXISTS_MAX_SECONDS = 1
+
+# sbatch's output on a successful submission
+SBATCH_SUBMITTED_REGEX = re.compile(r"Submitted batch job (\d+)")
+
+# ioctl that clones one file's data into another, copy on write (from linux's fs.h)
+FICLONE = 0x40049409
+
+# inotify events that mean a run journal may have been written to (from linux's inotify.h)
+INOTIFY_EVENTS = 0x00000002 | 0x00000008 | 0x00000080 | 0x00000100 # IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
 # Classes
 
 # QA module base class
@@ -38,25 +98,121 @@ class QA_Module(ABC):
         print("Entering QA_Module.__init__")
         
         self.config = p_config
-        self.process_queue = QAProcessWaiter()
+        self.process_queue = QAProcessWaiter(
+            get_worker_count(p_config.get(LOCAL_MAX_PROCESSES, WORKERS_AUTO)),
+            p_config.get(LOCAL_PROCESS_TIMEOUT, None))
+        self.jobs_submitted_at = None
+        self.submitted_job_names = []
+        self.run_catalog = QARunCatalog(p_config[OUTPUT_DIRECTORY])
+        self.directory_snapshot = QADirectorySnapshot(p_config[BOOK_DIRECTORY])
+        self.trash = QATrash(p_config[RUN_UUID])
+
+        # Jobs run on slurm or in the process queue on this machine
+        if EXECUTOR_LOCAL == p_config.get(EXECUTOR, EXECUTOR_SLURM):
+            self.job_executor = QALocalJobExecutor(p_config, self.process_queue)
+        else:
+            self.job_executor = QASlurmJobExecutor(p_config)
 
         print("Exiting QA_Module.__init__")
 
     def call_command(self, p_command_name):
 
         print("Entering QA_Module.call_command")
+
+        # Each command starts from fresh listings of the book directories
+        self.directory_snapshot.invalidate()
         
-        getattr(self, p_command_name)()
+        # With dependency chaining, a command that would run here while this run's jobs are still pending
+        # is instead submitted as a job of its own to run once they have all ended
+        if self.config.get(SLURM_DEPENDENCY_CHAINING, False) and len(self.submitted_job_names) and \
+           not self.is_job_command(p_command_name):
+            self.__submit_command_job(p_command_name)
+        else:
+            getattr(self, p_command_name)()
         # self.wait()
 
+        # Jobs run on this machine finish before the next command starts
+        self.job_executor.wait_till_all_finished()
+
         print("Exiting QA_Module.call_command")
 
+    def archive_output_items(self, p_items):
+
+        '''Moves items in the output directory into its archive folder. With ARCHIVE_BUNDLES, files that belong to a
+        run are instead added to that run's bundle (one tar of gzipped files plus an index of where each is in it).'''
+
+        archive_directory = self.config[OUTPUT_DIRECTORY] + ARCHIVE_DIRECTORY + os.sep
+
+        # 1. Group the files of each run (by the run UUID in their names)
+        run_filepaths = {}
+        loose_items = list(p_items)
+        if self.config.get(ARCHIVE_BUNDLES, False):
+            run_uuids = set(self.run_catalog.get_run_uuids()) | {self.config[RUN_UUID]}
+            run_uuid_regexes = [(run_uuid, re.compile(r"(?<![0-9A-Za-z]){0}(?![0-9A-Za-z])".format(re.escape(run_uuid)))) \
+                for run_uuid in sorted(run_uuids, key=len, reverse=True)]
+            loose_items = []
+            for item in p_items:
+                item_run_uuid = None
+                if os.path.isfile(self.config[OUTPUT_DIRECTORY] + item):
+                    item_run_uuid = next((run_uuid for run_uuid, run_uuid_regex in run_uuid_regexes if run_uuid_regex.search(item)), None)
+                if item_run_uuid is None:
+                    loose_items.append(item)
+                else:
+                    run_filepaths.setdefault(item_run_uuid, []).append(self.config[OUTPUT_DIRECTORY] + item)
+
+        # 2. Add each run's files to its bundle
+        for run_uuid in run_filepaths:
+            bundle = QAArchiveBundle(archive_directory + ARCHIVE_BUNDLE_FILENAME.format(run_uuid),
+                archive_directory + ARCHIVE_INDEX_FILENAME.format(run_uuid))
+            bundle.add_files(run_filepaths[run_uuid])
+            print("Archived {0} files in {1}".format(len(run_filepaths[run_uuid]), ARCHIVE_BUNDLE_FILENAME.format(run_uuid)))
+
+        # 3. Move everything else into the archive folder as is
+        for item in loose_items:
+            os.rename(self.config[OUTPUT_DIRECTORY] + item, archive_directory + item)
+
+    def record_artifact(self, p_filepath, p_book_name, p_kind):
+
+        '''Records a file produced by this run in the run catalog'''
+
+        self.run_catalog.record_artifact(p_filepath, self.config[RUN_UUID], self.config.get(QA_TYPE, type(self).__name__), p_book_name, p_kind)
+
+    def is_job_command(self, p_command_name):
+
+        '''Whether the command only submits jobs (that declare what they depend on) rather than doing its work here'''
+
+        return COMMAND_RUN == p_command_name
+
     def is_method_finished(self, p_book_directory):
 
         print("Entering/exiting QA_Module.is_method_finished")
 
         return False
 
+    def __submit_command_job(self, p_command_name):
+
+        print("Entering QA_Module.__submit_command_job")
+
+        # 1. A qa.py call that runs just this command for this run
+        job_name = "{0}_{1}".format(p_command_name, self.config[RUN_UUID])
+        command = "python3 qa.py {0} --output_directory {1} --run_uuid {2} --commands {3}".format(
+            self.config[QA_TYPE], self.config[OUTPUT_DIRECTORY], self.config[RUN_UUID], p_command_name)
+        if RUN_TYPE_SINGLE == self.config[RUN_TYPE]:
+            command += " --single_book --book_directory {0}".format(self.config[BOOK_DIRECTORY])
+        if CONFIG_FILE in self.config:
+            command += " --config_file {0}".format(self.config[CONFIG_FILE])
+
+        # 2. Submit it to run after every job submitted so far has ended (however it ended)
+        self.submit_jobs([QAJob(
+            job_name,
+            command,
+            "{0}slurm-{1}.out".format(self.config[OUTPUT_DIRECTORY], job_name),
+            p_dependencies=list(self.submitted_job_names),
+            p_dependency_type=DEPENDENCY_AFTERANY
+        )], SLURM_COMMAND_JOB_DIRECTIVES, job_name)
+
+        print("Exiting QA_Module.__submit_command_job")
+
     # QA methods (listable in "COMMANDS" in config)
 
     def archive(self):
@@ -130,27 +286,7 @@ class QA_Module(ABC):
 
         print("Entering QA_Module.data_stats")
 
-        # 1. Calculate stats for book and page images
-        book_stats = {}
-        for book_directory in get_items_in_dir(self.config[BOOK_DIRECTORY], ["directories"]):
-            
-            book_stats[book_directory] = {
-                "images": {},
-                "num_pages": 0
-            }
-
-            for image_filepath in glob.glob(self.config[BOOK_DIRECTORY] + book_directory + os.sep + "*.tif"):
-                
-                width, height, file_size = get_image_stats(image_filepath)
-                image_name = Path(image_filepath).name
-
-                book_stats[book_directory]["num_pages"] += 1
-                book_stats[book_directory]["images"][image_name] = {}
-                book_stats[book_directory]["images"][image_name]["width"] = width
-                book_stats[book_directory]["images"][image_name]["height"] = height
-                book_stats[book_directory]["images"][image_name]["file_size"] = file_size
-
-        # 2. Write out results to data stats file in output directory
+        # Write out stats on each book's page images to a data stats file in the output directory
         with open(self.config[OUTPUT_DIRECTORY] + "data_stats_{0}.csv".format(self.config[RUN_UUID]), "w") as stats_file:
 
             csv_writer = csv.writer(stats_file)
@@ -162,14 +298,21 @@ class QA_Module(ABC):
                 "height_pixels"
             ])
 
-            for book in book_stats:
-                for image_name in book_stats[book]["images"]:
+            # 1. Read the book's page dimensions from its page index and write its rows out
+            for book_directory in self.directory_snapshot.get_book_names():
+
+                book_path = self.config[BOOK_DIRECTORY] + book_directory + os.sep
+                image_names = self.directory_snapshot.get_tifs(book_path)
+                page_metadata = QAPageIndex(book_path).get_pages([book_path + image_name for image_name in image_names])
+
+                for image_name in image_names:
+                    metadata = page_metadata[book_path + image_name]
                     csv_writer.writerow([
                         image_name,
-                        book_stats[book]["num_pages"],
-                        book_stats[book]["images"][image_name]["file_size"],
-                        book_stats[book]["images"][image_name]["width"],
-                        book_stats[book]["images"][image_name]["height"],
+                        len(image_names),
+                        "N/A" if metadata is None else metadata["bytes"],
+                        "N/A" if metadata is None else metadata["width"],
+                        "N/A" if metadata is None else metadata["height"],
                     ])
 
         print("Exiting QA_Module.data_stats")
@@ -188,27 +331,444 @@ class QA_Module(ABC):
     def _Base__run_on_book(self, p_book_directory):
         raise NotImplementedError("Must override QA_LineExtraction.__run_on_book")
 
+    # Job submission methods
+    def submit_jobs(self, p_jobs, p_sbatch_directives, p_array_name):
+
+        print("Entering QA_Module.submit_jobs")
+
+        # NOTE: Every job records its exit status and timings in the run journal when it finishes (see wait_for_jobs)
+        if self.jobs_submitted_at is None:
+            self.jobs_submitted_at = time.time()
+
+        # Run the jobs on slurm or on this machine (see EXECUTOR)
+        job_results = self.job_executor.submit_jobs(p_jobs, p_sbatch_directives, p_array_name, self.get_run_journal_filepath())
+        self.submitted_job_names.extend([job.name for job in p_jobs])
+
+        print("Exiting QA_Module.submit_jobs")
+
+        return job_results
+
+    def get_run_journal_filepath(self):
+        return self.config[OUTPUT_DIRECTORY] + RUN_JOURNAL_FILENAME.format(self.config[RUN_UUID])
+
+    def wait_for_jobs(self, p_job_names, p_timeout=None):
+
+        print("Entering QA_Module.wait_for_jobs")
+
+        # 1. Block until every job has a record in the run journal, or its executor says the job running it has ended
+        # NOTE: Only counts jobs that finished after this QA run first submitted jobs, so that
+        # records from earlier runs with the same run UUID aren't mistaken for these jobs
+        journal = QARunJournal(self.get_run_journal_filepath())
+        job_records = journal.wait_for(p_job_names,
+            p_since=self.jobs_submitted_at if self.jobs_submitted_at is not None else 0,
+            p_timeout=p_timeout,
+            p_get_ended_jobs=self.job_executor.get_ended_jobs)
+
+        # 2. Report on the jobs that failed
+        for job_name in job_records:
+            if 0 != job_records[job_name]["exit_status"]:
+                print("Job {0} failed with exit status {1} after {2:.1f}s".format(
+                    job_name, job_records[job_name]["exit_status"], job_records[job_name]["elapsed_seconds"]))
+
+        # 3. And on those that ended without recording how (e.g. killed for running out of time or memory)
+        for job_name in p_job_names:
+            if job_name not in job_records:
+                executor_job = self.job_executor.get_job(job_name)
+                print("Job {0} ended without a run journal record (job {1}: {2})".format(
+                    job_name, executor_job["job_id"], executor_job["state"]))
+
+        print("Exiting QA_Module.wait_for_jobs")
+
+        return job_records
+
+    # Streaming pipeline methods
+    def finish_pipeline(self):
+
+        '''Run level work left once every book has been through the streaming pipeline'''
+
+        print("Entering/exiting QA_Module.finish_pipeline")
+
+        pass
+
+    def get_pipeline_book_directories(self):
+        return [format_path(self.config[BOOK_DIRECTORY] + book_name) \
+            for book_name in self.directory_snapshot.get_book_names() \
+            if book_name not in [RESULTS_DIRECTORY, Path(self.config[OUTPUT_DIRECTORY]).name]]
+
+    @property
+    def pipeline_book_stages(self):
+
+        # Commands that can be run a book at a time by the streaming pipeline
+        return []
+
+    def run_pipeline(self):
+
+        print("Entering QA_Module.run_pipeline")
+
+        # 0. Commands books move through one at a time, in the order listed in COMMANDS
+        # NOTE: Other commands run once for the whole run, before the pipeline if they are listed
+        # before its first per book command (e.g. 'clear'), otherwise after it
+        book_stages = [command for command in self.config[COMMANDS] if command in self.pipeline_book_stages]
+        first_stage_index = self.config[COMMANDS].index(book_stages[0]) if len(book_stages) else len(self.config[COMMANDS])
+        for command in self.config[COMMANDS][:first_stage_index]:
+            self.call_command(command)
+
+        # 1. Start each book on its first stage, then move it on to its next stage
+        # as soon as the jobs of its last one have finished
+        journal = QARunJournal(self.get_run_journal_filepath())
+        book_stage_indices = { book_directory: 0 for book_directory in self.get_pipeline_book_directories() } if len(book_stages) else {}
+        ready_books = list(book_stage_indices.keys())
+        pending_jobs = {}
+        batch_index = 0
+        while len(ready_books) or len(pending_jobs):
+
+            # A. Start the next stage of each book that is ready for it
+            # (stages done here rather than by jobs leave the book ready for the stage after)
+            stage_jobs = {}
+            while len(ready_books):
+                book_directory = ready_books.pop(0)
+                if len(book_stages) == book_stage_indices[book_directory]:
+                    continue
+                stage = book_stages[book_stage_indices[book_directory]]
+                book_stage_indices[book_directory] += 1
+
+                jobs, sbatch_directives = self.start_book_stage(stage, book_directory)
+                if not len(jobs):
+                    ready_books.append(book_directory)
+                    continue
+                stage_jobs.setdefault(stage, ([], sbatch_directives))[0].extend(jobs)
+                for job in jobs:
+                    pending_jobs[job.name] = book_directory
+
+            # B. Submit the jobs of each stage together
+            for stage in stage_jobs:
+                self.submit_jobs(stage_jobs[stage][0], stage_jobs[stage][1],
+                    "{0}_{1}_{2}".format(stage, self.config[RUN_UUID], batch_index))
+            batch_index += 1
+            if not len(pending_jobs):
+                break
+
+            # C. Wait for at least one job to finish (or to end without recording how)
+            job_records = journal.wait_for(list(pending_jobs.keys()),
+                p_since=self.jobs_submitted_at if self.jobs_submitted_at is not None else 0,
+                p_get_ended_jobs=self.job_executor.get_ended_jobs,
+                p_min_finished=1)
+            ended_job_names = self.job_executor.get_ended_jobs([job_name for job_name in pending_jobs if job_name not in job_records])
+
+            # D. Books whose jobs have all finished are ready for their next stage
+            for job_name in list(job_records.keys()) + ended_job_names:
+                book_directory = pending_jobs.pop(job_name)
+                if job_name not in job_records:
+                    print("Job {0} ended without a run journal record".format(job_name))
+                elif 0 != job_records[job_name]["exit_status"]:
+                    print("Job {0} failed with exit status {1}".format(job_name, job_records[job_name]["exit_status"]))
+                if book_directory not in pending_jobs.values():
+                    ready_books.append(book_directory)
+
+        # 2. Run level work for the stages books went through, then the remaining commands
+        if len(book_stages):
+            self.finish_pipeline()
+        for command in self.config[COMMANDS][first_stage_index:]:
+            if command not in book_stages:
+                self.call_command(command)
+
+        print("Exiting QA_Module.run_pipeline")
+
+    def start_book_stage(self, p_command_name, p_book_directory):
+
+        '''Starts a command on one book for the streaming pipeline. Returns the QAJobs that run it
+        and their sbatch directives (or no jobs if the command was done here).'''
+
+        raise NotImplementedError("QA module does not run {0} a book at a time".format(p_command_name))
+
     # Process queue methods
+    def cancel_process(self, p_description):
+
+        print("Entering/exiting QA_Module.cancel_process")
+
+        return self.process_queue.cancel_process(p_description)
     def is_process_finished(self, p_description):
 
         print("Entering/exiting QA_Module.is_process_finished")
 
         return not self.process_queue.process_is_in_queue(p_description)
-    def start_process(self, p_command, p_args, p_description):
+    def start_process(self, p_command, p_args, p_description, p_timeout=None):
 
         print("Entering QA_Module.start_process")
 
-        self.process_queue.start_process(QAProcess(p_command, p_args, p_description))
+        self.process_queue.start_process(QAProcess(p_command, p_args, p_description), p_timeout)
 
         print("Exiting QA_Module.start_process")
     def wait(self):
 
         print("Entering QA_Module.wait")
 
-        self.process_queue.wait_till_all_finished()
+        finished_processes = self.process_queue.wait_till_all_finished()
 
         print("Exiting QA_Module.wait")
 
+        return finished_processes
+
+class QAJob:
+
+    # NOTE: One unit of work for slurm, usually run on a single book. Submitted on its own it
+    # gets its own job name and log file; as part of a job array it becomes one task of the array,
+    # and packed with other jobs it is run by a worker of a job group (logging to its own file).
+    # With dependency chaining, it waits on the named jobs it depends on (see SLURM_DEPENDENCY_CHAINING).
+    # Its environment names the conda environment its command activates (see qa_environment.sh),
+    # which a job group activates once for all of its jobs.
+
+    def __init__(self, p_name, p_command, p_log_filepath, p_book_directory="", p_dependencies=None, p_dependency_type=DEPENDENCY_AFTEROK,
+        p_environment=ENVIRONMENT_NONE):
+
+        self.m_name = p_name
+        self.m_command = p_command
+        self.m_log_filepath = p_log_filepath
+        self.m_book_directory = p_book_directory
+        self.m_dependencies = p_dependencies if p_dependencies is not None else []
+        self.m_dependency_type = p_dependency_type
+        self.m_environment = p_environment
+
+    @property
+    def book_directory(self):
+        return self.m_book_directory
+
+    @property
+    def command(self):
+        return self.m_command
+
+    @property
+    def dependencies(self):
+        return self.m_dependencies
+
+    @property
+    def dependency_type(self):
+        return self.m_dependency_type
+
+    @property
+    def environment(self):
+        return self.m_environment
+
+    @property
+    def log_filepath(self):
+        return self.m_log_filepath
+
+    @property
+    def name(self):
+        return self.m_name
+
+class QAJobExecutor(ABC):
+
+    # NOTE: Runs the QAJobs of a QA module, either on slurm or on this machine (chosen by the EXECUTOR config key).
+    # Either way, each job runs its command from a task manifest via run_array_task, which records
+    # in the run journal when the job finishes (see QA_Module.wait_for_jobs).
+
+    def __init__(self, p_config):
+
+        self.m_config = p_config
+
+    @abstractmethod
+    def get_ended_jobs(self, p_job_names):
+        raise NotImplementedError("Must override QAJobExecutor.get_ended_jobs")
+
+    @abstractmethod
+    def get_job(self, p_job_name):
+        raise NotImplementedError("Must override QAJobExecutor.get_job")
+
+    @abstractmethod
+    def submit_jobs(self, p_jobs, p_sbatch_directives, p_submission_name, p_journal_filepath):
+        raise NotImplementedError("Must override QAJobExecutor.submit_jobs")
+
+    def wait_till_all_finished(self):
+        pass
+
+class QALocalJobExecutor(QAJobExecutor):
+
+    # NOTE: Runs jobs as processes on this machine, no more at once than the process queue
+    # allows (LOCAL_MAX_PROCESSES, by default one per core). sbatch directives are ignored, as are
+    # dependencies (each command's jobs have finished before the next command starts).
+
+    def __init__(self, p_config, p_process_waiter):
+
+        super().__init__(p_config)
+        self.m_process_waiter = p_process_waiter
+
+        # QAProcesses running each job and their futures, keyed by job name
+        # (kept after the process queue is done with them)
+        self.m_jobs = {}
+
+    def get_ended_jobs(self, p_job_names):
+        return [job_name for job_name in p_job_names if job_name in self.m_jobs and self.m_jobs[job_name][1].done()]
+
+    def get_job(self, p_job_name):
+
+        if p_job_name not in self.m_jobs:
+            return None
+        qa_process, future = self.m_jobs[p_job_name]
+
+        if future.cancelled():
+            state = "CANCELLED"
+        elif qa_process.timed_out:
+            state = "TIMED_OUT"
+        elif qa_process.return_code is not None:
+            state = "EXITED ({0})".format(qa_process.return_code)
+        else:
+            state = "QUEUED" if qa_process.handle is None else "RUNNING"
+
+        return {
+            "name": p_job_name,
+            "job_id": qa_process.handle.pid if qa_process.handle is not None else None,
+            "state": state
+        }
+
+    def submit_jobs(self, p_jobs, p_sbatch_directives, p_submission_name, p_journal_filepath):
+
+        for job in p_jobs:
+
+            # Each job runs from a one task manifest, as it would on slurm, with its output going to its log file
+            task_manifest_filepath = "{0}job_{1}.jsonl".format(self.m_config[OUTPUT_DIRECTORY], job.name)
+            write_task_manifest(task_manifest_filepath, [job], p_journal_filepath)
+            qa_process = QAProcess(
+                "python3 qa_utilities.py run_array_task",
+                [shlex.quote(task_manifest_filepath), ">", shlex.quote(job.log_filepath), "2>&1"],
+                job.name)
+            self.m_jobs[job.name] = (qa_process, self.m_process_waiter.start_process(qa_process))
+
+        return [self.get_job(job.name) for job in p_jobs]
+
+    def wait_till_all_finished(self):
+        self.m_process_waiter.wait_till_all_finished()
+
+class QASlurmJobExecutor(QAJobExecutor):
+
+    # NOTE: Submits jobs to slurm with sbatch, as job arrays and/or packed into shared allocations if configured
+
+    def __init__(self, p_config):
+
+        super().__init__(p_config)
+        self.m_slurm_client = QASlurmClient(
+            p_config.get(SLURM_SBATCH_COMMAND, "sbatch"),
+            p_config.get(SLURM_SQUEUE_COMMAND, "squeue"),
+            p_config.get(SLURM_SACCT_COMMAND, "sacct"),
+            p_config.get(SLURM_SUBMIT_CONCURRENCY, 8),
+            p_config.get(SLURM_STATUS_POLL_SECONDS, 30))
+
+    def get_ended_jobs(self, p_job_names):
+        return self.m_slurm_client.get_ended_jobs(p_job_names)
+
+    def get_job(self, p_job_name):
+        return self.m_slurm_client.get_job(p_job_name)
+
+    def submit_jobs(self, p_jobs, p_sbatch_directives, p_submission_name, p_journal_filepath):
+
+        # NOTE: Each submission is (name, array task index of each job it runs keyed by job name, sbatch arguments)
+        submissions = []
+
+        # 0. With dependency chaining, jobs that depend on jobs submitted earlier are submitted on their own,
+        # each waiting on just the jobs it needs (so that books move through the pipeline independently)
+        if self.m_config.get(SLURM_DEPENDENCY_CHAINING, False):
+            independent_jobs = []
+            for job in p_jobs:
+                dependency_ids = self.m_slurm_client.get_dependency_ids(job.dependencies, DEPENDENCY_AFTERANY != job.dependency_type)
+                if not len(dependency_ids):
+                    independent_jobs.append(job)
+                    continue
+                sbatch_directives = dict(p_sbatch_directives)
+                sbatch_directives["-d"] = "{0}:{1}".format(job.dependency_type, ":".join(dependency_ids))
+                sbatch_directives["--kill-on-invalid-dep"] = "yes"
+                submissions.append((job.name, { job.name: None },
+                    get_sbatch_job_args(job, sbatch_directives, self.m_config[OUTPUT_DIRECTORY], p_journal_filepath)))
+            p_jobs = independent_jobs
+
+        # 1. Pack jobs on small books together so that each group shares one allocation
+        group_members = {}
+        packing_mode = self.m_config.get(SLURM_PACKING, PACKING_NONE)
+        if PACKING_NONE != packing_mode and len(p_jobs) > 1:
+            p_jobs, p_sbatch_directives, group_members = self.__pack_jobs(p_jobs, p_sbatch_directives, p_submission_name, packing_mode, p_journal_filepath)
+
+        # 2. sbatch arguments for all of the jobs as tasks of a slurm job array
+        # (split into several arrays if there are more tasks than slurm allows in one)
+        if self.m_config.get(SLURM_JOB_ARRAYS, False) and len(p_jobs) > 1:
+            for start_index in range(0, len(p_jobs), SLURM_MAX_ARRAY_SIZE):
+                array_name = p_submission_name
+                if len(p_jobs) > SLURM_MAX_ARRAY_SIZE:
+                    array_name = "{0}_{1}".format(p_submission_name, start_index // SLURM_MAX_ARRAY_SIZE)
+                array_jobs = p_jobs[start_index:start_index + SLURM_MAX_ARRAY_SIZE]
+                submissions.append((
+                    array_name,
+                    { job_name: task_index for task_index, job in enumerate(array_jobs) \
+                        for job_name in group_members.get(job.name, [job.name]) },
+                    get_sbatch_array_args(
+                        array_jobs,
+                        p_sbatch_directives,
+                        array_name,
+                        self.m_config[OUTPUT_DIRECTORY],
+                        self.m_config.get(SLURM_ARRAY_THROTTLE, None),
+                        p_journal_filepath)))
+
+        # 3. Or for each job separately
+        else:
+            for job in p_jobs:
+                submissions.append((
+                    job.name,
+                    { job_name: None for job_name in group_members.get(job.name, [job.name]) },
+                    get_sbatch_job_args(job, p_sbatch_directives, self.m_config[OUTPUT_DIRECTORY], p_journal_filepath)))
+
+        # 4. Submit them all (a few at a time), recording their slurm job ids
+        slurm_results = self.m_slurm_client.submit(submissions)
+
+        return slurm_results
+
+    def __pack_jobs(self, p_jobs, p_sbatch_directives, p_group_name, p_packing_mode, p_journal_filepath):
+
+        # Returns:
+        # 1. Jobs to submit, where groups of packed jobs are replaced by one job that runs the group with a pool of workers
+        # 2. sbatch directives with enough CPUs for the group's workers
+        # 3. Names of the jobs in each group, keyed by group name
+
+        worker_count = max(1, int(self.m_config.get(SLURM_PACKING_WORKERS, 1)))
+        packed_jobs = []
+        group_members = {}
+
+        # 1. Group jobs that run in the same environment by the total pages or bytes of their books
+        packing_target = self.m_config.get(SLURM_PACKING_TARGET)
+        if packing_target is None:
+            packing_target = PACKING_TARGET_DEFAULTS[p_packing_mode]
+        environment_jobs = {}
+        for job in p_jobs:
+            environment_jobs.setdefault(job.environment, []).append(job)
+        job_groups = [job_group for environment in environment_jobs \
+            for job_group in pack_jobs(environment_jobs[environment], p_packing_mode, int(packing_target))]
+        print("Packed {0} jobs into {1} groups by {2}".format(len(p_jobs), len(job_groups), p_packing_mode))
+
+        for group_index, job_group in enumerate(job_groups):
+
+            # A. A group of one is submitted as is
+            if 1 == len(job_group):
+                packed_jobs.append(job_group[0])
+                continue
+
+            # B. Otherwise write out the group's jobs for the job that runs them
+            group_name = "{0}_group{1}".format(p_group_name, group_index)
+            group_manifest_filepath = "{0}job_group_{1}.jsonl".format(self.m_config[OUTPUT_DIRECTORY], group_name)
+            write_task_manifest(group_manifest_filepath, job_group, p_journal_filepath)
+            group_members[group_name] = [job.name for job in job_group]
+
+            # NOTE: The group's job activates its jobs' environment once, and they skip activating it themselves
+            packed_jobs.append(QAJob(
+                group_name,
+                "bash qa_job_group.sh {0} {1} {2}".format(job_group[0].environment, group_manifest_filepath, min(worker_count, len(job_group))),
+                "{0}slurm-{1}.out".format(self.m_config[OUTPUT_DIRECTORY], group_name),
+                p_environment=job_group[0].environment
+            ))
+
+        # 2. Each worker of a group gets as many CPUs as a job would on its own
+        sbatch_directives = dict(p_sbatch_directives)
+        sbatch_directives["-c"] = str(int(p_sbatch_directives.get("-c", 1)) * \
+            min(worker_count, max([len(job_group) for job_group in job_groups])))
+
+        return packed_jobs, sbatch_directives, group_members
+
 class QAProcess:
 
     def __init__(self, p_command, p_args, p_description):
@@ -219,13 +779,48 @@ class QAProcess:
         
         self.m_popen_handle = None
 
+        # Results (set once the process has finished)
+        self.m_output = None
+        self.m_return_code = None
+        self.m_timed_out = False
+        self.m_wall_time = None
+
     def open(self):
 
-        self.m_popen_handle = subprocess.Popen([self.m_command, *self.m_args], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, shell=True)
-        # self.m_popen_handle = subprocess.run("{0} {1}".format(self.m_command, *self.m_args), capture_output=True, text=True, shell=True)
+        # NOTE: Args may be a list of arguments or a string of them
+        args = [self.m_args] if isinstance(self.m_args, str) else list(self.m_args)
+        self.m_popen_handle = subprocess.Popen(" ".join([self.m_command, *args]), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, shell=True,
+                                               start_new_session=True)
 
         return self.m_popen_handle
 
+    def kill(self):
+
+        '''Kills the process along with anything its shell started'''
+
+        if self.m_popen_handle is not None and self.m_popen_handle.poll() is None:
+            try:
+                os.killpg(self.m_popen_handle.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def run(self, p_timeout=None):
+
+        '''Opens the process and waits for it to finish (killing it after p_timeout seconds), saving its results'''
+
+        start_time = time.time()
+        self.open()
+        try:
+            self.m_output, _ = self.m_popen_handle.communicate(timeout=p_timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            self.m_output, _ = self.m_popen_handle.communicate()
+            self.m_timed_out = True
+        self.m_return_code = self.m_popen_handle.returncode
+        self.m_wall_time = time.time() - start_time
+
+        return self
+
     @property
     def handle(self):
         return self.m_popen_handle
@@ -242,75 +837,923 @@ class QAProcess:
     def description(self):
         return self.m_description
 
+    @property
+    def output(self):
+        return self.m_output
+
+    @property
+    def return_code(self):
+        return self.m_return_code
+
+    @property
+    def timed_out(self):
+        return self.m_timed_out
+
+    @property
+    def wall_time(self):
+        return self.m_wall_time
+
 class QAProcessWaiter:
 
-    def __init__(self):
+    # NOTE: Runs QAProcesses on a pool of threads, so that no more than p_max_processes
+    # run at once (the rest wait their turn), each optionally limited to p_timeout seconds
 
-        self.m_processes = []
-        self.m_queue = queue.Queue()
+    def __init__(self, p_max_processes=1, p_timeout=None):
 
-    def __process_waiter(self, p_process_handle, p_description):
+        self.m_executor = ThreadPoolExecutor(max_workers=max(1, p_max_processes))
+        self.m_timeout = p_timeout
 
-        try:
-            p_process_handle.wait()
-        finally:
-            self.m_queue.put((
-                p_description,
-                p_process_handle.returncode
-            ))
+        # QAProcesses and their futures keyed by description
+        self.m_processes = {}
 
-    def __remove_process(self, p_description):
+    def cancel_process(self, p_description):
 
-        found_process = False
-        found_index = -1
-        for index in range(len(self.m_processes)):
-            if p_description == self.m_processes[index][0].description:
-                found_index = index
-                break
-        
-        if -1 != found_index:
-            del self.m_processes[found_index]
+        '''Cancels a process that has not started yet, or kills one that is running. Returns whether it was found.'''
 
-    def process_is_in_queue(self, p_description):
+        if not self.process_is_in_queue(p_description):
+            return False
 
-        for index in range(len(self.m_processes)):
-            if p_description == self.m_processes[index][0].description:
-                return True
-        return False
+        qa_process, future = self.m_processes[p_description]
+        if not future.cancel():
+            qa_process.kill()
 
-    def start_process(self, p_qa_process):
+        return True
+
+    def process_is_in_queue(self, p_description):
+        return p_description in self.m_processes
+
+    def start_process(self, p_qa_process, p_timeout=None):
 
         if self.process_is_in_queue(p_qa_process.description):
-            raise Exception("A QA process with description '{0}' is already in queue.\n" + \
+            raise Exception("A QA process with description '{0}' is already in queue.\n".format(p_qa_process.description) + \
                             "QA processes must have unique descriptions.")
 
-        # 1. Save a reference to the process and open it
-        process_handle = p_qa_process.open()
-        self.m_processes.append((p_qa_process, process_handle))
-
-        # 2. Begin a new thread to wait on this process's finish
-        _thread.start_new_thread(
-            self.__process_waiter,
-            (p_qa_process.handle, p_qa_process.description)
-        )
+        # Queue the process to be run once there is a free worker
+        future = self.m_executor.submit(p_qa_process.run, p_timeout if p_timeout is not None else self.m_timeout)
+        self.m_processes[p_qa_process.description] = (p_qa_process, future)
 
-        return process_handle
+        return future
 
     def wait_till_all_finished(self):
 
-        # Wait for all processes on the queue to finish
-        while len(self.m_processes) > 0:
+        '''Waits for all queued processes to finish. Returns the finished QAProcesses keyed by description.'''
+
+        finished_processes = {}
+        futures = { future: description for description, (qa_process, future) in self.m_processes.items() }
+
+        for future in as_completed(futures):
+
+            # 1. Once done, remove the process from the registry
+            description = futures[future]
+            qa_process, _ = self.m_processes.pop(description)
+            finished_processes[description] = qa_process
+
+            # 2. Report how it ended
+            if future.cancelled():
+                print("Job {0} was cancelled before it started".format(description))
+            elif future.exception() is not None:
+                print("Job {0} could not be run: {1}".format(description, future.exception()))
+            elif qa_process.timed_out:
+                print("Job {0} timed out after {1:.1f}s".format(description, qa_process.wall_time))
+            else:
+                print("Job {0} ended with return code: {1} ({2:.1f}s)".format(description, qa_process.return_code, qa_process.wall_time))
+
+        return finished_processes
+
+class QATrash:
+
+    # NOTE: Deletes files and directory trees without making the caller wait on them. Each is renamed into
+    # this run's directory in a trash directory beside it (on the same filesystem, so the rename is atomic
+    # and instant) and is then deleted by a pool of threads. A run keeps its trash directory's modification
+    # time current while it uses it. Anything else in a trash directory that hasn't been touched in
+    # TRASH_STALE_SECONDS (e.g. left by a run that was killed before its deletions finished) is moved into
+    # this run's directory and deleted too. Runs still using theirs are left alone.
+
+    def __init__(self, p_run_uuid, p_max_workers=TRASH_DELETE_WORKERS):
+
+        self.m_run_uuid = p_run_uuid
+        self.m_executor = ThreadPoolExecutor(max_workers=p_max_workers, thread_name_prefix="qa_trash")
+        self.m_futures = {}
+        self.m_trash_directories = set()
+
+    def delete(self, p_path):
+
+        '''Moves a file or directory into this run's trash directory beside it to be deleted in the background.
+        Returns whether there was anything at the path.'''
+
+        path = os.path.abspath(p_path).rstrip(os.sep)
+        if not os.path.lexists(path):
+            return False
+
+        # 1. Make this run's trash directory (the first time, sweeping in what other runs left behind)
+        # NOTE: It is remade each time in case another run took it for stale
+        trash_directory = os.path.join(os.path.dirname(path), TRASH_DIRECTORY)
+        run_trash_directory = os.path.join(trash_directory, self.m_run_uuid)
+        os.makedirs(run_trash_directory, exist_ok=True)
+        if trash_directory not in self.m_trash_directories:
+            self.m_trash_directories.add(trash_directory)
+            self.__sweep_stale_items(trash_directory)
+
+        # 2. Move the item into the trash under a name of its own and queue it for deletion
+        trashed_path = os.path.join(run_trash_directory, "{0}_{1}".format(os.path.basename(path), uuid.uuid4().hex))
+        os.rename(path, trashed_path)
+        self.__queue(trashed_path)
+
+        return True
+
+    def wait(self):
+
+        '''Blocks until everything trashed has been deleted, reporting progress along the way'''
+
+        if 0 == len(self.m_futures):
+            return
+
+        # 1. Wait on the deletions, reporting how many are done every so often
+        # (and marking this run's trash directories as still in use)
+        pending_futures = set(self.m_futures)
+        while len(pending_futures):
+            done_futures, pending_futures = wait_for_futures(pending_futures, timeout=TRASH_PROGRESS_SECONDS)
+            print("Deleted {0} of {1} trashed items".format(len(self.m_futures) - len(pending_futures), len(self.m_futures)), flush=True)
+            self.__touch_run_trash_directories()
+
+        # 2. Report what could not be deleted and remove the trash directories that are now empty
+        # (a trash directory other runs are using still has their directories in it)
+        for future in self.m_futures:
+            if future.exception() is not None:
+                print("WARNING: Could not delete {0}: {1}".format(self.m_futures[future], future.exception()))
+        for trash_directory in self.m_trash_directories:
+            for directory in [os.path.join(trash_directory, self.m_run_uuid), trash_directory]:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+
+        self.m_futures = {}
+        self.m_trash_directories = set()
+
+    def __queue(self, p_trashed_path):
+
+        if os.path.isdir(p_trashed_path) and not os.path.islink(p_trashed_path):
+            future = self.m_executor.submit(shutil.rmtree, p_trashed_path)
+        else:
+            future = self.m_executor.submit(os.unlink, p_trashed_path)
+        self.m_futures[future] = p_trashed_path
+
+    def __sweep_stale_items(self, p_trash_directory):
+
+        # Moves each item in the trash directory that no run has touched in a while into this run's
+        # trash directory and queues it for deletion
+        # NOTE: The move claims an item, so runs sweeping at the same time never delete the same one
+        stale_before = time.time() - TRASH_STALE_SECONDS
+        run_trash_directory = os.path.join(p_trash_directory, self.m_run_uuid)
+        for item in os.listdir(p_trash_directory):
+            if self.m_run_uuid == item:
+                continue
+            item_path = os.path.join(p_trash_directory, item)
+            try:
+                if os.lstat(item_path).st_mtime >= stale_before:
+                    continue
+                swept_path = os.path.join(run_trash_directory, "{0}_{1}".format(item, uuid.uuid4().hex))
+                os.rename(item_path, swept_path)
+            except FileNotFoundError:
+                continue
+            self.__queue(swept_path)
+
+    def __touch_run_trash_directories(self):
+
+        for trash_directory in self.m_trash_directories:
+            try:
+                os.utime(os.path.join(trash_directory, self.m_run_uuid))
+            except OSError:
+                pass
+
+class QAInotifyWatch:
+
+    # NOTE: A minimal inotify watch on a directory through libc (linux only). On other systems,
+    # or if inotify is unavailable, QAInotifyWatch.open returns None and callers poll instead.
+
+    def __init__(self, p_libc, p_fd):
+
+        self.m_libc = p_libc
+        self.m_fd = p_fd
+
+    @staticmethod
+    def open(p_directory):
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(p_directory), INOTIFY_EVENTS) < 0:
+                os.close(fd)
+                return None
+        except (AttributeError, OSError):
+            return None
+
+        return QAInotifyWatch(libc, fd)
+
+    def close(self):
+        os.close(self.m_fd)
+
+    def wait(self, p_timeout):
+
+        '''Waits up to p_timeout seconds for an event in the watched directory. Returns whether there was one.'''
+
+        ready, _, _ = select.select([self.m_fd], [], [], p_timeout)
+        if not ready:
+            return False
+
+        # Drain the queued events (only whether there were any matters)
+        try:
+            while os.read(self.m_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        return True
+
+class QARunJournal:
 
-            # 1. Wait for a process on the queue to finish
-            description, return_code = self.m_queue.get()
+    # NOTE: Jobs append a json line to the run journal as they finish (see append_journal_record).
+    # The journal is followed from where it was last read. inotify only sees writes made from this
+    # node (not from compute nodes writing to a shared filesystem), so it is used to wake up early,
+    # and the journal is also reread on a backoff timer.
 
-            # 2. Once done, remove it from the process list
-            self.__remove_process(description)
+    def __init__(self, p_journal_filepath):
 
-            print("Job {0} ended with return code: {1}".format(description, return_code))
+        self.m_journal_filepath = p_journal_filepath
+        self.m_offset = 0
+        self.m_records = {}
+
+    def read_new_records(self):
+
+        '''Reads records added to the journal since the last read. Returns the new records.'''
+
+        if not os.path.exists(self.m_journal_filepath):
+            return []
+
+        with open(self.m_journal_filepath, "rb") as journal_file:
+            journal_file.seek(self.m_offset)
+            new_bytes = journal_file.read()
+
+        # Only complete lines are read (a line may be in the middle of being written)
+        last_newline = new_bytes.rfind(b"\n")
+        if -1 == last_newline:
+            return []
+        self.m_offset += last_newline + 1
+
+        new_records = []
+        for line in new_bytes[:last_newline].splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.m_records[record["name"]] = record
+            new_records.append(record)
+
+        return new_records
+
+    @property
+    def records(self):
+        return self.m_records
+
+    def wait_for(self, p_job_names, p_since=0, p_timeout=None, p_get_ended_jobs=None, p_min_finished=None):
+
+        '''Blocks until each of the named jobs has a record in the journal for a run that ended after p_since
+        (or until at least p_min_finished of them have). Returns those records keyed by job name. p_get_ended_jobs
+        may name waited on jobs known to have ended some other way (see QASlurmClient.get_ended_jobs);
+        these are left out of the returned records.'''
+
+        start_time = time.time()
+        poll_seconds = JOURNAL_MIN_POLL_SECONDS
+        inotify_watch = QAInotifyWatch.open(str(Path(self.m_journal_filepath).parent))
+
+        try:
+            while True:
+
+                # 1. Check for records of the jobs (checking more often again when there are new ones)
+                if len(self.read_new_records()):
+                    poll_seconds = JOURNAL_MIN_POLL_SECONDS
+                waiting_job_names = [job_name for job_name in p_job_names \
+                    if job_name not in self.m_records or self.m_records[job_name]["end_time"] < p_since]
+                if len(waiting_job_names) and p_get_ended_jobs is not None:
+                    ended_job_names = set(p_get_ended_jobs(waiting_job_names))
+                    waiting_job_names = [job_name for job_name in waiting_job_names if job_name not in ended_job_names]
+                if not len(waiting_job_names) or \
+                   (p_min_finished is not None and len(p_job_names) - len(waiting_job_names) >= p_min_finished):
+                    return { job_name: self.m_records[job_name] for job_name in p_job_names \
+                        if job_name in self.m_records and self.m_records[job_name]["end_time"] >= p_since }
+
+                # 2. Give up after the timeout
+                if p_timeout is not None and time.time() - start_time > p_timeout:
+                    raise TimeoutError("Timed out waiting on {0} job(s) in {1}: {2}".format(
+                        len(waiting_job_names), self.m_journal_filepath, waiting_job_names))
+
+                # 3. Wait for the journal's directory to change, or for the next poll
+                if inotify_watch is not None:
+                    inotify_watch.wait(poll_seconds)
+                else:
+                    time.sleep(poll_seconds)
+                poll_seconds = min(2 * poll_seconds, JOURNAL_MAX_POLL_SECONDS)
+        finally:
+            if inotify_watch is not None:
+                inotify_watch.close()
+
+class QAArchiveBundle:
+
+    # NOTE: A tar of individually gzipped files with a json index of each file's offset and size in it,
+    # so that one file can be read back with a seek instead of decompressing or scanning the whole archive.
+    # Files added again (e.g. by a later archive_logs of the same run) replace earlier copies in the index.
+
+    def __init__(self, p_bundle_filepath, p_index_filepath):
+
+        self.m_bundle_filepath = p_bundle_filepath
+        self.m_index_filepath = p_index_filepath
+
+    def add_files(self, p_filepaths):
+
+        '''Appends the files to the bundle (gzipping each on the way in), updates the index, then removes the files'''
+
+        index = self.read_index()
+
+        # 1. Stream each file through gzip into a spooled buffer to learn its size, then into the tar
+        with tarfile.open(self.m_bundle_filepath, "a" if os.path.exists(self.m_bundle_filepath) else "w") as bundle_file:
+            for filepath in p_filepaths:
+
+                file_stat = os.stat(filepath)
+                with tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_BYTES) as compressed_file:
+                    with open(filepath, "rb") as source_file, gzip.GzipFile(fileobj=compressed_file, mode="wb", mtime=file_stat.st_mtime) as gzip_file:
+                        shutil.copyfileobj(source_file, gzip_file)
+                    member_info = tarfile.TarInfo(Path(filepath).name + ".gz")
+                    member_info.size = compressed_file.tell()
+                    member_info.mtime = file_stat.st_mtime
+                    compressed_file.seek(0)
+                    bundle_file.addfile(member_info, compressed_file)
+
+                # (the tar now ends with the file's data, padded out to a whole number of blocks)
+                data_offset = bundle_file.offset - tarfile.BLOCKSIZE * math.ceil(member_info.size / tarfile.BLOCKSIZE)
+                index[Path(filepath).name] = {
+                    "member": member_info.name,
+                    "offset": data_offset,
+                    "size": member_info.size,
+                    "original_size": file_stat.st_size,
+                    "mtime": file_stat.st_mtime
+                }
+
+        # 2. Save the index (replacing the old one in one step) before removing the files it now points to
+        with open(self.m_index_filepath + ".tmp", "w") as index_file:
+            json.dump(index, index_file, indent=1)
+        os.replace(self.m_index_filepath + ".tmp", self.m_index_filepath)
+        for filepath in p_filepaths:
+            os.unlink(filepath)
+
+    def read(self, p_filename):
+
+        '''Contents of an archived file, read from its offset in the bundle'''
+
+        member = self.read_index()[p_filename]
+        with open(self.m_bundle_filepath, "rb") as bundle_file:
+            bundle_file.seek(member["offset"])
+            return gzip.decompress(bundle_file.read(member["size"]))
+
+    def read_index(self):
+
+        if not os.path.exists(self.m_index_filepath):
+            return {}
+        with open(self.m_index_filepath, "r") as index_file:
+            return json.load(index_file)
+
+class QADirectorySnapshot:
+
+    # NOTE: Listings of the directories a command reads (the book directory, each book's directory, etc.),
+    # each made once with os.scandir. The listing itself says which entries are directories, so unlike
+    # os.listdir plus os.path.isdir there is no extra stat per entry. Listings are kept until they are
+    # invalidated, so steps that add or remove items in a listed directory must invalidate it after.
+
+    def __init__(self, p_book_directory):
+
+        self.m_book_directory = format_path(p_book_directory)
+        self.m_listings = {}
+
+    def get_book_names(self):
+        return self.get_items(self.m_book_directory, ["directories"])
+
+    def get_items(self, p_directory, p_return_types=[]):
+
+        '''Get all items in the given directory of type "directories" and/or "files" (as get_items_in_dir)'''
+
+        return [name for name, is_directory in self.__get_listing(p_directory) \
+            if ("directories" in p_return_types and is_directory) or ("files" in p_return_types and not is_directory)]
+
+    def get_tifs(self, p_directory):
+
+        # Names of the tif images in the directory (matching a glob of "*.tif")
+        return [name for name in self.get_items(p_directory, ["files"]) if name.endswith(".tif") and not name.startswith(".")]
+
+    def has_directory(self, p_directory, p_subdirectory_name):
+
+        # Whether the directory exists and has the given subdirectory (whose name may end with a separator)
+        try:
+            return p_subdirectory_name.rstrip(os.sep) in self.get_items(p_directory, ["directories"])
+        except FileNotFoundError:
+            return False
+
+    def invalidate(self, p_directory=None):
+
+        '''Forgets the listings of the given directory and those beneath it (or all listings if none is given)'''
+
+        if p_directory is None:
+            self.m_listings.clear()
+            return
+
+        directory = format_path(os.path.abspath(p_directory))
+        for listed_directory in [listed_directory for listed_directory in self.m_listings if listed_directory.startswith(directory)]:
+            del self.m_listings[listed_directory]
+
+    def __get_listing(self, p_directory):
+
+        directory = format_path(os.path.abspath(p_directory))
+        if directory not in self.m_listings:
+            with os.scandir(directory) as directory_entries:
+                self.m_listings[directory] = [(entry.name, entry.is_dir()) for entry in directory_entries]
+
+        return self.m_listings[directory]
+
+class QARunCatalog:
+
+    # NOTE: SQLite index of the runs in an output directory and the files (artifacts) they produce,
+    # so that finding a run's files is a lookup instead of a scan of the (often remote) directories
+    # they are in. Jobs on other nodes record their files too, so statements wait on others' locks.
+    # The catalog's connection (and its tables) are set up once, when the output directory exists.
+    # Files it never recorded are scanned for by callers, but a catalog that can't be used is an error.
+
+    def __init__(self, p_output_directory):
+
+        self.m_catalog_filepath = os.path.join(p_output_directory, RUN_CATALOG_FILENAME)
+        self.m_connection = None
+        self.m_lock = threading.Lock()
+
+        # The output directory may only be made later in the run (e.g. by the command that starts it)
+        if os.path.isdir(p_output_directory):
+            with self.m_lock:
+                self.__connect()
+
+    def add_run(self, p_run_uuid, p_module):
+
+        '''Records a run (if it isn't already)'''
+
+        self.__execute("INSERT OR IGNORE INTO runs (run_uuid, module, created_at) VALUES (?, ?, ?)",
+            (p_run_uuid, p_module, time.time()))
+
+    def close(self):
+
+        with self.m_lock:
+            if self.m_connection is not None:
+                self.m_connection.close()
+                self.m_connection = None
+
+    def find_artifacts(self, p_run_uuid, p_book_name, p_kind):
+
+        '''Returns the paths of a run's artifacts of the given kind for a book, newest first
+        (leaving out any that no longer exist)'''
+
+        rows = self.__execute("SELECT filepath FROM artifacts WHERE run_uuid = ? AND book_name = ? AND kind = ? " + \
+            "ORDER BY mtime DESC, filepath", (p_run_uuid, p_book_name, p_kind))
+
+        return [row[0] for row in rows if os.path.exists(row[0])]
+
+    def get_run_uuids(self):
+        return [row[0] for row in self.__execute("SELECT run_uuid FROM runs", ())]
+
+    def has_run(self, p_run_uuid):
+        return bool(self.__execute("SELECT 1 FROM runs WHERE run_uuid = ?", (p_run_uuid,)))
+
+    def record_artifact(self, p_filepath, p_run_uuid, p_module, p_book_name, p_kind):
+
+        '''Records (or updates) a file produced by a run, with its current size and modification time'''
+
+        file_stats = os.stat(p_filepath)
+        self.__execute("INSERT OR REPLACE INTO artifacts " + \
+            "(filepath, run_uuid, module, book_name, kind, size, mtime, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(p_filepath), p_run_uuid, p_module, p_book_name, p_kind, file_stats.st_size, file_stats.st_mtime, time.time()))
+
+    def __connect(self):
+
+        # Opens the catalog's connection and creates its tables (if they don't exist yet)
+        # NOTE: Called with the lock held. The connection is shared by this module's threads.
+        try:
+            connection = sqlite3.connect(self.m_catalog_filepath, timeout=RUN_CATALOG_TIMEOUT_SECONDS, check_same_thread=False)
+            try:
+                with connection:
+                    connection.executescript(
+                        "CREATE TABLE IF NOT EXISTS runs (run_uuid TEXT PRIMARY KEY, module TEXT, created_at REAL);" + \
+                        "CREATE TABLE IF NOT EXISTS artifacts (filepath TEXT PRIMARY KEY, run_uuid TEXT, module TEXT, " + \
+                        "book_name TEXT, kind TEXT, size INTEGER, mtime REAL, recorded_at REAL);" + \
+                        "CREATE INDEX IF NOT EXISTS artifacts_by_run ON artifacts (run_uuid, book_name, kind);")
+            except sqlite3.Error:
+                connection.close()
+                raise
+        except sqlite3.Error as sqlite_error:
+            print("ERROR: Could not open run catalog {0}: {1}".format(self.m_catalog_filepath, sqlite_error))
+            raise
+        self.m_connection = connection
+
+    def __execute(self, p_sql, p_parameters):
+
+        # Returns the rows of the statement's results
+        with self.m_lock:
+            if self.m_connection is None:
+                self.__connect()
+            try:
+                with self.m_connection:
+                    return self.m_connection.execute(p_sql, p_parameters).fetchall()
+            except sqlite3.Error as sqlite_error:
+                print("ERROR: Could not use run catalog {0}: {1}".format(self.m_catalog_filepath, sqlite_error))
+                raise
+
+class QASlurmClient:
+
+    # NOTE: Submits jobs with sbatch and checks on them with squeue and sacct, running these commands
+    # as asyncio subprocesses. Submissions run a few at a time, and each check on job status is one squeue
+    # call and one sacct call covering every submitted job. The commands are configurable so that
+    # stand-in scripts can take the place of slurm's.
+
+    def __init__(self, p_sbatch_command="sbatch", p_squeue_command="squeue", p_sacct_command="sacct",
+                 p_max_submissions=8, p_status_poll_seconds=30):
+
+        self.m_sbatch_command = shlex.split(p_sbatch_command)
+        self.m_squeue_command = shlex.split(p_squeue_command)
+        self.m_sacct_command = shlex.split(p_sacct_command)
+        self.m_max_submissions = max(1, int(p_max_submissions))
+        self.m_status_poll_seconds = p_status_poll_seconds
+        self.m_last_status_time = None
+
+        # Submitted jobs keyed by submission name, and the submission name of each job they run
+        self.m_jobs = {}
+        self.m_submission_names = {}
+
+    def get_dependency_ids(self, p_job_names, p_array_tasks=True):
+
+        '''Returns the slurm job ids that the named jobs were submitted with, for use in sbatch dependencies.
+        Jobs run as array tasks are given as that task (or as the whole array if p_array_tasks is False).
+        Jobs that were not submitted are left out.'''
+
+        dependency_ids = {}
+        for job_name in p_job_names:
+            job = self.get_job(job_name)
+            if job is None or job["job_id"] is None:
+                continue
+            task_index = job["array_tasks"][job_name]
+            if task_index is None or not p_array_tasks:
+                dependency_ids[job["job_id"]] = True
+            else:
+                dependency_ids["{0}_{1}".format(job["job_id"], task_index)] = True
+
+        return list(dependency_ids.keys())
+
+    def get_ended_jobs(self, p_job_names):
+
+        '''Returns which of the named jobs slurm has finished with (or failed to submit), checking on the jobs
+        at most once every status poll interval. Jobs are only counted once they were seen ending a poll interval ago,
+        so that records they wrote on the way out have time to show up on a shared filesystem.'''
+
+        submission_names = set([self.m_submission_names[job_name] for job_name in p_job_names if job_name in self.m_submission_names])
+        if not len(submission_names):
+            return []
+
+        # 1. Check on jobs that slurm may still be running
+        if self.m_last_status_time is None or time.time() - self.m_last_status_time >= self.m_status_poll_seconds:
+            self.update_states()
+
+        # 2. Jobs run by submissions that have ended
+        ended_before = time.time() - self.m_status_poll_seconds
+        return [job_name for job_name in p_job_names if job_name in self.m_submission_names and \
+            self.m_jobs[self.m_submission_names[job_name]]["ended_at"] is not None and \
+            self.m_jobs[self.m_submission_names[job_name]]["ended_at"] <= ended_before]
+
+    def get_job(self, p_job_name):
+
+        '''Returns the submitted job that runs the named job (or None)'''
+
+        return self.m_jobs.get(self.m_submission_names.get(p_job_name, None), None)
+
+    @property
+    def jobs(self):
+        return self.m_jobs
+
+    def submit(self, p_submissions):
+
+        '''Submits each (name, array task index of each job it runs keyed by job name, sbatch arguments) with sbatch.
+        Returns the submitted jobs.'''
+
+        return asyncio.run(self.__submit_all(p_submissions))
+
+    def update_states(self):
+
+        '''Updates the state of every submitted job that slurm has not finished with'''
+
+        self.m_last_status_time = time.time()
+
+        job_ids = [job["job_id"] for job in self.m_jobs.values() if job["job_id"] is not None and job["ended_at"] is None]
+        if not len(job_ids):
+            return
+
+        # 1. One squeue call and one sacct call for all of the jobs
+        squeue_states, sacct_states = asyncio.run(self.__query_states(job_ids))
+
+        # 2. A job is finished once neither reports any of its tasks as active
+        # NOTE: squeue only knows about jobs that are queued or have just ended, and sacct
+        # may not be set up (or may lag behind), so if squeue fails nothing is concluded
+        if squeue_states is None:
+            return
+        for job in self.m_jobs.values():
+            if job["job_id"] not in job_ids:
+                continue
+            job_states = squeue_states.get(job["job_id"], []) + (sacct_states or {}).get(job["job_id"], [])
+            active_states = [state for state in job_states if state in SLURM_ACTIVE_STATES]
+            if len(active_states):
+                job["state"] = active_states[0]
+                continue
+            failed_states = [state for state in job_states if "COMPLETED" != state]
+            job["state"] = failed_states[0] if len(failed_states) else ("COMPLETED" if len(job_states) else "ENDED")
+            job["ended_at"] = self.m_last_status_time
+
+    async def __query_states(self, p_job_ids):
+
+        # Returns slurm job states (one per job or array task) keyed by job id, from squeue and from sacct
+        # (or None for either one that couldn't be run)
+
+        job_id_list = ",".join(p_job_ids)
+        (squeue_status, squeue_output, squeue_errors), (sacct_status, sacct_output, _) = await asyncio.gather(
+            self.__run_command(self.m_squeue_command + ["-h", "-o", "%i|%T", "-j", job_id_list]),
+            self.__run_command(self.m_sacct_command + ["-n", "-P", "-X", "-o", "JobID,State", "-j", job_id_list]))
+
+        # squeue fails on job ids it no longer knows about
+        if 0 != squeue_status and "Invalid job id" not in squeue_errors:
+            squeue_output = None
+        if 0 != sacct_status:
+            sacct_output = None
+
+        return [None if output is None else self.__parse_states(output) for output in [squeue_output, sacct_output]]
+
+    def __parse_states(self, p_output):
+
+        # Lines of "<job id>[_<array task(s)>]|<state>[ by <user>]"
+        job_states = {}
+        for line in p_output.splitlines():
+            if "|" not in line:
+                continue
+            job_id, state = line.strip().split("|")[:2]
+            job_states.setdefault(job_id.split("_")[0].split(".")[0], []).append(state.split(" ")[0].rstrip("+"))
+
+        return job_states
+
+    async def __run_command(self, p_command):
+
+        # Returns the exit status, output, and errors of a command (exit status is None if it could not be run)
+        try:
+            process = await asyncio.create_subprocess_exec(*p_command,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as os_error:
+            return None, "", str(os_error)
+        output, errors = await process.communicate()
+
+        return process.returncode, output.decode(errors="replace"), errors.decode(errors="replace")
+
+    async def __submit(self, p_semaphore, p_name, p_array_tasks, p_sbatch_args):
+
+        async with p_semaphore:
+
+            print("{0} {1}".format(" ".join(self.m_sbatch_command), shlex.join(p_sbatch_args)))
+            exit_status, output, errors = await self.__run_command(self.m_sbatch_command + p_sbatch_args)
+
+        # Record the job id sbatch gives the job (or that it could not be submitted)
+        job_id_match = SBATCH_SUBMITTED_REGEX.search(output)
+        job = {
+            "name": p_name,
+            "job_id": job_id_match.group(1) if job_id_match else None,
+            "job_names": list(p_array_tasks.keys()),
+            "array_tasks": p_array_tasks,
+            "state": "SUBMITTED" if job_id_match else "SUBMIT_FAILED",
+            "submitted_at": time.time(),
+            "ended_at": None if job_id_match else 0,
+            "sbatch_output": (output + errors).strip()
+        }
+        if job_id_match is None:
+            print("Failed to submit {0} (exit status {1}): {2}".format(p_name, exit_status, job["sbatch_output"]))
+
+        self.m_jobs[p_name] = job
+        for job_name in p_array_tasks:
+            self.m_submission_names[job_name] = p_name
+
+        return job
+
+    async def __submit_all(self, p_submissions):
+
+        semaphore = asyncio.Semaphore(self.m_max_submissions)
+        return await asyncio.gather(*[self.__submit(semaphore, name, array_tasks, sbatch_args) \
+            for name, array_tasks, sbatch_args in p_submissions])
+
+class QAPageIndex:
+
+    # NOTE: Metadata of a book's page images (width, height, bytes, mode, compression, mtime) kept in a
+    # sidecar in the book's cache folder, keyed by each image's path within the book. An entry is reused
+    # while its image's size and mtime are unchanged. Others are read from the images' headers (without
+    # decoding any pixels) on a pool of threads.
+
+    def __init__(self, p_book_directory):
+
+        self.m_book_directory = format_path(p_book_directory)
+        self.m_index_filepath = os.path.join(p_book_directory, BOOK_CACHE_DIRECTORY, PAGE_INDEX_FILENAME)
+        self.m_entries = {}
+
+        if os.path.exists(self.m_index_filepath):
+            try:
+                with open(self.m_index_filepath, "r") as index_file:
+                    self.m_entries = json.load(index_file)
+            except (OSError, ValueError):
+                print("WARNING: Could not read page index {0}, rebuilding it".format(self.m_index_filepath))
+
+    def get_pages(self, p_image_filepaths, p_max_workers=PAGE_INDEX_WORKERS):
+
+        '''Metadata of each image keyed by its given filepath (None for images that can't be read)'''
+
+        # 1. Find the images that are new or have changed since they were indexed
+        stale_filepaths = []
+        for image_filepath in p_image_filepaths:
+            entry = self.m_entries.get(os.path.relpath(image_filepath, self.m_book_directory))
+            size, mtime_ns = get_file_signature(image_filepath)
+            if entry is None or size != entry["bytes"] or mtime_ns != entry["mtime_ns"]:
+                stale_filepaths.append(image_filepath)
+
+        # 2. Read their headers side by side, then save the index (replaced in one step, as jobs may share a book)
+        if len(stale_filepaths):
+            with ThreadPoolExecutor(max_workers=p_max_workers) as executor:
+                for image_filepath, entry in zip(stale_filepaths, executor.map(read_page_metadata, stale_filepaths)):
+                    self.m_entries[os.path.relpath(image_filepath, self.m_book_directory)] = entry
+            self.save()
+
+        return { image_filepath: self.m_entries[os.path.relpath(image_filepath, self.m_book_directory)] \
+            if "error" not in self.m_entries[os.path.relpath(image_filepath, self.m_book_directory)] else None \
+            for image_filepath in p_image_filepaths }
+
+    def save(self):
+
+        os.makedirs(Path(self.m_index_filepath).parent, exist_ok=True)
+        temp_filepath = self.m_index_filepath + ".{0}.tmp".format(os.getpid())
+        with open(temp_filepath, "w") as index_file:
+            json.dump(self.m_entries, index_file)
+        os.replace(temp_filepath, self.m_index_filepath)
+
+class QAStatsManifest:
+
+    # NOTE: Records which source files already have up to date rows in a stats csv file,
+    # keyed by source path, size, mtime, and stats type (e.g. an autocrop type). The manifest
+    # is a json lines file that is only appended to, with later entries overriding earlier ones.
+    # It is only trusted while the stats file it describes still exists.
+
+    def __init__(self, p_manifest_filepath, p_stats_filepath):
+
+        self.m_manifest_filepath = p_manifest_filepath
+        self.m_stats_filepath = p_stats_filepath
+        self.m_entries = {}
+        self.m_pending_entries = []
+
+        # 1. Start over if either the manifest or the stats file it describes is missing
+        if not os.path.exists(p_manifest_filepath) or not os.path.exists(p_stats_filepath):
+            self.reset()
+            return
+
+        # 2. Read in the recorded entries (a partially written last line is ignored)
+        with open(p_manifest_filepath, "r") as manifest_file:
+            for line in manifest_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get("forgotten", False):
+                    self.m_entries.pop((entry["path"], entry["type"]), None)
+                else:
+                    self.m_entries[(entry["path"], entry["type"])] = entry
+
+    def forget(self, p_source_filepath, p_stats_type):
+
+        # Mark a source file's stats as needing to be recalculated
+        entry = { "path": os.path.abspath(p_source_filepath), "type": p_stats_type, "forgotten": True }
+        if self.m_entries.pop((entry["path"], entry["type"]), None) is not None:
+            self.m_pending_entries.append(entry)
+
+    def is_current(self, p_source_filepath, p_stats_type, p_settings=""):
+
+        entry = self.m_entries.get((os.path.abspath(p_source_filepath), p_stats_type))
+        if entry is None:
+            return False
+
+        size, mtime_ns = get_file_signature(p_source_filepath)
+        return size == entry["size"] and mtime_ns == entry["mtime_ns"] and p_settings == entry["settings"]
+
+    def prune_stats_file(self, p_row_is_current):
+
+        '''Rewrites the stats file without the rows that p_row_is_current (given a csv.DictReader row) rejects.
+        Returns the rows kept, or None if there is no stats file with a header to append to.'''
+
+        if not os.path.exists(self.m_stats_filepath) or not len(self.m_entries):
+            return None
+
+        # 1. Read the stats file and keep its up to date rows
+        with open(self.m_stats_filepath, "r") as stats_file:
+            csv_reader = csv.DictReader(stats_file)
+            if csv_reader.fieldnames is None:
+                return None
+            fieldnames = csv_reader.fieldnames
+            all_rows = list(csv_reader)
+        current_rows = [row for row in all_rows if p_row_is_current(row)]
+
+        # 2. Only rewrite the file when some of its rows are out of date
+        if len(current_rows) < len(all_rows):
+
+            print("Removing {0} out of date row(s) from {1}".format(len(all_rows) - len(current_rows), self.m_stats_filepath))
+
+            temp_filepath = self.m_stats_filepath + ".{0}.tmp".format(os.getpid())
+            with open(temp_filepath, "w") as temp_file:
+                csv_writer = csv.DictWriter(temp_file, fieldnames=fieldnames)
+                csv_writer.writeheader()
+                csv_writer.writerows(current_rows)
+            os.replace(temp_filepath, self.m_stats_filepath)
+
+        return current_rows
+
+    def record(self, p_source_filepath, p_stats_type, p_settings=""):
+
+        size, mtime_ns = get_file_signature(p_source_filepath)
+        entry = {
+            "path": os.path.abspath(p_source_filepath),
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "type": p_stats_type,
+            "settings": p_settings
+        }
+        self.m_entries[(entry["path"], entry["type"])] = entry
+        self.m_pending_entries.append(entry)
+
+    def reset(self):
+
+        # Forget all entries and truncate the manifest file
+        self.m_entries = {}
+        self.m_pending_entries = []
+        os.makedirs(Path(self.m_manifest_filepath).parent, exist_ok=True)
+        open(self.m_manifest_filepath, "w").close()
+
+    def save(self):
+
+        # Append entries recorded since the last save
+        # NOTE: Should be called only after the rows the entries describe are written to the stats file
+        if not len(self.m_pending_entries):
+            return
+        with open(self.m_manifest_filepath, "a") as manifest_file:
+            for entry in self.m_pending_entries:
+                manifest_file.write(json.dumps(entry) + "\n")
+        self.m_pending_entries = []
 
 # Functions
 
+def append_csv_file(p_source_filepath, p_destination_filepath):
+
+    '''Appends the rows of a csv file to another, along with its header if the other is new or empty'''
+
+    write_header = not os.path.exists(p_destination_filepath) or 0 == os.path.getsize(p_destination_filepath)
+    with open(p_source_filepath, "r") as input_file:
+        lines = input_file.readlines()
+    with open(p_destination_filepath, "a") as output_file:
+        output_file.writelines(lines if write_header else lines[1:])
+
+def append_journal_record(p_journal_filepath, p_record):
+
+    '''Appends a record to a run journal as a single write, so that records from jobs finishing at once don't interleave'''
+    journal_fd = os.open(p_journal_filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    try:
+        os.write(journal_fd, (json.dumps(p_record) + "\n").encode("utf-8"))
+    finally:
+        os.close(journal_fd)
+
+def binary_frobenius_norm(p_binary_mtx1, p_binary_mtx2):
+
+    '''Frobenius norm of the difference of two binary images, which is the square root of the number of pixels that differ'''
+    return math.sqrt(count_binary_differences(p_binary_mtx1, p_binary_mtx2))
+
+def bounded_ordered_map(p_executor, p_function, p_max_in_flight, *p_iterables):
+
+    '''Like Executor.map, but with no more than p_max_in_flight calls submitted and not yet yielded at a time,
+    so that results waiting to be consumed can't pile up in memory'''
+    pending_futures = collections.deque()
+    for function_args in zip(*p_iterables):
+        if len(pending_futures) >= p_max_in_flight:
+            yield pending_futures.popleft().result()
+        pending_futures.append(p_executor.submit(p_function, *function_args))
+    while len(pending_futures):
+        yield pending_futures.popleft().result()
+
 def copy_data_directory(p_src_directory, p_dest_directory):
 
     directories = get_items_in_dir(p_src_directory, ["directories"])
@@ -322,6 +1765,36 @@ def copy_data_directory(p_src_directory, p_dest_directory):
             filename = Path(src_filepath).name
             shutil.copyfile(src_filepath, new_dir + filename)
 
+def count_binary_differences(p_binary_mtx1, p_binary_mtx2, p_band_rows=BINARY_DIFF_BAND_ROWS):
+
+    '''Counts the pixels that differ between two binary images (boolean arrays or mode '1' PIL images).
+    Bands of rows are packed to bits, XOR'd, and popcounted so that memory use stays at a few bytes per image row.
+    Images of different sizes are aligned at their top left corners, with pixels outside of the smaller image
+    treated as unset (i.e. as if it were pasted onto a blank canvas the size of the larger one)'''
+
+    binary_mtx1 = np.asarray(p_binary_mtx1, dtype=bool)
+    binary_mtx2 = np.asarray(p_binary_mtx2, dtype=bool)
+    overlap_columns = min(binary_mtx1.shape[1], binary_mtx2.shape[1])
+
+    difference_count = 0
+    for start_row in range(0, max(binary_mtx1.shape[0], binary_mtx2.shape[0]), p_band_rows):
+
+        band1 = binary_mtx1[start_row:start_row + p_band_rows]
+        band2 = binary_mtx2[start_row:start_row + p_band_rows]
+        overlap_rows = min(band1.shape[0], band2.shape[0])
+
+        # 1. Pixels in the overlapping region differ where their bits differ
+        difference_count += popcount(np.bitwise_xor(
+            np.packbits(band1[:overlap_rows, :overlap_columns], axis=1),
+            np.packbits(band2[:overlap_rows, :overlap_columns], axis=1)))
+
+        # 2. Pixels outside of the overlapping region differ wherever they are set
+        for band in [band1, band2]:
+            difference_count += popcount(np.packbits(band[:overlap_rows, overlap_columns:], axis=1))
+            difference_count += popcount(np.packbits(band[overlap_rows:], axis=1))
+
+    return difference_count
+
 def directory_has_files_of_type(p_book_directory, p_file_tag):
 
     items = get_items_in_dir(format_path(p_book_directory), return_types=["files"])
@@ -331,6 +1804,17 @@ def directory_has_files_of_type(p_book_directory, p_file_tag):
             found_tif = True
     return found_tif
 
+def extract_archived_file(p_archive_directory, p_run_uuid, p_filename, p_destination_filepath=None):
+
+    '''Writes one file from a run's archive bundle (see QA_Module.archive_output_items) to the destination
+    (by default, the file's name in the current directory)'''
+
+    archive_directory = format_path(p_archive_directory)
+    bundle = QAArchiveBundle(archive_directory + ARCHIVE_BUNDLE_FILENAME.format(p_run_uuid),
+        archive_directory + ARCHIVE_INDEX_FILENAME.format(p_run_uuid))
+    with open(p_destination_filepath or p_filename, "wb") as output_file:
+        output_file.write(bundle.read(p_filename))
+
 def find_errors(p_errors_to_look_for, p_directory, p_filesearch_str_w_wildcard):
 
     files_containing_errors = { error_string:[] for error_string in p_errors_to_look_for }
@@ -409,7 +1893,7 @@ def find_missing_images_le(p_book_directory, p_output_directory, p_single_or_mul
     else:
         missing_image_filepaths = find_missing_images_le_helper(book_dir)
 
-    run_uuid = get_unique_uuid(output_dir, "*.csv")
+    run_uuid = get_unique_uuid(output_dir)
 
     with open("{0}missing_le_images_{1}.csv".format(output_dir, run_uuid), "w") as output_file:
         csv_writer = csv.writer(output_file)
@@ -588,6 +2072,33 @@ def get_uniquer_error_line(p_error):
 
     return key_line.strip()
 
+def get_allocated_cpu_count():
+
+    '''Number of CPUs this process may use, preferring the size of its slurm allocation'''
+    if os.environ.get("SLURM_CPUS_PER_TASK", "").isdigit():
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def get_file_signature(p_filepath):
+
+    '''Size and modification time of a file, or (None, None) if it does not exist'''
+    try:
+        file_stat = os.stat(p_filepath)
+    except FileNotFoundError:
+        return None, None
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+def get_book_size(p_book_directory, p_packing_mode):
+
+    '''Number of pages or total bytes of the page images in a book directory'''
+    # NOTE: Bytes are the same file sizes get_image_stats reports, read without opening the images
+    image_filepaths = glob.glob(os.path.join(p_book_directory, "*.tif"))
+    if PACKING_BYTES == p_packing_mode:
+        return sum([os.stat(image_filepath).st_size for image_filepath in image_filepaths])
+    return len(image_filepaths)
+
 def get_image_stats(p_image_filepath):
 
     try:
@@ -605,17 +2116,15 @@ def get_image_stats(p_image_filepath):
 def get_items_in_dir(path, return_types=[]):
     '''Get all items in given path of type "directories" and/or "files"'''
 
-    formatted_path = format_path(path)
-    directory_contents = os.listdir(formatted_path)
+    # NOTE: scandir's entries know if they are directories without a stat of their own
     returned_contents = []
-
-    for dI in directory_contents:
-        if "directories" in return_types:
-            if os.path.isdir(os.path.join(formatted_path, dI)):
-                returned_contents.append(dI)
-        if "files" in return_types:
-            if not os.path.isdir(os.path.join(formatted_path, dI)):
-                returned_contents.append(dI)
+    with os.scandir(format_path(path)) as directory_entries:
+        for entry in directory_entries:
+            if entry.is_dir():
+                if "directories" in return_types:
+                    returned_contents.append(entry.name)
+            elif "files" in return_types:
+                returned_contents.append(entry.name)
 
     return returned_contents
 
@@ -695,21 +2204,73 @@ def get_line_extraction_angles(p_search_directory):
             if image_angle_dict[filename]["funny"]:
                 csv_writer.writerow([image_angle_dict[filename]["path"], image_angle_dict[filename]["angle"]])
 
-def get_unique_uuid(p_search_directory, p_search_string):
+def get_sbatch_args(p_sbatch_directives, p_command):
+
+    '''sbatch arguments that submit a shell command to slurm with the given sbatch directives'''
+
+    sbatch_args = []
+    for arg in p_sbatch_directives:
+        sbatch_args.extend([arg, str(p_sbatch_directives[arg])])
+    sbatch_args.append("--wrap={0}".format(p_command))
+
+    return sbatch_args
+
+def get_sbatch_array_args(p_jobs, p_sbatch_directives, p_array_name, p_output_directory, p_throttle=None, p_journal_filepath=""):
+
+    '''sbatch arguments that submit one slurm job array for the given QAJobs. Jobs are written to a task manifest
+    that each array task reads its command from.'''
+
+    # 1. Write a manifest of the tasks (line index == SLURM_ARRAY_TASK_ID)
+    task_manifest_filepath = "{0}array_tasks_{1}.jsonl".format(p_output_directory, p_array_name)
+    write_task_manifest(task_manifest_filepath, p_jobs, p_journal_filepath)
+
+    # 2. Array size (and how many of its tasks may run at once), name, and per task log files
+    sbatch_directives = dict(p_sbatch_directives)
+    sbatch_directives["--array"] = "0-{0}".format(len(p_jobs) - 1)
+    if p_throttle:
+        sbatch_directives["--array"] += "%{0}".format(p_throttle)
+    sbatch_directives["-J"] = p_array_name
+    sbatch_directives["-o"] = "{0}slurm-{1}_%A_%a.out".format(p_output_directory, p_array_name)
+
+    return get_sbatch_args(sbatch_directives, "python3 qa_utilities.py run_array_task {0}".format(task_manifest_filepath))
+
+def get_sbatch_job_args(p_job, p_sbatch_directives, p_output_directory="", p_journal_filepath=""):
 
-    # 1. Get a random UUID
-    new_uuid = uuid.uuid4()
+    '''sbatch arguments that submit a single QAJob to slurm with its own job name and log file'''
 
-    # 2. Make sure no file in the search directory matching the given search string has this UUID
-    filepaths = glob.glob(p_search_directory + p_search_string)
-    for index in range(len(filepaths)):
+    sbatch_directives = dict(p_sbatch_directives)
+    sbatch_directives["-J"] = p_job.name
+    sbatch_directives["-o"] = p_job.log_filepath
 
-        # A. Get a new UUID if the current one is detected in a filename
-        if str(new_uuid) in os.path.basename(filepaths[index]):
-            new_uuid = uuid.uuid4()
-            index = 0
+    # Jobs recorded in a run journal are run from a one task manifest by run_array_task
+    if p_journal_filepath:
+        task_manifest_filepath = "{0}job_{1}.jsonl".format(p_output_directory, p_job.name)
+        write_task_manifest(task_manifest_filepath, [p_job], p_journal_filepath)
+        return get_sbatch_args(sbatch_directives, "python3 qa_utilities.py run_array_task {0}".format(task_manifest_filepath))
 
-    return str(new_uuid)
+    return get_sbatch_args(sbatch_directives, p_job.command)
+
+def get_unique_uuid(p_output_directory):
+
+    '''Returns a random UUID that no run recorded in the output directory's run catalog has used'''
+
+    # NOTE: No run can have been recorded in an output directory that doesn't exist yet
+    new_uuid = str(uuid.uuid4())
+    if not os.path.isdir(p_output_directory):
+        return new_uuid
+    run_catalog = QARunCatalog(p_output_directory)
+    while run_catalog.has_run(new_uuid):
+        new_uuid = str(uuid.uuid4())
+    run_catalog.close()
+
+    return new_uuid
+
+def get_worker_count(p_requested_workers):
+
+    '''Number of worker processes for a config value that is either a count or "auto" (the size of the allocation)'''
+    if WORKERS_AUTO == str(p_requested_workers).strip().lower():
+        return get_allocated_cpu_count()
+    return max(1, int(p_requested_workers))
 
 def makedirs(p_location):
 
@@ -717,6 +2278,37 @@ def makedirs(p_location):
         shutil.rmtree(p_location, ignore_errors=True)
     os.makedirs(p_location)
 
+def pack_jobs(p_jobs, p_packing_mode, p_target):
+
+    '''Groups QAJobs so that the books in each group total no more than p_target pages or bytes (first fit decreasing).
+    Jobs on books larger than the target get a group of their own.'''
+
+    # 1. Largest books first
+    job_sizes = [(get_book_size(job.book_directory, p_packing_mode), job) for job in p_jobs]
+    job_sizes.sort(key=lambda job_size: job_size[0], reverse=True)
+
+    # 2. Put each job in the first group it fits in, or start a new group
+    job_groups = []
+    group_sizes = []
+    for size, job in job_sizes:
+        for group_index in range(len(job_groups)):
+            if group_sizes[group_index] + size <= p_target:
+                job_groups[group_index].append(job)
+                group_sizes[group_index] += size
+                break
+        else:
+            job_groups.append([job])
+            group_sizes.append(size)
+
+    return job_groups
+
+def popcount(p_byte_array):
+
+    '''Total number of set bits in an array of bytes'''
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(p_byte_array).sum(dtype=np.int64))
+    return int(POPCOUNT_TABLE[p_byte_array].sum(dtype=np.int64))
+
 def print_debug_header(p_header="", p_header_character="=", p_header_length=80):
 
     print("{0} {1}".format(p_header, p_header_character * (p_header_length - len(p_header) - 1)))
@@ -731,9 +2323,13 @@ def read_error_file(p_error_filepath_with_wildcard, p_module_name):
     error_filepath = ""
     
     # 0. Use first file that matches the given filepath with wildcard
-    for filepath in glob.glob(p_error_filepath_with_wildcard):
-        error_filepath = filepath
-        break
+    # (a filepath without wildcards is just checked for, without listing its directory)
+    if not glob.has_magic(p_error_filepath_with_wildcard):
+        error_filepath = p_error_filepath_with_wildcard if os.path.exists(p_error_filepath_with_wildcard) else ""
+    else:
+        for filepath in glob.glob(p_error_filepath_with_wildcard):
+            error_filepath = filepath
+            break
     if "" == error_filepath:
         return {}
     
@@ -786,6 +2382,98 @@ def read_error_file(p_error_filepath_with_wildcard, p_module_name):
     
     return error_lookup
 
+def read_page_metadata(p_image_filepath):
+
+    '''Width, height, bytes, mode, compression, and mtime of a page image, read from its header.
+    Images that can't be read get an entry with their size, mtime, and the error instead.'''
+
+    size, mtime_ns = get_file_signature(p_image_filepath)
+    try:
+        with Image.open(p_image_filepath) as img:
+            return {
+                "width": img.size[0],
+                "height": img.size[1],
+                "bytes": size,
+                "mode": img.mode,
+                "compression": img.info.get("compression", "N/A"),
+                "mtime_ns": mtime_ns
+            }
+    except (UnidentifiedImageError, OSError) as e:
+        print("Could not read header of {0}: {1}".format(Path(p_image_filepath).name, e))
+        return { "bytes": size, "mtime_ns": mtime_ns, "error": str(e) }
+
+def run_array_task(p_task_manifest_filepath):
+
+    '''Runs the command for this slurm array task (given by SLURM_ARRAY_TASK_ID, or the only task
+    for a job that isn't an array) from a task manifest written by write_task_manifest'''
+
+    # 1. Look up this task in the manifest
+    task_id = int(os.environ.get("SLURM_ARRAY_TASK_ID", 0))
+    with open(p_task_manifest_filepath, "r") as manifest_file:
+        for line_index, line in enumerate(manifest_file):
+            if task_id == line_index:
+                task = json.loads(line)
+                break
+        else:
+            print("ERROR: No task {0} in task manifest {1}".format(task_id, p_task_manifest_filepath))
+            sys.exit(1)
+
+    print("Running array task {0} ({1}) on book directory {2}".format(task_id, task["name"], task["book_directory"]))
+    print(task["command"])
+
+    # 2. Run the task's command and exit with its return code
+    sys.stdout.flush()
+    sys.exit(run_task_command(task))
+
+def run_job_group(p_group_manifest_filepath, p_worker_count):
+
+    '''Runs the commands of a group of packed QAJobs (written by write_task_manifest) with a pool of workers.
+    Each command's output goes to its job's own log file.'''
+
+    with open(p_group_manifest_filepath, "r") as manifest_file:
+        tasks = [json.loads(line) for line in manifest_file]
+
+    def run_task(p_task):
+        print("Running {0} on book directory {1}".format(p_task["name"], p_task["book_directory"]))
+        sys.stdout.flush()
+        with open(p_task["log_filepath"], "w") as log_file:
+            return_code = run_task_command(p_task, log_file)
+        print("{0} ended with return code: {1}".format(p_task["name"], return_code))
+        sys.stdout.flush()
+        return return_code
+
+    # NOTE: Commands are run in their own processes, so threads are enough to run them side by side
+    with ThreadPoolExecutor(max_workers=int(p_worker_count)) as executor:
+        return_codes = list(executor.map(run_task, tasks))
+
+    # Fail the job if any of the group's commands failed
+    sys.exit(max(return_codes) if len(return_codes) else 0)
+
+def run_task_command(p_task, p_log_file=None):
+
+    '''Runs the command of a task from a task manifest, then records its exit status and timings in the run journal'''
+
+    # 1. Run the command (sending its output to a log file if given)
+    start_time = time.time()
+    return_code = subprocess.run(p_task["command"], shell=True, executable="/bin/bash",
+        stdout=p_log_file, stderr=subprocess.STDOUT if p_log_file else None).returncode
+    end_time = time.time()
+
+    # 2. Record that it finished
+    if p_task.get("journal_filepath"):
+        append_journal_record(p_task["journal_filepath"], {
+            "name": p_task["name"],
+            "book_directory": p_task["book_directory"],
+            "exit_status": return_code,
+            "start_time": start_time,
+            "end_time": end_time,
+            "elapsed_seconds": end_time - start_time,
+            "host": socket.gethostname(),
+            "slurm_job_id": os.environ.get("SLURM_JOB_ID", "")
+        })
+
+    return return_code
+
 def scale_image(p_image_filepath, p_scale_factor, p_scale_tag="scaled"):
 
     # 1. Load the image into memory
@@ -850,6 +2538,47 @@ def shootout(p_id_field, p_input_csvs_filepath, p_output_filepath=None):
                 output_file.write(",".join(col_values) + "\n")
     
     
+def stage_file(p_source_filepath, p_destination_directory, p_staging_mode=STAGING_COPY):
+
+    '''Puts a file in the destination directory for other tools to read, returning how it was staged.
+    In 'link' mode that's a hardlink, else a reflink (a copy on write clone), else a symlink, before
+    falling back to a copy. Only copies and reflinks are safe to write to: the others share the original's data.'''
+
+    destination_filepath = os.path.join(p_destination_directory, Path(p_source_filepath).name)
+
+    # 0. Remove a file staged here before (copying onto a link to the original would overwrite the original)
+    if os.path.lexists(destination_filepath):
+        os.unlink(destination_filepath)
+
+    if STAGING_LINK == p_staging_mode:
+
+        # 1. Hardlink
+        try:
+            os.link(p_source_filepath, destination_filepath)
+            return "hardlink"
+        except OSError:
+            pass
+
+        # 2. Reflink (on filesystems that can share data between files, e.g. btrfs and xfs)
+        try:
+            with open(p_source_filepath, "rb") as source_file, open(destination_filepath, "wb") as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            return "reflink"
+        except OSError:
+            if os.path.lexists(destination_filepath):
+                os.unlink(destination_filepath)
+
+        # 3. Symlink
+        try:
+            os.symlink(os.path.abspath(p_source_filepath), destination_filepath)
+            return "symlink"
+        except OSError:
+            pass
+
+    # 4. Copy
+    shutil.copy(p_source_filepath, destination_filepath)
+    return "copy"
+
 def str_to_class(module_name, class_name):
 
     """Return a class instance from a string reference"""
@@ -873,15 +2602,32 @@ def str_to_class(module_name, class_name):
 def traceback_to_str(p_traceback):
 
     '''Makes sure given traceback from exception is in string form'''
-    return " ".join(p_traceback) if isinstance(p_traceback, list) else p_traceback
+    # NOTE: read_error_file returns a list of traceback line lists per image
+    return " ".join([traceback_to_str(item) for item in p_traceback]) if isinstance(p_traceback, list) else p_traceback
 
 def wait_while_exists(p_path):
 
     '''For after uses of unlink or rmtree; waits until passed in item still exists on disk'''
     # Taken from https://stackoverflow.com/questions/21505313/is-there-a-foolproof-way-to-give-the-system-enough-time-to-delete-a-folder-befor
+    # (sleeping between checks rather than spinning)
 
+    poll_seconds = WAIT_WHILE_EXISTS_MIN_SECONDS
     while os.path.exists(p_path):
-        pass
+        time.sleep(poll_seconds)
+        poll_seconds = min(2 * poll_seconds, WAIT_WHILE_EXISTS_MAX_SECONDS)
+
+def write_task_manifest(p_task_manifest_filepath, p_jobs, p_journal_filepath=""):
+
+    '''Writes QAJobs out as json lines for run_array_task and run_job_group'''
+    with open(p_task_manifest_filepath, "w") as manifest_file:
+        for job in p_jobs:
+            manifest_file.write(json.dumps({
+                "name": job.name,
+                "book_directory": job.book_directory,
+                "command": job.command,
+                "log_filepath": job.log_filepath,
+                "journal_filepath": p_journal_filepath
+            }) + "\n")
 
 
 def main(p_args):